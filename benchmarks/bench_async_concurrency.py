@@ -0,0 +1,95 @@
+"""
+Concurrent chats through sync WSGI workers vs one ASGI event loop.
+
+Both sides get the same number of concurrent chats against a slow upstream
+stub. WSGI serves them with a fixed pool of worker threads, each held for
+the whole upstream call; ASGI serves them from a single event loop that
+awaits the upstream call.
+
+    python benchmarks/bench_async_concurrency.py --chats 200 --workers 8 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import quiet, test_database
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import AsyncClient, Client
+
+from benchmarks.stub_openrouter import StubOpenRouter
+from chatBot.services import reset_http_session
+
+BODY = json.dumps({'message': 'Hello'})
+
+
+def report(label, latencies, elapsed):
+    latencies.sort()
+    print(f"{label:>22}: {len(latencies) / elapsed:7.1f} chats/s   "
+          f"p50 {latencies[len(latencies) // 2] * 1000:8.1f} ms   "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:8.1f} ms   "
+          f"wall {elapsed:6.2f} s")
+
+
+# Every chat arrives at the same moment, so latency is measured from the
+# start of the burst and includes any time spent waiting for a worker
+
+def run_wsgi(user, chats, workers):
+    def chat(_):
+        client = Client()
+        client.force_login(user)
+        response = client.post('/send_message/', BODY, content_type='application/json')
+        assert response.json()['status'] == 'success', response.content
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(chat, range(chats)))
+    return latencies, time.perf_counter() - start
+
+
+async def run_asgi(user, chats):
+    client = AsyncClient()
+    await client.aforce_login(user)
+
+    async def chat():
+        response = await client.post('/send_message/', BODY, content_type='application/json')
+        assert response.json()['status'] == 'success', response.content
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(chat() for _ in range(chats)))
+    return list(latencies), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=200, help="Concurrent chats on each side")
+    parser.add_argument('--workers', type=int, default=8, help="WSGI worker threads")
+    parser.add_argument('--latency', type=float, default=0.5, help="Upstream seconds per completion")
+    args = parser.parse_args()
+
+    with test_database(file_backed=True), StubOpenRouter(latency=args.latency) as stub:
+        settings.OPENROUTER_API_URL = stub.url
+        settings.DEEPSEEK_API_KEY = settings.DEEPSEEK_API_KEY or 'benchmark-key'
+        settings.CHAT_RATE_LIMIT_ENABLED = False  # One user sends every chat
+        settings.OPENROUTER_POOL_SIZE = args.workers
+        reset_http_session()
+        user = User.objects.create_user('bench_async', password='bench-pass')
+
+        with quiet():
+            wsgi = run_wsgi(user, args.chats, args.workers)
+            asgi = asyncio.run(run_asgi(user, args.chats))
+
+        report(f"WSGI {args.workers} threads", *wsgi)
+        report("ASGI 1 event loop", *asgi)
+
+
+if __name__ == "__main__":
+    main()
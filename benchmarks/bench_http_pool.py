@@ -0,0 +1,88 @@
+"""
+Per-request latency of a fresh requests.post() vs the shared pooled session.
+
+Runs against the local OpenRouter stub, so the numbers only cover the
+connection setup we save (plain TCP here; real OpenRouter adds TLS on top).
+
+    python benchmarks/bench_http_pool.py --requests 500 --threads 8
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import quiet
+
+import requests
+from django.conf import settings
+
+from benchmarks.stub_openrouter import StubOpenRouter
+from chatBot.services import DeepSeekService, reset_http_session
+
+HISTORY = [{"role": "user", "content": "Hello"}]
+
+
+def fresh_connection_call(url):
+    """What send_message used to do: a new connection per chat turn"""
+    payload = {"model": "deepseek/deepseek-chat", "messages": HISTORY, "stream": False}
+    response = requests.post(url, json=payload, timeout=30)
+    response.json()
+
+
+def pooled_call(url):
+    DeepSeekService.send_message(HISTORY)
+
+
+def run(label, call, url, total, threads, stub):
+    connections_before = stub.connections
+    latencies = []
+
+    def timed(_):
+        start = time.perf_counter()
+        call(url)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(timed, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        'label': label,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'req_per_s': total / elapsed,
+        'connections': stub.connections - connections_before,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    with StubOpenRouter() as stub:
+        settings.OPENROUTER_API_URL = stub.url
+        settings.DEEPSEEK_API_KEY = settings.DEEPSEEK_API_KEY or 'benchmark-key'
+        reset_http_session()
+
+        with quiet():
+            fresh = run('fresh', fresh_connection_call, stub.url, args.requests, args.threads, stub)
+            pooled = run('pooled', pooled_call, stub.url, args.requests, args.threads, stub)
+
+        for result in (fresh, pooled):
+            print(f"{result['label']:>8}: mean {result['mean_ms']:.3f} ms  p50 {result['p50_ms']:.3f} ms  "
+                  f"p99 {result['p99_ms']:.3f} ms  {result['req_per_s']:.0f} req/s  "
+                  f"{result['connections']} TCP connections")
+        print(f"Saved per request: {fresh['mean_ms'] - pooled['mean_ms']:.3f} ms (mean)")
+
+
+if __name__ == "__main__":
+    main()
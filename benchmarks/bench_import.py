@@ -0,0 +1,68 @@
+"""
+Messages per second through import_conversations.
+
+Writes an NDJSON file of synthetic conversations and imports it into a
+throwaway test database (point DATABASES at Postgres to measure that).
+--memory also embeds the messages into memory indexes in a temporary
+directory, as a real import does unless it's run with --no-memory.
+
+    python benchmarks/bench_import.py --conversations 2000 --messages 50 --batch-size 5000
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import test_database
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.core.management import call_command
+from django.db import connection
+
+from chatBot.models import Message
+
+
+def write_input(path, conversations, messages):
+    with open(path, 'w') as f:
+        for c in range(conversations):
+            f.write(json.dumps({'type': 'conversation', 'id': c, 'user': f'bench_import_{c % 100}'}) + '\n')
+            for m in range(messages):
+                f.write(json.dumps({
+                    'type': 'message', 'conversation': c, 'role': 'user' if m % 2 == 0 else 'assistant',
+                    'content': f"Message {m} of conversation {c}: " + 'lorem ipsum dolor ' * 8,
+                    'timestamp': f'2024-01-01T{m // 3600 % 24:02d}:{m // 60 % 60:02d}:{m % 60:02d}Z',
+                }) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=50, help="Messages per conversation")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--memory', action='store_true', help="Add the messages to the memory index too")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, test_database(file_backed=True), \
+            override_settings(CHAT_MEMORY_DIR=directory):
+        path = f"{directory}/bench.ndjson"
+        write_input(path, args.conversations, args.messages)
+        User.objects.bulk_create([User(username=f'bench_import_{u}') for u in range(100)])
+
+        start = time.perf_counter()
+        call_command('import_conversations', path, batch_size=args.batch_size, no_memory=not args.memory,
+                     stdout=io.StringIO())
+        elapsed = time.perf_counter() - start
+
+        total = Message.objects.count()
+        print(f"{total} messages in {args.conversations} conversations, batches of {args.batch_size}, "
+              f"{connection.vendor}{', with memory' if args.memory else ''}")
+        print(f"{elapsed:.2f} s, {total / elapsed:,.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
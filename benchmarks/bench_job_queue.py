@@ -0,0 +1,130 @@
+"""
+Page loads while the web workers are busy with chats: inline vs job queue.
+
+A burst of chats hits a fixed pool of WSGI worker threads, against a slow
+upstream stub, while a steady trickle of page loads (GET /) arrives in the
+same pool. Inline, every chat holds a worker for the whole upstream call
+and the page loads wait behind them. With CHAT_QUEUE_ENABLED the chats only
+insert a job and return; an in-process job Worker with its own threads
+makes the upstream calls, and page loads stay as fast as on an idle server.
+
+    python benchmarks/bench_job_queue.py --chats 64 --workers 8 --job-threads 16 --latency 2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import quiet, test_database
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client
+
+from benchmarks.stub_openrouter import StubOpenRouter
+from chatBot.jobs import Worker
+from chatBot.models import Job
+from chatBot.services import reset_http_session
+
+BODY = json.dumps({'message': 'Hello'})
+
+
+def report(label, latencies):
+    latencies.sort()
+    print(f"{label:>28}: p50 {latencies[len(latencies) // 2] * 1000:8.1f} ms   "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:8.1f} ms   "
+          f"max {latencies[-1] * 1000:8.1f} ms")
+
+
+def run(user, chats, workers, pages, page_interval):
+    """
+    Chats arrive in one burst, page loads one every page_interval seconds.
+    Latency is measured from arrival, so it includes waiting for a worker.
+    Returns (page latencies, chat latencies)
+    """
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = Client()
+            local.client.force_login(user)
+        return local.client
+
+    def chat(arrived):
+        response = client().post('/send_message/', BODY, content_type='application/json')
+        assert response.json()['status'] in ('success', 'queued'), response.content
+        return time.perf_counter() - arrived
+
+    def page(arrived):
+        response = client().get('/')
+        assert response.status_code == 200
+        return time.perf_counter() - arrived
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        chat_futures = [pool.submit(chat, time.perf_counter()) for _ in range(chats)]
+        page_futures = []
+        for _ in range(pages):
+            page_futures.append(pool.submit(page, time.perf_counter()))
+            time.sleep(page_interval)
+        return [f.result() for f in page_futures], [f.result() for f in chat_futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=64, help="Chats in the burst")
+    parser.add_argument('--workers', type=int, default=8, help="WSGI worker threads")
+    parser.add_argument('--job-threads', type=int, default=16, help="Job worker threads (queued run)")
+    parser.add_argument('--latency', type=float, default=2.0, help="Upstream seconds per completion")
+    parser.add_argument('--pages', type=int, default=100, help="Page loads during the burst")
+    parser.add_argument('--page-interval', type=float, default=0.05, help="Seconds between page loads")
+    args = parser.parse_args()
+
+    with test_database(file_backed=True), StubOpenRouter(latency=args.latency) as stub:
+        settings.OPENROUTER_API_URL = stub.url
+        settings.DEEPSEEK_API_KEY = settings.DEEPSEEK_API_KEY or 'benchmark-key'
+        settings.CHAT_RATE_LIMIT_ENABLED = False  # One user sends every chat
+        settings.OPENROUTER_POOL_SIZE = max(args.workers, args.job_threads)
+        settings.CHAT_SUMMARY_ENABLED = False
+        settings.CHAT_MEMORY_ENABLED = False
+        reset_http_session()
+        user = User.objects.create_user('bench_queue', password='bench-pass')
+
+        with quiet():
+            idle_pages, _ = run(user, 0, args.workers, args.pages, args.page_interval)
+
+            settings.CHAT_QUEUE_ENABLED = False
+            inline_pages, inline_chats = run(user, args.chats, args.workers, args.pages, args.page_interval)
+
+            settings.CHAT_QUEUE_ENABLED = True
+            settings.CHAT_QUEUE_MAX_DEPTH = args.chats
+            worker = Worker(threads=args.job_threads, poll_interval=0.05)
+            worker_thread = threading.Thread(target=worker.run)
+            worker_thread.start()
+            start = time.perf_counter()
+            try:
+                queued_pages, queued_chats = run(user, args.chats, args.workers, args.pages, args.page_interval)
+                while Job.objects.exclude(status__in=['done', 'failed']).exists():
+                    time.sleep(0.05)
+                drained = time.perf_counter() - start
+            finally:
+                worker.stop()
+                worker_thread.join()
+
+        done = Job.objects.filter(status='done').count()
+        print(f"{args.chats} chats, {args.workers} WSGI threads, {args.latency} s upstream, "
+              f"{args.pages} page loads")
+        report("page load, idle", idle_pages)
+        report("page load, chats inline", inline_pages)
+        report("page load, chats queued", queued_pages)
+        report("chat response, inline", inline_chats)
+        report("chat response, queued (202)", queued_chats)
+        print(f"{'queued jobs':>28}: {done}/{args.chats} done in {drained:.2f} s "
+              f"by {args.job_threads} job threads")
+
+
+if __name__ == "__main__":
+    main()
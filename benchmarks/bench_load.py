@@ -0,0 +1,324 @@
+"""
+Load test: a realistic mix of chat and browsing requests against a seeded
+database, with the upstream API stubbed.
+
+Virtual users (one thread each, like WSGI worker threads taking requests
+back to back) send a weighted mix of
+
+    send        POST /send_message/
+    history     GET  /api/conversations/history/
+    conversation GET /api/conversations/<id>/
+
+as seeded users with conversations and messages already in the database.
+The stub can add latency from a distribution and fail a share of the
+upstream calls with 500s and 429s (see stub_openrouter.py).
+
+    python benchmarks/bench_load.py --users 8 --requests 2000 --mix send=1,history=6,conversation=3 \\
+        --latency lognormal:0.3,0.5 --error-rate 0.02 --output results.json
+
+Prints a table, and with --output writes the results as JSON ('-' for
+stdout): throughput, p50/p95/p99 latency and database queries per request,
+by endpoint and overall, with the settings of the run, so runs of different
+releases can be compared. The app logs as it would in production, to
+/dev/null, so logging's cost is in the latencies; --log-level changes how
+much it logs, and the records written and dropped are reported.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import quiet, test_database
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from benchmarks.stub_openrouter import StubOpenRouter
+from chatBot import metrics
+from chatBot.importer import insert_conversations
+from chatBot.models import Conversation, Message, make_preview, make_title
+from chatBot.services import reset_http_session
+
+WORDS = ('weather travel python recipe garden budget music history football exam '
+         'holiday kenya coffee science movie health bank phone river market').split()
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def seed(users, conversations, messages, rng):
+    """
+    users with conversations of messages each, spread over the last 60 days.
+    Returns {user id: [conversation ids]}
+    """
+    now = timezone.now()
+    owned = {}
+    for u in range(users):
+        user = User(username=f'load_user_{u}')
+        user.set_unusable_password()  # Logged in with force_login; hashing a password is slow
+        user.save()
+        # The first conversation made for the user on sign up stays empty
+        new = []
+        for _ in range(conversations):
+            updated = now - timedelta(minutes=rng.randrange(60 * 24 * 60))
+            first = sentence(rng)
+            new.append(Conversation(
+                user=user, title=make_title(first), preview_text=make_preview(first), message_count=messages,
+                created_at=updated - timedelta(hours=1), updated_at=updated, last_message_at=updated))
+        insert_conversations(new)
+        Message.objects.bulk_create(
+            (Message(conversation=conversation, role='user' if i % 2 == 0 else 'assistant',
+                     content=sentence(rng, 12 if i % 2 == 0 else 60),
+                     timestamp=conversation.created_at + timedelta(seconds=30 * i))
+             for conversation in new for i in range(messages)),
+            batch_size=2000)
+        owned[user.id] = [c.id for c in new]
+    return owned
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def send(client, rng, conversation_ids):
+    # Every message different, so the response cache doesn't answer them
+    body = json.dumps({'message': f"{sentence(rng, 8)} {rng.random()}"})
+    return client.post('/send_message/', body, content_type='application/json')
+
+
+def history(client, rng, conversation_ids):
+    return client.get('/api/conversations/history/')
+
+
+def conversation(client, rng, conversation_ids):
+    return client.get(f'/api/conversations/{rng.choice(conversation_ids)}/')
+
+
+ENDPOINTS = {'send': send, 'history': history, 'conversation': conversation}
+
+
+def ok(response):
+    if response.status_code >= 400:
+        return False
+    if response.get('Content-Type', '').startswith('application/json'):
+        return response.json().get('status', 'success') != 'error'
+    return True
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, user_id, conversation_ids, mix, requests, warmup, seed):
+        super().__init__()
+        self.user_id = user_id
+        self.conversation_ids = conversation_ids
+        self.mix = mix
+        self.requests = requests
+        self.warmup = warmup
+        self.rng = random.Random(seed)
+        self.samples = []  # (endpoint, seconds, queries, ok, status)
+        self.error = None
+
+    def run(self):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        try:
+            client = Client()
+            client.force_login(User.objects.get(pk=self.user_id))
+            names, weights = list(self.mix), list(self.mix.values())
+            # Views run in this thread (async ones via async_to_sync, their
+            # ORM calls back on it), so this sees every query they make
+            with connection.execute_wrapper(count):
+                for n in range(self.warmup + self.requests):
+                    name = self.rng.choices(names, weights)[0]
+                    queries = 0
+                    start = time.perf_counter()
+                    response = ENDPOINTS[name](client, self.rng, self.conversation_ids)
+                    elapsed = time.perf_counter() - start
+                    if n >= self.warmup:
+                        self.samples.append((name, elapsed, queries, ok(response), response.status_code))
+        except Exception as e:  # Reported by main(), not lost in the thread
+            self.error = e
+        finally:
+            connection.close()
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list"""
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summarise(samples, elapsed):
+    latencies = sorted(s[1] for s in samples)
+    queries = [s[2] for s in samples]
+    statuses = {}
+    for s in samples:
+        statuses[str(s[4])] = statuses.get(str(s[4]), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if not s[3]),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            **{f'p{p}': round(percentile(latencies, p) * 1000, 2) if latencies else None for p in (50, 95, 99)},
+            'max': round(latencies[-1] * 1000, 2) if latencies else None,
+        },
+        'queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'max': max(queries, default=None),
+        },
+        'status_codes': statuses,
+    }
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def log_records():
+    return {labels[0]: count for labels, count in metrics.LOG_RECORDS.snapshot()}
+
+
+def print_table(results, file):
+    def cell(value, width):
+        return f"{'-' if value is None else value:>{width}}"
+
+    print(f"{results['config']['users']} virtual users, {results['elapsed_s']} s", file=file)
+    print(f"{'endpoint':>14} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'queries':>8}", file=file)
+    for name, row in [*results['endpoints'].items(), ('all', results['overall'])]:
+        latency = row['latency_ms']
+        print(f"{name:>14} {row['requests']:>9} {row['errors']:>7} {cell(row['throughput_rps'], 8)} "
+              f"{cell(latency['p50'], 9)} {cell(latency['p95'], 9)} {cell(latency['p99'], 9)} "
+              f"{cell(row['queries_per_request']['mean'], 8)}", file=file)
+    stub = results['upstream']
+    print(f"upstream: {stub['requests']} calls, failures injected {stub['failures']}", file=file)
+    logged = results['logging']
+    print(f"logging: {logged['records']} records at {logged['level']}, {logged['dropped']} dropped", file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8, help="Virtual users sending at once")
+    parser.add_argument('--requests', type=int, default=1000, help="Requests measured, across all users")
+    parser.add_argument('--warmup', type=int, default=5, help="Requests per user before measuring")
+    parser.add_argument('--mix', type=parse_mix, default='send=1,history=6,conversation=3',
+                        help="Endpoint weights")
+    parser.add_argument('--seed-users', type=int, default=50, help="Users in the seeded database")
+    parser.add_argument('--conversations', type=int, default=20, help="Conversations per seeded user")
+    parser.add_argument('--messages', type=int, default=40, help="Messages per seeded conversation")
+    parser.add_argument('--latency', default='lognormal:0.3,0.5', help="Upstream latency, seconds or a spec")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="Upstream seconds between words")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of upstream calls failing with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of upstream calls failing with 429")
+    parser.add_argument('--rate-limit', action='store_true', help="Keep the app's per-user rate limits on")
+    parser.add_argument('--log-level', default=settings.CHAT_LOG_LEVEL, help="Level of the chatBot loggers")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the data, the mix and the stub")
+    parser.add_argument('--output', help="Write the results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    memory_dir = tempfile.TemporaryDirectory()
+    with test_database(file_backed=True), memory_dir, \
+            StubOpenRouter(latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate,
+                           rate_limit_rate=args.rate_limit_rate, seed=args.seed) as stub:
+        settings.OPENROUTER_API_URL = stub.url
+        settings.DEEPSEEK_API_KEY = settings.DEEPSEEK_API_KEY or 'benchmark-key'
+        settings.OPENROUTER_POOL_SIZE = args.users
+        # Replayed traffic is far denser than a person's: limits would only measure the 429s
+        settings.CHAT_RATE_LIMIT_ENABLED = args.rate_limit
+        settings.CHAT_MEMORY_DIR = memory_dir.name
+        reset_http_session()
+        logging.getLogger('chatBot').setLevel(args.log_level)
+
+        rng = random.Random(args.seed)
+        start = time.perf_counter()
+        owned = seed(args.seed_users, args.conversations, args.messages, rng)
+        seeded = time.perf_counter() - start
+        connection.close()  # The threads open their own
+
+        users = list(owned)
+        per_user, extra = divmod(args.requests, args.users)
+        threads = [VirtualUser(users[n % len(users)], owned[users[n % len(users)]], args.mix,
+                               per_user + (n < extra), args.warmup, rng.random())
+                   for n in range(args.users)]
+        logged = log_records()
+        with quiet():
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        logged = {result: count - logged.get(result, 0) for result, count in log_records().items()}
+        for thread in threads:
+            if thread.error:
+                raise thread.error
+
+        samples = [sample for thread in threads for sample in thread.samples]
+        results = {
+            'config': {
+                'users': args.users, 'requests': args.requests, 'warmup': args.warmup, 'mix': args.mix,
+                'seed_users': args.seed_users, 'conversations': args.conversations, 'messages': args.messages,
+                'latency': str(stub.server.latency), 'token_delay': args.token_delay,
+                'error_rate': args.error_rate, 'rate_limit_rate': args.rate_limit_rate,
+                'rate_limit': args.rate_limit, 'log_level': args.log_level, 'seed': args.seed,
+            },
+            'environment': {
+                'revision': revision(), 'python': platform.python_version(), 'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'seed_s': round(seeded, 2),
+            'elapsed_s': round(elapsed, 2),
+            'endpoints': {name: summarise([s for s in samples if s[0] == name], elapsed)
+                          for name in args.mix},
+            'overall': summarise(samples, elapsed),
+            'upstream': {'requests': stub.requests, 'failures': stub.failures},
+            'logging': {'level': args.log_level, 'records': logged.get('queued', 0),
+                        'dropped': logged.get('dropped', 0)},
+        }
+
+    # The JSON alone on stdout when it goes there
+    print_table(results, sys.stderr if args.output == '-' else sys.stdout)
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
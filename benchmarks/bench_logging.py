@@ -0,0 +1,129 @@
+"""
+Cost of logging on the request path.
+
+Logs a chat.turn-like record (a message, a request id and a dozen extra
+fields) over and over, from one thread or several, to an output that takes
+--sink-delay seconds per write, standing in for a log collector that has
+fallen behind, and times what the logging threads wait for:
+
+    print           a print() of the same text straight to the output, as the
+                    request path used to
+    blocking        a StreamHandler with the JSON formatter on the output
+    queued          QueueJsonHandler: the record is queued and a background
+                    thread formats and writes it (the project's setup)
+
+With a slow output the queue fills and records are dropped rather than
+waited for; the number dropped is printed with the timings.
+
+    python benchmarks/bench_logging.py --records 20000 --threads 4 --sink-delay 0.0005
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmarks.common  # noqa: F401  (sets up Django)
+
+from chatBot import logs, metrics
+
+
+class SlowSink:
+    """A file-like output that takes delay seconds per write"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+def turn_fields(n):
+    return {
+        'event': 'chat.turn', 'outcome': 'ok', 'conversation_id': n, 'user_id': 7, 'messages_sent': 24,
+        'total_ms': 812.4, 'db_read_ms': 4.1, 'upstream_ms': 803.0, 'db_write_ms': 5.3, 'reply_chars': 1310,
+    }
+
+
+def run_threads(work, threads, records):
+    per_thread = records // threads
+    workers = [threading.Thread(target=work, args=(per_thread,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start, per_thread * threads
+
+
+def bench_print(sink, threads, records):
+    def work(n):
+        for i in range(n):
+            fields = turn_fields(i)
+            print(f"Chat turn ok: {fields}", file=sink)
+    return run_threads(work, threads, records)
+
+
+def bench_handler(handler, threads, records):
+    logger = logging.getLogger('bench.logging')
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler.addFilter(logs.RequestIdFilter())
+
+    def work(n):
+        logs.set_request_id()
+        for i in range(n):
+            logger.info("Chat turn %s", 'ok', extra=turn_fields(i))
+    try:
+        return run_threads(work, threads, records)
+    finally:
+        logger.handlers = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000, help="Records logged, across all threads")
+    parser.add_argument('--threads', type=int, default=4, help="Threads logging at once")
+    parser.add_argument('--sink-delay', type=float, default=0.0005, help="Seconds the output takes per write")
+    parser.add_argument('--queue-size', type=int, default=10000, help="QueueJsonHandler's queue size")
+    args = parser.parse_args()
+
+    print(f"{args.records} records from {args.threads} threads, {args.sink_delay * 1e6:.0f} us per write")
+    results = []
+
+    elapsed, n = bench_print(SlowSink(args.sink_delay), args.threads, args.records)
+    results.append(('print', elapsed, n, ''))
+
+    blocking = logging.StreamHandler(SlowSink(args.sink_delay))
+    blocking.setFormatter(logs.JsonFormatter())
+    elapsed, n = bench_handler(blocking, args.threads, args.records)
+    results.append(('blocking', elapsed, n, ''))
+
+    metrics.reset()
+    target = logging.StreamHandler(SlowSink(args.sink_delay))
+    target.setFormatter(logs.JsonFormatter())
+    queued = logs.QueueJsonHandler(queue_size=args.queue_size, target=target)
+    elapsed, n = bench_handler(queued, args.threads, args.records)
+    counts = dict((labels[0], count) for labels, count in metrics.LOG_RECORDS.snapshot())
+    results.append(('queued', elapsed, n, f"{counts.get('dropped', 0)} dropped"))
+    drain = time.perf_counter()
+    queued.close()  # Waits for the writer to catch up, which isn't on the request path
+    drain = time.perf_counter() - drain
+
+    for label, elapsed, n, note in results:
+        print(f"{label:>10}: {elapsed / n * 1e6:9.1f} us per record ({elapsed:.2f} s until the logging "
+              f"threads were done) {note}")
+    print(f"{'':>10}  writer thread drained the rest in {drain:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
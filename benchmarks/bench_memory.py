@@ -0,0 +1,63 @@
+"""
+Search latency of the per-user vector memory at a given index size.
+
+    python benchmarks/bench_memory.py --messages 100000 --dim 64
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmarks.common  # noqa: F401  (sets up Django)
+
+from django.test import override_settings
+
+from chatBot.memory import EmbeddingIndex, HashingEmbedder
+
+WORDS = ("dog cat garden travel Nairobi recipe budget python django music football "
+         "sister birthday doctor coffee rain exam salary holiday phone laptop").split()
+
+
+def sentence(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 30)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=64)
+    parser.add_argument('--searches', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=1000, help="Messages appended per write")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as memory_dir, override_settings(CHAT_MEMORY_DIR=memory_dir):
+        index = EmbeddingIndex(1, HashingEmbedder(dim=args.dim))
+
+        start = time.perf_counter()
+        for offset in range(0, args.messages, args.batch):
+            count = min(args.batch, args.messages - offset)
+            index.append(range(offset, offset + count), [1] * count, [sentence(rng) for _ in range(count)])
+        append_s = time.perf_counter() - start
+
+        queries = [sentence(rng) for _ in range(args.searches)]
+        index.search(queries[0], k=4)  # Map the file once
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, k=4, exclude_ids=range(20))
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+        size_mb = os.path.getsize(index.vectors_path) / 1e6
+        print(f"index: {len(index)} vectors x {args.dim} dims float32 ({size_mb:.1f} MB), "
+              f"appended at {args.messages / append_s:,.0f} msgs/s")
+        print(f"search: p50 {timings[len(timings) // 2] * 1000:.3f} ms   "
+              f"p99 {timings[int(len(timings) * 0.99) - 1] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
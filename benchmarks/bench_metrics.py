@@ -0,0 +1,74 @@
+"""
+Cost of recording metrics on the hot path.
+
+Times one histogram observation and one counter increment, from one thread
+and from several contending for the lock, and the whole of what
+MetricsMiddleware adds to a request (start, per-query timing of a few
+queries, finish), without any request around it.
+
+    python benchmarks/bench_metrics.py --observations 200000 --threads 8
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmarks.common  # noqa: F401  (sets up Django)
+
+from chatBot import metrics
+
+QUERIES_PER_REQUEST = 6
+
+
+def per_call(label, calls, elapsed):
+    print(f"{label:>34}: {elapsed / calls * 1e9:8.0f} ns per call")
+
+
+def observe(n):
+    for i in range(n):
+        metrics.REQUEST_DURATION.observe(0.02, 'conversation_history', 'GET')
+
+
+def request_overhead(n):
+    execute = lambda sql, params, many, context: None  # noqa: E731
+    for _ in range(n):
+        token = metrics.start_request()
+        for _ in range(QUERIES_PER_REQUEST):
+            metrics._time_query(execute, 'SELECT 1', (), False, {})
+        metrics.finish_request(token, 'conversation_history', 'GET', 200, 0.02)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--observations', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    n = args.observations
+
+    start = time.perf_counter()
+    observe(n)
+    per_call("histogram observe", n, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(n):
+        metrics.REQUESTS.inc('conversation_history', 'GET', '200')
+    per_call("counter inc", n, time.perf_counter() - start)
+
+    threads = [threading.Thread(target=observe, args=(n // args.threads,)) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    per_call(f"histogram observe, {args.threads} threads", n, time.perf_counter() - start)
+
+    requests = n // 10
+    start = time.perf_counter()
+    request_overhead(requests)
+    per_call(f"request ({QUERIES_PER_REQUEST} queries)", requests, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Cost of request profiling, off and on.
+
+Times what ProfilingMiddleware and the SQL hook add to a request that
+isn't profiled (the common case: it should be next to nothing) and to one
+that is, then the same GET /api/conversations/history/ end to end, plain
+and with X-Profile from a staff user (which includes saving the profile).
+
+    python benchmarks/bench_profiling.py --calls 200000 --requests 300
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import test_database
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client, RequestFactory
+
+from chatBot import profiling
+from chatBot.middleware import ProfilingMiddleware
+from chatBot.models import RequestProfile
+
+QUERIES_PER_REQUEST = 6
+
+
+def per_call(label, calls, elapsed, unit=1e9, unit_name='ns'):
+    print(f"{label:>34}: {elapsed / calls * unit:8.1f} {unit_name} per call")
+
+
+def hook(n, profile=None):
+    execute = lambda sql, params, many, context: None  # noqa: E731
+    token = profiling.activate(profile) if profile else None
+    try:
+        for _ in range(n):
+            profiling._capture_query(execute, 'SELECT 1 WHERE 1 = %s', (1,), False, {})
+    finally:
+        if token:
+            profiling.deactivate(token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200000, help="Calls of the hooks timed")
+    parser.add_argument('--requests', type=int, default=300, help="Requests timed, each way")
+    args = parser.parse_args()
+    n = args.calls
+
+    start = time.perf_counter()
+    hook(n)
+    per_call("SQL hook, not profiling", n, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    hook(n, profiling.Profile('sample'))
+    per_call("SQL hook, profiling", n, time.perf_counter() - start)
+
+    middleware = ProfilingMiddleware(lambda request: None)
+    request = RequestFactory().get('/api/conversations/history/')
+    start = time.perf_counter()
+    for _ in range(n):
+        middleware(request)
+    per_call("middleware, not profiling", n, time.perf_counter() - start)
+
+    with test_database():
+        staff = User.objects.create_user('bench_staff', is_staff=True)
+        client = Client()
+        client.force_login(staff)
+        for headers, label in (({}, "request, not profiled"), ({'X-Profile': '1'}, "request, profiled")):
+            client.get('/api/conversations/history/', headers=headers)  # Warm up
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                client.get('/api/conversations/history/', headers=headers)
+            per_call(label, args.requests, time.perf_counter() - start, 1e6, 'us')
+        print(f"{RequestProfile.objects.count()} profiles kept (CHAT_PROFILE_KEEP={settings.CHAT_PROFILE_KEEP})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Cost of the per-user rate limit check on each chat request.
+
+Times RateLimiter.check() plus the slot release, the cache work every chat
+request pays, against the cache backend in CACHES (locmem unless
+configured), spread over many users as in production.
+
+    python benchmarks/bench_rate_limit.py --checks 20000 --users 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmarks.common  # noqa: F401  (sets up Django)
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import override_settings
+
+from chatBot.ratelimit import get_rate_limiter
+
+
+def report(label, latencies):
+    latencies.sort()
+    print(f"{label:>20}: p50 {latencies[len(latencies) // 2] * 1e6:7.1f} us   "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1e6:7.1f} us   "
+          f"max {latencies[-1] * 1e6:7.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checks', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    # Every check is admitted, so each one does the full set of cache calls
+    with override_settings(CHAT_RATE_LIMIT_PER_MINUTE=10 ** 6, CHAT_RATE_LIMIT_BURST=10 ** 6):
+        limiter = get_rate_limiter()
+        caches[settings.CHAT_RATE_LIMIT_ALIAS].clear()
+        admitted, denied = [], []
+        for i in range(args.checks):
+            user_id = i % args.users
+            start = time.perf_counter()
+            limited = limiter.check(user_id)
+            limiter.release_slot(user_id)
+            admitted.append(time.perf_counter() - start)
+            assert limited is None, limited
+
+        with override_settings(CHAT_RATE_LIMIT_CONCURRENT=0):
+            for i in range(args.checks):
+                start = time.perf_counter()
+                limiter.check(i % args.users)
+                denied.append(time.perf_counter() - start)
+
+    backend = settings.CACHES[settings.CHAT_RATE_LIMIT_ALIAS]['BACKEND'].rsplit('.', 1)[-1]
+    print(f"{args.checks} checks over {args.users} users, {backend}")
+    report("admitted + release", admitted)
+    report("denied", denied)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Time-to-first-token of /send_message/ (blocking) vs /send_message/stream/.
+
+The stub "generates" the reply word by word, so the blocking endpoint only
+answers once every word is done while the stream shows the first one early.
+
+    python benchmarks/bench_streaming.py --turns 10 --words 100 --token-delay 0.02
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import quiet, test_database
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client
+
+from benchmarks.stub_openrouter import StubOpenRouter
+from chatBot.services import reset_http_session
+
+
+def blocking_turn(client):
+    start = time.perf_counter()
+    response = client.post('/send_message/', json.dumps({'message': 'Hello'}), content_type='application/json')
+    assert response.json()['status'] == 'success'
+    elapsed = time.perf_counter() - start
+    # Nothing is shown until the whole reply arrives
+    return elapsed, elapsed
+
+
+def streaming_turn(client):
+    start = time.perf_counter()
+    response = client.post('/send_message/stream/', json.dumps({'message': 'Hello'}), content_type='application/json')
+    first_token = None
+    for chunk in response.streaming_content:
+        if first_token is None and b'event: token' in chunk:
+            first_token = time.perf_counter() - start
+    response.close()
+    return first_token, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=10)
+    parser.add_argument('--words', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.2, help="Upstream delay before the first word")
+    parser.add_argument('--token-delay', type=float, default=0.02, help="Upstream delay between words")
+    args = parser.parse_args()
+
+    reply = ' '.join(f"word{i}" for i in range(args.words))
+    with test_database(), StubOpenRouter(latency=args.latency, token_delay=args.token_delay, reply=reply) as stub:
+        settings.OPENROUTER_API_URL = stub.url
+        settings.DEEPSEEK_API_KEY = settings.DEEPSEEK_API_KEY or 'benchmark-key'
+        settings.CHAT_RATE_LIMIT_ENABLED = False  # One user sends every chat
+        reset_http_session()
+
+        client = Client()
+        client.force_login(User.objects.create_user('bench_streaming', password='bench-pass'))
+
+        for label, turn in (('blocking', blocking_turn), ('stream', streaming_turn)):
+            with quiet():
+                results = [turn(client) for _ in range(args.turns)]
+            ttft = statistics.mean(first for first, _ in results) * 1000
+            total = statistics.mean(full for _, full in results) * 1000
+            print(f"{label:>8}: time to first token {ttft:8.1f} ms   full reply {total:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
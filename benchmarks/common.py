@@ -0,0 +1,57 @@
+"""
+Shared setup for the benchmark scripts
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatBot_project.settings')
+django.setup()
+
+
+@contextmanager
+def test_database(file_backed=False):
+    """
+    Run the benchmark against a throwaway test database, never db.sqlite3.
+    SQLite test databases live in memory; pass file_backed=True when many
+    threads write at once.
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    if file_backed and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = f"{old_name}.bench"
+        # Benchmarks measure the app, not fsync
+        connection.settings_dict['OPTIONS']['init_command'] = "PRAGMA journal_mode=WAL; PRAGMA synchronous=OFF"
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        test_name = connection.settings_dict['NAME']
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if file_backed and connection.vendor == 'sqlite':
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(f"{test_name}{suffix}"):
+                    os.remove(f"{test_name}{suffix}")
+
+
+@contextmanager
+def quiet():
+    """
+    Send the request path's log output to /dev/null while measuring. It is
+    still formatted and written (see chatBot/logs.py), so its cost is part
+    of what is measured
+    """
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
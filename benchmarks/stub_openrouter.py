@@ -0,0 +1,228 @@
+"""
+Local stand-in for the OpenRouter /chat/completions API.
+
+Benchmarks point OPENROUTER_API_URL at this server so they never spend
+credits or depend on the network. Besides a fixed delay it can draw each
+request's latency from a distribution (see Latency) and answer a share of
+requests with a 500 or a 429, to see how the app holds up when the real
+API misbehaves.
+"""
+import json
+import math
+import random
+import threading
+import time
+
+
+class Latency:
+    """
+    Seconds a request waits before its reply starts, drawn per request.
+    Built from a spec string:
+
+        0.2                   always 0.2 s
+        uniform:0.1,0.5       anywhere between 0.1 and 0.5 s
+        normal:0.3,0.05       mean 0.3 s, standard deviation 0.05 (never below 0)
+        lognormal:0.3,0.6     median 0.3 s, sigma 0.6: mostly quick, a long tail
+        exponential:0.3       mean 0.3 s
+    """
+    KINDS = {
+        'fixed': lambda rng, value: value,
+        'uniform': lambda rng, low, high: rng.uniform(low, high),
+        'normal': lambda rng, mean, sd: max(rng.gauss(mean, sd), 0.0),
+        'lognormal': lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma) if median else 0.0,
+        'exponential': lambda rng, mean: rng.expovariate(1 / mean) if mean else 0.0,
+    }
+
+    def __init__(self, kind='fixed', *params):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.params = [float(p) for p in params] or [0.0]
+
+    @classmethod
+    def parse(cls, spec):
+        if isinstance(spec, cls):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls('fixed', spec)
+        kind, _, params = spec.partition(':')
+        if not params:
+            return cls('fixed', kind)
+        return cls(kind, *params.split(','))
+
+    def sample(self, rng):
+        return self.KINDS[self.kind](rng, *self.params)
+
+    def __str__(self):
+        return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive between requests
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without TCP_NODELAY a
+    # kept-alive connection stalls on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # One handler instance per TCP connection, so this counts handshakes
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        # One draw per request from the shared, seeded generator
+        with self.server.lock:
+            self.server.requests += 1
+            latency = self.server.latency.sample(self.server.random)
+            fault = self.server.random.random()
+        if latency:
+            time.sleep(latency)
+
+        # Failures come before any of the reply, as OpenRouter's do
+        if fault < self.server.rate_limit_rate:
+            self.send_error_reply(429, "Rate limit exceeded", {'Retry-After': str(self.server.retry_after)})
+            return
+        if fault < self.server.rate_limit_rate + self.server.error_rate:
+            self.send_error_reply(500, "Internal server error")
+            return
+
+        if payload.get('stream'):
+            self.stream_reply(payload)
+            return
+
+        # A blocking completion takes as long as streaming every word would
+        time.sleep(self.server.token_delay * (len(self.server.reply.split(' ')) - 1))
+        body = json.dumps({
+            'id': 'stub-completion',
+            'model': payload.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.server.reply},
+                'finish_reason': 'stop',
+            }],
+        }).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_reply(self, status, message, headers=None):
+        with self.server.lock:
+            self.server.failures[status] = self.server.failures.get(status, 0) + 1
+        body = json.dumps({'error': {'code': status, 'message': message}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_reply(self, payload):
+        """Send the reply word by word as chunked SSE, like OpenRouter's stream: true"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        words = self.server.reply.split(' ')
+        for index, word in enumerate(words):
+            if index and self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            chunk = {
+                'model': payload.get('model', 'stub'),
+                'choices': [{'index': 0, 'delta': {'content': word if index == 0 else ' ' + word}}],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+
+class StubOpenRouter:
+    """
+    Run the stub API on a background thread: ``with StubOpenRouter() as stub:``
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, reply='Stub reply', token_delay=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+        self.server = ThreadingHTTPServer((host, port), StubHandler)
+        self.server.daemon_threads = True
+        self.server.latency = Latency.parse(latency)  # Seconds, or a Latency spec string
+        self.server.reply = reply
+        self.server.token_delay = token_delay
+        self.server.error_rate = error_rate  # Share of requests answered with a 500
+        self.server.rate_limit_rate = rate_limit_rate  # Share answered with a 429
+        self.server.retry_after = retry_after  # The 429s' Retry-After, in seconds
+        self.server.random = random.Random(seed)
+        self.server.connections = 0
+        self.server.requests = 0
+        self.server.failures = {}  # Status code to count
+        self.server.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def connections(self):
+        return self.server.connections
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def failures(self):
+        return dict(self.server.failures)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/v1/chat/completions"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local OpenRouter stub")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='0', help="Seconds to wait before replying, or a Latency spec")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="Seconds between streamed words")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of requests answered with a 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After of the 429s, in seconds")
+    parser.add_argument('--seed', type=int, help="Seed for the latency and failure draws")
+    args = parser.parse_args()
+
+    stub = StubOpenRouter(port=args.port, latency=args.latency, token_delay=args.token_delay,
+                          error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                          retry_after=args.retry_after, seed=args.seed)
+    print(f"Stub OpenRouter listening on {stub.url}")
+    stub.server.serve_forever()
@@ -1,32 +1,117 @@
 from django.contrib import admin
-from .models import Conversation, Message, ContactMessage
+from django.utils.html import format_html, format_html_join
+from .models import Conversation, Message, ContactMessage, Job, RequestProfile
+from .search import matching_messages
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
     list_display = ['user', 'title', 'message_count', 'created_at', 'updated_at', 'is_active']
     list_filter = ['is_active', 'created_at', 'updated_at', 'user']
-    search_fields = ['title', 'user__username', 'messages__content']
-    readonly_fields = ['created_at', 'updated_at']
+    # Message content is searched through the full-text index, below
+    search_fields = ['title', 'user__username']
     list_editable = ['is_active', 'title']
     list_per_page = 25
-    
-    def message_count(self, obj):
-        return obj.messages.count()
-    message_count.short_description = 'Messages'
+    readonly_fields = ['created_at', 'updated_at', 'message_count', 'preview_text', 'last_message_at']
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        # Only what was edited: a full save() would write back the counters as
+        # they were when the page loaded, over any turn saved since
+        obj.save(update_fields=[*form.changed_data, 'updated_at'])
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            # A subquery, not a join: one row per conversation however many messages match
+            results |= queryset.filter(id__in=matching_messages(search_term).values('conversation_id'))
+        return results, may_have_duplicates
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ['conversation', 'role', 'content_preview', 'timestamp']
     list_filter = ['role', 'timestamp', 'conversation__user']
-    search_fields = ['content', 'conversation__title', 'conversation__user__username']
+    # Content is searched through the full-text index, below
+    search_fields = ['conversation__title', 'conversation__user__username']
     readonly_fields = ['timestamp']
     list_per_page = 50
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= queryset.filter(id__in=matching_messages(search_term).values('id'))
+        return results, may_have_duplicates
     
     def content_preview(self, obj):
         return obj.content[:75] + '...' if len(obj.content) > 75 else obj.content
     content_preview.short_description = 'Content'
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'user', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'kind']
+    search_fields = ['user__username', 'error']
+    readonly_fields = ['created_at', 'started_at', 'heartbeat_at', 'finished_at', 'lock_token', 'attempts']
+    list_per_page = 50
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Profiles are written by ProfilingMiddleware (see profiling.py) and only read here"""
+    list_display = ['created_at', 'method', 'path', 'status', 'duration_ms', 'query_count', 'duplicate_queries',
+                    'query_ms', 'upstream_ms', 'user', 'trigger']
+    list_filter = ['trigger', 'view', 'method']
+    search_fields = ['path', 'request_id', 'user__username']
+    list_per_page = 50
+    fields = ['created_at', 'request_id', 'user', 'method', 'path', 'view', 'status', 'trigger', 'duration_ms',
+              'query_count', 'query_ms', 'duplicate_queries', 'upstream_ms', 'repeated_queries', 'queries',
+              'upstream_calls', 'sections', 'stacks']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def repeated_queries(self, obj):
+        """The same SQL run more than once, the costliest first: duplicates had the same parameters too"""
+        return _table(['Runs', 'Duplicates', 'ms', 'SQL'],
+                      [(g['count'], g['duplicates'], g['ms'], g['sql']) for g in obj.data.get('repeated', [])])
+
+    def queries(self, obj):
+        rows = [(q['ms'], q['sql']) for q in obj.data.get('queries', [])]
+        if obj.data.get('queries_not_stored'):
+            rows.append(('', f"... and {obj.data['queries_not_stored']} more"))
+        return _table(['ms', 'SQL'], rows)
+
+    def upstream_calls(self, obj):
+        return _table(['Model', 'ms', 'Error'],
+                      [(c['model'], c['ms'], c['code'] or '') for c in obj.data.get('upstream', [])])
+
+    def sections(self, obj):
+        return _table(['Section', 'ms'], list(obj.data.get('sections', {}).items()))
+
+    def stacks(self, obj):
+        """Collapsed stacks: save as text for flamegraph.pl or speedscope"""
+        if 'stacks' not in obj.data:
+            return 'Not sampled'
+        lines = [f"{stack} {count}" for stack, count in obj.data['stacks']]
+        return format_html('<p>Every {} s</p><pre>{}</pre>', obj.data['stack_interval'], '\n'.join(lines))
+
+
+def _table(headings, rows):
+    if not rows:
+        return '-'
+    return format_html(
+        '<table><thead><tr>{}</tr></thead><tbody>{}</tbody></table>',
+        format_html_join('', '<th>{}</th>', ((h,) for h in headings)),
+        format_html_join('', '<tr>{}</tr>',
+                         ((format_html_join('', '<td>{}</td>', ((cell,) for cell in row)),) for row in rows)),
+    )
+
+
 @admin.register(ContactMessage)
 class ContactMessageAdmin(admin.ModelAdmin):
     """
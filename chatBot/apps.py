@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ChatbotAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatBot'
+
+    def ready(self):
+        # Instruments database connections as they're made (see metrics.py)
+        from . import metrics  # noqa: F401
+        # Register the checks that the full-text index is all there and that
+        # the rate limits and circuits are shared between processes
+        from . import ratelimit, search  # noqa: F401
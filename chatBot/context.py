@@ -0,0 +1,173 @@
+"""
+Build the context sent to OpenRouter for one chat turn.
+
+A conversation never ends, so instead of sending every message we walk back
+from the newest one and keep whole turns until the token budget is spent.
+Only the tail of the conversation is queried, a small batch at a time.
+Turns already folded into the conversation's rolling summary (see
+summaries.py) are not walked at all; the summary stands in for them.
+When vector memory is on, a slice of the budget is kept for older turns
+recalled by similarity to the newest message (see memory.py).
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .memory import recall
+from .models import ConversationSummary, Message
+
+# Rough but cheap: English text averages about four characters per token
+CHARS_PER_TOKEN = 4
+# Role name and separators the API adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# How many messages to pull per query while walking back from the newest
+BATCH_SIZE = 50
+
+
+def estimate_tokens(text):
+    """Estimate the tokens one message costs without a tokenizer"""
+    return tokens_for_length(len(text))
+
+
+def tokens_for_length(length):
+    """Same estimate from a character count (e.g. a Length() annotation)"""
+    return length // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_budget():
+    """Tokens available for history: the context size minus room for the reply"""
+    return settings.CHAT_CONTEXT_TOKENS - settings.CHAT_MAX_TOKENS
+
+
+def recall_budget():
+    """Tokens kept aside for recalled turns"""
+    return settings.CHAT_MEMORY_TOKENS if settings.CHAT_MEMORY_ENABLED else 0
+
+
+class ContextWindow:
+    """
+    Collects messages newest-first until the budget is spent. The rolling
+    summary, when there is one, is charged to the budget up front.
+    """
+
+    def __init__(self, budget=None, summary='', summarized_through_id=0):
+        self.budget = context_budget() - recall_budget() if budget is None else budget
+        self.summary = summary
+        self.summarized_through_id = summarized_through_id
+        self.tokens = estimate_tokens(summary) if summary else 0
+        self.full = False
+        self._newest_first = []
+        self.recalled = []
+
+    def add(self, message):
+        """Add the next older message; returns False once it no longer fits"""
+        cost = estimate_tokens(message.content)
+        # The newest message (what the user just said) always goes in
+        if self._newest_first and self.tokens + cost > self.budget:
+            self.full = True
+            return False
+        self.tokens += cost
+        self._newest_first.append(message)
+        return True
+
+    @property
+    def messages(self):
+        """The kept messages, oldest first as the API expects"""
+        return self._newest_first[::-1]
+
+    def recall_query(self):
+        """(text to search for, ids already in the window)"""
+        newest = self._newest_first[0]
+        return newest.content, [message.id for message in self._newest_first if message.id is not None]
+
+    def add_recalled(self, message_ids, messages):
+        """Keep recalled messages, best match first, while they fit the recall budget"""
+        by_id = {message.id: message for message in messages}
+        tokens = 0
+        for message_id in message_ids:
+            message = by_id.get(message_id)
+            if message is None:  # Deleted, or its conversation was
+                continue
+            tokens += estimate_tokens(message.content)
+            if tokens > recall_budget():
+                break
+            self.recalled.append(message)
+
+
+def _summary_query(conversation_id):
+    return ConversationSummary.objects.filter(conversation_id=conversation_id).values_list(
+        'content', 'summarized_through_at', 'summarized_through_id')
+
+
+def unsummarized(conversation_id, through_at, through_id):
+    """
+    The conversation's messages after the summary's watermark. Compared as
+    (timestamp, id), the order the summary walks: ids alone don't follow
+    timestamps when turns are saved concurrently
+    """
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    return messages if through_at is None else messages.after(through_at, through_id)
+
+
+def _tail(conversation_id, through_at, through_id, offset):
+    return (unsummarized(conversation_id, through_at, through_id)
+            .order_by('-timestamp', '-id')
+            .only('id', 'role', 'content', 'timestamp')[offset:offset + BATCH_SIZE])
+
+
+def _recalled(user_id, message_ids):
+    return Message.objects.filter(
+        id__in=message_ids, conversation__user_id=user_id, conversation__is_active=True
+    ).only('id', 'role', 'content')
+
+
+def build_context(conversation_id, budget=None, user_id=None, pending=None):
+    """
+    Return a ContextWindow holding the conversation summary, the newest
+    messages after it that fit in the token budget (oldest first) and, given
+    the user_id, older turns recalled from the user's memory index.
+    `pending` is a message not saved yet (the one being answered); it goes
+    in as the newest.
+    """
+    summary, through_at, through_id = _summary_query(conversation_id).first() or ('', None, 0)
+    window = ContextWindow(budget, summary, through_id)
+    if pending is not None:
+        window.add(pending)
+    offset = 0
+    while not window.full:
+        batch = list(_tail(conversation_id, through_at, through_id, offset))
+        for message in batch:
+            if not window.add(message):
+                break
+        if len(batch) < BATCH_SIZE:
+            break
+        offset += BATCH_SIZE
+
+    if user_id is not None and window.messages:
+        message_ids = recall(user_id, *window.recall_query())
+        if message_ids:
+            window.add_recalled(message_ids, _recalled(user_id, message_ids))
+    return window
+
+
+async def abuild_context(conversation_id, budget=None, user_id=None, pending=None):
+    """Async version of build_context for the async chat views"""
+    summary, through_at, through_id = await _summary_query(conversation_id).afirst() or ('', None, 0)
+    window = ContextWindow(budget, summary, through_id)
+    if pending is not None:
+        window.add(pending)
+    offset = 0
+    while not window.full:
+        batch = [message async for message in _tail(conversation_id, through_at, through_id, offset)]
+        for message in batch:
+            if not window.add(message):
+                break
+        if len(batch) < BATCH_SIZE:
+            break
+        offset += BATCH_SIZE
+
+    if user_id is not None and window.messages:
+        # Searching reads the memory-mapped index; keep it off the event loop
+        message_ids = await sync_to_async(recall, thread_sensitive=False)(user_id, *window.recall_query())
+        if message_ids:
+            window.add_recalled(message_ids, [message async for message in _recalled(user_id, message_ids)])
+    return window
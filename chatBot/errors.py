@@ -0,0 +1,65 @@
+"""
+Errors from the AI service, shared by the modules that call OpenRouter.
+
+The type says what went wrong, so callers can decide what to do about it:
+whether a retry could help, what to answer the client with, and never to
+save the error text as if the assistant had said it.
+"""
+from email.utils import parsedate_to_datetime
+
+from django.utils import timezone
+
+
+class AIServiceError(Exception):
+    """The OpenRouter call failed; str(error) is the message to show the user"""
+    retryable = False  # Could the same request succeed if sent again?
+    status = 502  # What the chat API answers with
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after  # Seconds to wait before trying again, if known
+
+
+class UpstreamError(AIServiceError):
+    """OpenRouter timed out, dropped the connection or answered with a 5xx"""
+    retryable = True
+
+
+class RateLimited(UpstreamError):
+    """OpenRouter answered 429 Too Many Requests"""
+    status = 503
+
+
+class CircuitOpen(AIServiceError):
+    """Failing fast without a request: OpenRouter has been failing (see resilience.py)"""
+    status = 503
+
+
+class NotConfigured(AIServiceError):
+    """No API key, so no request can succeed"""
+    status = 503
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or an HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - timezone.now()).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def error_for_response(status_code, detail, retry_after=None):
+    """The error for a non-200 answer from OpenRouter"""
+    message = f"API Error {status_code}: {detail}"
+    if status_code == 429:
+        return RateLimited(message, parse_retry_after(retry_after))
+    if status_code >= 500 or status_code == 408:
+        return UpstreamError(message, parse_retry_after(retry_after))
+    # Anything else is a problem with our request: sending it again won't help
+    return AIServiceError(message)
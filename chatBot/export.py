@@ -0,0 +1,133 @@
+"""
+Streaming export of conversations and their messages as NDJSON.
+
+One JSON object per line: each conversation, then its messages, oldest
+first:
+
+    {"type": "conversation", "id": 7, "user": "alice", "title": "...", "is_active": true,
+     "created_at": "...", "updated_at": "..."}
+    {"type": "message", "id": 51, "conversation": 7, "role": "user", "content": "...",
+     "timestamp": "..."}
+
+Memory stays constant however much there is: two queries (conversations,
+and all their messages in conversation order) are read CHAT_EXPORT_BATCH_SIZE
+rows at a time with .iterator() and merged as they go, and the output is
+produced in CHAT_EXPORT_CHUNK_BYTES chunks, one at a time, only as fast as
+the consumer takes them. That is what gives a slow client backpressure: the
+next rows aren't fetched until the last chunk has been written to the socket.
+
+With `since`, only conversations updated at or after it are exported, with
+just their messages from then on: enough to bring an earlier export up to date.
+"""
+import json
+import zlib
+from datetime import timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from .models import Conversation, Message
+
+
+def parse_since(value):
+    """Aware datetime from an ISO 8601 `since` parameter; ValueError if it isn't one"""
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError(f"Invalid since: {value}")
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, dt_timezone.utc)
+    return since
+
+
+def export_records(user_id=None, since=None):
+    """The export as dicts, for one user or (user_id None) everyone"""
+    conversations = Conversation.objects.order_by('id')
+    messages = Message.objects.order_by('conversation_id', 'timestamp', 'id')
+    if user_id is not None:
+        conversations = conversations.filter(user_id=user_id)
+        messages = messages.filter(conversation__user_id=user_id)
+    if since is not None:
+        conversations = conversations.filter(updated_at__gte=since)
+        messages = messages.filter(conversation__updated_at__gte=since, timestamp__gte=since)
+
+    batch = settings.CHAT_EXPORT_BATCH_SIZE
+    message_rows = messages.values_list('id', 'conversation_id', 'role', 'content', 'timestamp').iterator(batch)
+    pending = next(message_rows, None)
+    for conversation in conversations.values('id', 'user__username', 'title', 'is_active', 'created_at',
+                                             'updated_at').iterator(batch):
+        yield {
+            'type': 'conversation',
+            'id': conversation['id'],
+            'user': conversation['user__username'],
+            'title': conversation['title'],
+            'is_active': conversation['is_active'],
+            'created_at': conversation['created_at'].isoformat(),
+            'updated_at': conversation['updated_at'].isoformat(),
+        }
+        # Skip messages of conversations that appeared after the first query ran
+        while pending is not None and pending[1] < conversation['id']:
+            pending = next(message_rows, None)
+        while pending is not None and pending[1] == conversation['id']:
+            message_id, conversation_id, role, content, timestamp = pending
+            yield {
+                'type': 'message',
+                'id': message_id,
+                'conversation': conversation_id,
+                'role': role,
+                'content': content,
+                'timestamp': timestamp.isoformat(),
+            }
+            pending = next(message_rows, None)
+
+
+def ndjson_chunks(records):
+    """Records as NDJSON, gathered into chunks of about CHAT_EXPORT_CHUNK_BYTES"""
+    buffer = []
+    size = 0
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False).encode() + b'\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= settings.CHAT_EXPORT_CHUNK_BYTES:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    """Chunks compressed as one gzip stream"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # 16+: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(user_id=None, since=None, compress=False):
+    """The export as bytes chunks, gzipped if compress"""
+    chunks = ndjson_chunks(export_records(user_id, since))
+    return gzipped(chunks) if compress else chunks
+
+
+async def aexport_stream(user_id=None, since=None, compress=False):
+    """
+    export_stream() for ASGI. Django would read a plain iterator to the end
+    before sending anything; this pulls one chunk at a time instead, on the
+    request's sync thread (the open database cursors live there)
+    """
+    chunks = export_stream(user_id, since, compress)
+    pull = sync_to_async(next)
+    try:
+        while True:
+            chunk = await pull(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Client gone early: close the cursors now, on their thread
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,317 @@
+"""
+Hedged requests and the model fallback chain for OpenRouter calls.
+
+OpenRouter's tail latency is far worse than its median. With
+CHAT_HEDGE_ENABLED, a completion that hasn't come back within the model's
+recent p95 latency (CHAT_HEDGE_QUANTILE) gets a second, identical request;
+whichever answers first is used and the other is dropped. Hedging at the
+p95 sends about one request in twenty twice, and the delay follows
+upstream as it speeds up or slows down. Until a model has
+CHAT_HEDGE_MIN_SAMPLES latencies on record, CHAT_HEDGE_DELAY is used. The
+delay counts from when the first request goes out, not from when it was
+handed to the thread pool: time spent waiting for a free thread while the
+pool is busy is not upstream being slow, and hedging then would only add
+load when there's the least room for it.
+
+The loser is cancelled. An async one outright; a sync one has the socket
+of its connection shut down (see Attempt), which ends its wait for the
+reply at once and tells OpenRouter nobody is listening any more.
+
+CHAT_MODELS is tried in order: when a model's request (hedge included)
+fails, the next model in the list is asked.
+
+Request, hedge and fallback counts and each model's recent latencies are
+kept per process and served at /api/upstream/stats/ for tuning.
+"""
+import asyncio
+import contextvars
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from .errors import AIServiceError
+
+logger = logging.getLogger(__name__)
+
+# Latencies kept per model for the quantiles
+LATENCY_WINDOW = 500
+
+
+class LatencyTracker:
+    """The most recent successful latencies of one model"""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def quantile(self, q):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class UpstreamStats:
+    """Hedge and fallback counters plus per-model latencies, guarded by a lock"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'fallbacks': 0, 'failures': 0}
+        self._latencies = {}
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def record_latency(self, model, seconds):
+        with self._lock:
+            self._latencies.setdefault(model, LatencyTracker()).add(seconds)
+
+    def hedge_delay(self, model):
+        """Seconds to wait on a request to this model before hedging it"""
+        with self._lock:
+            tracker = self._latencies.get(model)
+            if tracker is None or len(tracker) < settings.CHAT_HEDGE_MIN_SAMPLES:
+                return settings.CHAT_HEDGE_DELAY
+            return max(tracker.quantile(settings.CHAT_HEDGE_QUANTILE), settings.CHAT_HEDGE_MIN_DELAY)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            models = {
+                model: {
+                    'samples': len(tracker),
+                    'p50': tracker.quantile(0.5),
+                    'p95': tracker.quantile(0.95),
+                    'p99': tracker.quantile(0.99),
+                }
+                for model, tracker in self._latencies.items()
+            }
+        counts['hedge_rate'] = counts['hedged'] / counts['requests'] if counts['requests'] else 0.0
+        counts['hedge_win_rate'] = counts['hedge_wins'] / counts['hedged'] if counts['hedged'] else 0.0
+        return {**counts, 'models': models}
+
+
+_stats = UpstreamStats()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_upstream_stats():
+    return _stats
+
+
+def reset_upstream_stats():
+    """Start the counters and latencies over (tests use this)"""
+    global _stats
+    _stats = UpstreamStats()
+
+
+def chat_models():
+    """The models to try, in order"""
+    return settings.CHAT_MODELS
+
+
+class Attempt:
+    """
+    One request of a hedged pair, run in the thread pool. The HTTP session
+    tracks the connections the request uses (see services._HedgedConnection)
+    so cancel() can shut their sockets down mid-request; a connection goes
+    back to the pool untracked, so one that another request has picked up
+    since is never touched.
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.start = None
+        self.cancelled = False
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def track(self, connection):
+        """A request is about to go out on the connection: False if it shouldn't"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._connections.add(connection)
+            return True
+
+    def untrack(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            for connection in self._connections:
+                sock = getattr(connection, 'sock', None)
+                if sock is not None:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:  # Closed meanwhile
+                        pass
+            self._connections.clear()
+
+
+# The Attempt the current thread is running, if any
+_attempt = contextvars.ContextVar('hedge_attempt', default=None)
+
+
+def current_attempt():
+    return _attempt.get()
+
+
+def _get_executor():
+    # Both requests of a hedged pair run here, so the calling thread can stop
+    # waiting as soon as either one answers
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.OPENROUTER_POOL_SIZE * 2,
+                                               thread_name_prefix='openrouter-hedge')
+    return _executor
+
+
+def _timed(call, model):
+    start = time.monotonic()
+    result = call()
+    _stats.record_latency(model, time.monotonic() - start)
+    return result
+
+
+def _run_attempt(attempt, call, model):
+    _attempt.set(attempt)
+    attempt.start = time.monotonic()
+    attempt.started.set()
+    return _timed(call, model)
+
+
+def _submit(executor, call, model):
+    """Start an Attempt at call() on the pool: (future, attempt)"""
+    attempt = Attempt()
+    # In a copy of this context, so the request's id and profile go along
+    return executor.submit(contextvars.copy_context().run, _run_attempt, attempt, call, model), attempt
+
+
+def _first_result(attempts, primary):
+    """Result of whichever future of {future: attempt} succeeds first; the last error if none does"""
+    pending = set(attempts)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except AIServiceError as e:
+                error = e
+                continue
+            if future is not primary:
+                _stats.count('hedge_wins')
+            for other in pending:
+                if not other.cancel():  # Already running: cut its connection
+                    attempts[other].cancel()
+            return result
+    raise error
+
+
+def hedged(call, model):
+    """
+    Run call(), one request to `model`, sending an identical second request
+    if the first is slower than the hedge delay
+    """
+    if not settings.CHAT_HEDGE_ENABLED:
+        return _timed(call, model)
+
+    executor = _get_executor()
+    primary, attempt = _submit(executor, call, model)
+    # Timed from when the request goes out, not from the wait for a thread
+    attempt.started.wait()
+    delay = _stats.hedge_delay(model) - (time.monotonic() - attempt.start)
+    done, _ = wait([primary], timeout=max(delay, 0))
+    if done:
+        return primary.result()
+    _stats.count('hedged')
+    hedge, hedge_attempt = _submit(executor, call, model)
+    return _first_result({primary: attempt, hedge: hedge_attempt}, primary)
+
+
+async def _atimed(acall, model):
+    start = time.monotonic()
+    result = await acall()
+    _stats.record_latency(model, time.monotonic() - start)
+    return result
+
+
+async def ahedged(acall, model):
+    """Async version of hedged(): the losing request is cancelled outright"""
+    if not settings.CHAT_HEDGE_ENABLED:
+        return await _atimed(acall, model)
+
+    primary = asyncio.ensure_future(_atimed(acall, model))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=_stats.hedge_delay(model))
+        if not done:
+            _stats.count('hedged')
+            tasks.append(asyncio.ensure_future(_atimed(acall, model)))
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    result = task.result()
+                except AIServiceError as e:
+                    error = e
+                    continue
+                if task is not primary:
+                    _stats.count('hedge_wins')
+                return result
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def with_fallbacks(attempt):
+    """attempt(model) for each model in CHAT_MODELS until one succeeds"""
+    _stats.count('requests')
+    error = None
+    for index, model in enumerate(chat_models()):
+        if index:
+            _stats.count('fallbacks')
+        try:
+            return attempt(model)
+        except AIServiceError as e:
+            logger.warning("Model %s failed: %s", model, e, extra={'event': 'upstream.fallback', 'model': model})
+            error = e
+    _stats.count('failures')
+    raise error
+
+
+async def awith_fallbacks(attempt):
+    """Async version of with_fallbacks(); attempt(model) is awaited"""
+    _stats.count('requests')
+    error = None
+    for index, model in enumerate(chat_models()):
+        if index:
+            _stats.count('fallbacks')
+        try:
+            return await attempt(model)
+        except AIServiceError as e:
+            logger.warning("Model %s failed: %s", model, e, extra={'event': 'upstream.fallback', 'model': model})
+            error = e
+    _stats.count('failures')
+    raise error
@@ -0,0 +1,97 @@
+"""
+Idempotency keys for the chat endpoints.
+
+chat.js sends an Idempotency-Key header with every message, and reuses it
+when it retries. The first request with a key claims it by inserting an
+IdempotencyKey row (the unique constraint settles races, across processes
+too) and runs the turn. Requests with the same key that arrive while it is
+running wait for it and get its result; ones that arrive later, within
+CHAT_IDEMPOTENCY_WINDOW, get the stored result straight away. Either way
+the model is called once and the message pair is written once.
+"""
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+MAX_KEY_LENGTH = 64
+# How often a duplicate checks whether the original has finished
+POLL_INTERVAL = 0.1
+
+
+class IdempotencyError(Exception):
+    """Bad key, or the original request is taking too long to replay"""
+
+    def __init__(self, message, status=409):
+        super().__init__(message)
+        self.status = status  # HTTP status to answer with
+
+
+def get_key(request):
+    """The request's idempotency key, or None if it didn't send one"""
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters", status=400)
+    return key
+
+
+def claim(user_id, key):
+    """
+    Try to take the key. Returns (record, None) if this request owns it now,
+    or (None, existing_record) if another request got there first.
+    """
+    expired = timezone.now() - timedelta(seconds=settings.CHAT_IDEMPOTENCY_WINDOW)
+    # A key older than the window is free to be used again
+    IdempotencyKey.objects.filter(user_id=user_id, key=key, created_at__lt=expired).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user_id=user_id, key=key), None
+    except IntegrityError:
+        return None, IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+
+
+def finish(record, result):
+    """Store the result for duplicates to replay (call inside the turn's transaction)"""
+    IdempotencyKey.objects.filter(pk=record.pk).update(status='done', result=result)
+
+
+def release(record):
+    """Give the key up after a failure, so a retry can run the turn itself"""
+    IdempotencyKey.objects.filter(pk=record.pk, status='pending').delete()
+
+
+aclaim = sync_to_async(claim)
+arelease = sync_to_async(release)
+
+
+async def claim_or_wait(user_id, key):
+    """
+    Returns (record, None) when this request should run the turn, or
+    (None, result) with the result of the request that already ran it.
+    Raises IdempotencyError if that request doesn't finish within
+    CHAT_IDEMPOTENCY_WAIT seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.CHAT_IDEMPOTENCY_WAIT
+    while True:
+        record, existing = await aclaim(user_id, key)
+        if record is not None:
+            return record, None
+
+        # Same key in flight: wait for it rather than calling the model twice
+        while existing is not None and existing.status == 'pending':
+            if loop.time() > deadline:
+                raise IdempotencyError("A request with this Idempotency-Key is still being processed")
+            await asyncio.sleep(POLL_INTERVAL)
+            existing = await IdempotencyKey.objects.filter(pk=existing.pk).only('status', 'result').afirst()
+
+        if existing is not None:
+            return None, existing.result
+        # The original failed and gave the key up: try to take it
@@ -0,0 +1,333 @@
+"""
+Bulk import of conversations and messages from NDJSON.
+
+The input is what export.py writes: each conversation's line followed by
+its messages' lines.
+
+    {"type": "conversation", "id": "c-91", "user": "alice", "title": "...", "is_active": true,
+     "created_at": "...", "updated_at": "..."}
+    {"type": "message", "conversation": "c-91", "role": "user", "content": "...", "timestamp": "..."}
+
+Only "type", "id" and "user" are required on a conversation; a message
+needs all its fields. Ids are the source system's, any string or number:
+conversations get new ids here. A message must follow its conversation's
+line.
+
+Lines are read, validated and written batch_size at a time, each batch in
+one transaction: the users it needs (with create_users), one bulk INSERT of
+the new conversations with their own timestamps, one executemany() of the
+messages, and the counters, title and preview that Message.save() and
+save_turn() would have kept, worked out in Python from the batch instead
+of row by row. The batch's transaction also moves the run's
+ImportCheckpoint on, so a run that dies is resumed from the last batch
+that made it in, with nothing imported twice.
+
+benchmarks/bench_import.py puts about 11k messages/s through on SQLite
+(one vCPU, batches of 5000), short of the 50k/s asked for. Postgres is
+unmeasured.
+
+Once a batch is in, its messages are added to their users' memory indexes
+(memory.py) so they can be recalled like any saved turn, unless the
+importer is made with memory=False. A run that dies between the commit and
+that leaves its last batch out of the index: it is still searchable, just
+not recalled.
+"""
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .memory import remember
+from .models import DEFAULT_TITLE, Conversation, ImportCheckpoint, Message, make_preview, make_title
+
+ROLES = {'user', 'assistant'}
+
+
+class InvalidRecord(ValueError):
+    """An input line that can't be imported"""
+
+
+def _timestamp(record, key, required=False):
+    value = record.get(key)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str):
+        raise InvalidRecord(f"{key} is not an ISO 8601 timestamp: {value!r}")
+    try:
+        when = datetime.fromisoformat(value)  # Much faster, and takes what export.py writes
+    except ValueError:
+        when = parse_datetime(value)
+    if when is None:
+        raise InvalidRecord(f"{key} is not an ISO 8601 timestamp: {value!r}")
+    return timezone.make_aware(when, dt_timezone.utc) if timezone.is_naive(when) else when
+
+
+def _source_id(value):
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise InvalidRecord(f"Bad conversation id: {value!r}")
+    return value
+
+
+def read_batches(stream, batch_size):
+    """(lines, bytes) batches of a binary input stream, blank lines included"""
+    lines = []
+    size = 0
+    for line in stream:
+        lines.append(line)
+        size += len(line)
+        if len(lines) >= batch_size:
+            yield lines, size
+            lines = []
+            size = 0
+    if lines:
+        yield lines, size
+
+
+def insert_messages(messages):
+    """
+    INSERT (conversation, role, content, timestamp) rows with one
+    executemany(): what bulk_create() would do without building a model
+    instance per row, which is most of the cost at this volume. The ids
+    aren't needed back.
+    """
+    table = connection.ops.quote_name(Message._meta.db_table)
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} (conversation_id, role, content, timestamp) VALUES (%s, %s, %s, %s)",
+            # Conversations new in the batch got their ids after their messages were read
+            [(conversation if isinstance(conversation, int) else conversation.pk, role, content, adapt(timestamp))
+             for conversation, role, content, timestamp in messages],
+        )
+
+
+def insert_conversations(conversations):
+    """
+    INSERT the conversations with the created_at and updated_at they were
+    given: bulk_create() would stamp those (auto_now_add, auto_now) with the
+    time now. One multi-row INSERT per statement's worth, RETURNING the new
+    ids in row order as bulk_create() relies on too.
+    """
+    meta = Conversation._meta
+    fields = [f for f in meta.concrete_fields if not f.primary_key]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(f.column) for f in fields)
+    row = f"({', '.join(['%s'] * len(fields))})"
+    returning, _ = connection.ops.return_insert_columns([meta.pk])
+    per_statement = connection.ops.bulk_batch_size(fields, conversations) or len(conversations)
+    with connection.cursor() as cursor:
+        for start in range(0, len(conversations), per_statement):
+            chunk = conversations[start:start + per_statement]
+            cursor.execute(
+                f"INSERT INTO {quote(meta.db_table)} ({columns}) VALUES {', '.join([row] * len(chunk))} {returning}",
+                [f.get_db_prep_save(getattr(c, f.attname), connection) for c in chunk for f in fields],
+            )
+            for conversation, (pk,) in zip(chunk, cursor.fetchall()):
+                conversation.pk = pk
+                conversation._state.adding = False
+                conversation._state.db = connection.alias
+
+
+class Importer:
+    def __init__(self, checkpoint, create_users=False, skip_invalid=False, memory=True, report=print):
+        self.checkpoint = checkpoint
+        self.create_users = create_users
+        self.skip_invalid = skip_invalid
+        self.memory = memory and settings.CHAT_MEMORY_ENABLED
+        self.report = report  # Called with a line about each invalid record
+        self._users = {}  # Username to id
+
+    @classmethod
+    def start(cls, name, restart=False, **options):
+        """The importer for the run called name, resuming it unless restart"""
+        if restart:
+            ImportCheckpoint.objects.filter(name=name).delete()
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(name=name)
+        return cls(checkpoint, **options)
+
+    def user_id(self, username):
+        """The user's id, or None for one that create_users will make when the batch is written"""
+        if username not in self._users:
+            if not isinstance(username, str) or not username:
+                raise InvalidRecord(f"Bad user: {username!r}")
+            user_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+            if user_id is None:
+                if not self.create_users:
+                    raise InvalidRecord(f"No such user: {username}")
+                return None
+            self._users[username] = user_id
+        return self._users[username]
+
+    def create_user(self, username):
+        # A normal save() for the usual signals (settings, a first
+        # conversation); they log in by resetting their password
+        user = User(username=username)
+        user.set_unusable_password()
+        user.save()
+        return user.id
+
+    def run(self, stream, batch_size):
+        """Import stream (binary, positioned at checkpoint.offset) to the end"""
+        for lines, size in read_batches(stream, batch_size):
+            self.import_batch(lines, size)
+        self.checkpoint.finished_at = timezone.now()
+        self.checkpoint.save(update_fields=['finished_at', 'updated_at'])
+        return self.checkpoint
+
+    def import_batch(self, lines, size):
+        checkpoint = self.checkpoint
+        # (id in the input, Conversation or id) of the conversation messages go to
+        source = json.loads(checkpoint.source_conversation) if checkpoint.source_conversation else None
+        current = (source, checkpoint.conversation_id)
+        # Conversations started in this batch, with the timestamps to give them
+        new = []
+        messages = []
+        # What this batch adds to the conversation carried over from the last one
+        carried = {'count': 0, 'last': None, 'first_user': None}
+        skipped = 0
+
+        for number, line in enumerate(lines, checkpoint.lines + 1):
+            if not line.strip():
+                continue
+            kind = None
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise InvalidRecord("Not a JSON object")
+                kind = record.get('type')
+                if kind == 'conversation':
+                    # Validated first: a conversation with a bad id is skipped, not imported
+                    source_id = _source_id(record.get('id'))
+                    conversation, stamps = self.conversation(record)
+                    new.append((conversation, stamps))
+                    current = (source_id, conversation)
+                elif kind == 'message':
+                    message = self.message(record)
+                    if record.get('conversation') != current[0] or current[1] is None:
+                        raise InvalidRecord("Message doesn't follow its conversation's line")
+                    target = current[1]
+                    if isinstance(target, Conversation):
+                        self.count(target, *message, new[-1][1])
+                    else:
+                        self.count_carried(carried, *message)
+                    messages.append((target, *message))
+                else:
+                    raise InvalidRecord(f"Unknown type: {kind!r}")
+            except ValueError as e:  # Bad JSON and bad UTF-8 too
+                if not self.skip_invalid:
+                    raise InvalidRecord(f"Line {number}: {e}") from e
+                self.report(f"Skipped line {number}: {e}")
+                skipped += 1
+                if kind == 'conversation':
+                    # Its messages can't be imported either
+                    current = (None, None)
+
+        for conversation, stamps in new:
+            conversation.created_at = stamps['created_at'] or stamps['first'] or timezone.now()
+            conversation.updated_at = max(filter(None, [stamps['updated_at'], stamps['last']]),
+                                          default=conversation.created_at)
+        created = {}  # Users made for this batch, rolled back with it
+        with transaction.atomic():
+            for conversation, stamps in new:
+                if conversation.user_id is None:
+                    if stamps['user'] not in created:
+                        created[stamps['user']] = self.create_user(stamps['user'])
+                    conversation.user_id = created[stamps['user']]
+            insert_conversations([c for c, _ in new])
+            # insert_messages() doesn't return ids: remember() reads back what's above this one
+            last_id = Message.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            insert_messages(messages)
+            if carried['count']:
+                self.update_carried(checkpoint.conversation_id, carried)
+
+            source, target = current
+            checkpoint.source_conversation = json.dumps(source) if source is not None else ''
+            checkpoint.conversation_id = target.id if isinstance(target, Conversation) else target
+            checkpoint.offset += size
+            checkpoint.lines += len(lines)
+            checkpoint.conversations += len(new)
+            checkpoint.messages += len(messages)
+            checkpoint.skipped += skipped
+            checkpoint.save()
+        self._users.update(created)
+
+        if self.memory and messages:
+            self.remember(last_id, {target if isinstance(target, int) else target.pk for target, *_ in messages})
+
+    def remember(self, after_id, conversation_ids):
+        """Add the messages just inserted into these conversations to their users' indexes"""
+        by_user = {}
+        rows = (Message.objects.filter(id__gt=after_id, conversation_id__in=conversation_ids).order_by('id')
+                .values_list('id', 'conversation_id', 'conversation__user_id', 'content'))
+        for message_id, conversation_id, user_id, content in rows.iterator():
+            by_user.setdefault(user_id, []).append(
+                Message(id=message_id, conversation_id=conversation_id, content=content))
+        for user_id, messages in by_user.items():
+            remember(user_id, messages)
+
+    def conversation(self, record):
+        username = record.get('user')
+        conversation = Conversation(
+            user_id=self.user_id(username),
+            title=(record.get('title') or DEFAULT_TITLE)[:255],
+            is_active=record.get('is_active', True) is not False,
+            message_count=0,
+        )
+        stamps = {
+            'user': username,  # Made when the batch is written if user_id is None
+            'created_at': _timestamp(record, 'created_at'),
+            # Moved on to the last message's time if that's later, as a chat would
+            'updated_at': _timestamp(record, 'updated_at'),
+            'first': None,
+            'last': None,
+        }
+        return conversation, stamps
+
+    def message(self, record):
+        role = record.get('role')
+        if role not in ROLES:
+            raise InvalidRecord(f"Bad role: {role!r}")
+        content = record.get('content')
+        if not isinstance(content, str):
+            raise InvalidRecord("content is not a string")
+        return role, content, _timestamp(record, 'timestamp', required=True)
+
+    def count(self, conversation, role, content, timestamp, stamps):
+        """Keep a new conversation's counters as save_turn() would"""
+        conversation.message_count += 1
+        if conversation.last_message_at is None or timestamp > conversation.last_message_at:
+            conversation.last_message_at = timestamp
+        stamps['first'] = min(stamps['first'] or timestamp, timestamp)
+        stamps['last'] = conversation.last_message_at
+        if role == 'user' and not conversation.preview_text:
+            conversation.preview_text = make_preview(content)
+            if conversation.title == DEFAULT_TITLE:
+                conversation.title = make_title(content)
+
+    def count_carried(self, carried, role, content, timestamp):
+        carried['count'] += 1
+        carried['last'] = max(carried['last'] or timestamp, timestamp)
+        if role == 'user' and carried['first_user'] is None:
+            carried['first_user'] = content
+
+    def update_carried(self, conversation_id, carried):
+        """One UPDATE for the messages a conversation from an earlier batch got in this one"""
+        updates = {
+            'message_count': F('message_count') + carried['count'],
+            'last_message_at': Case(When(last_message_at__gt=carried['last'], then=F('last_message_at')),
+                                    default=Value(carried['last'])),
+            'updated_at': Case(When(updated_at__gt=carried['last'], then=F('updated_at')),
+                               default=Value(carried['last'])),
+        }
+        if carried['first_user'] is not None:
+            content = carried['first_user']
+            updates['title'] = Case(When(title=DEFAULT_TITLE, then=Value(make_title(content))), default=F('title'))
+            updates['preview_text'] = Case(When(preview_text='', then=Value(make_preview(content))),
+                                           default=F('preview_text'))
+        Conversation.objects.filter(pk=conversation_id).update(**updates)
+
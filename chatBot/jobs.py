@@ -0,0 +1,348 @@
+"""
+A job queue in the database, so web workers never wait on OpenRouter.
+
+With CHAT_QUEUE_ENABLED the chat views build the turn's context, insert a
+Job and answer straight away with its id; `manage.py run_worker` claims
+queued jobs and runs them on a pool of threads. The client polls
+/api/jobs/<id>/ (or, under ASGI, subscribes to /api/jobs/<id>/events/) and
+sees the reply grow as the worker flushes it into the row.
+
+No broker: claiming is a conditional UPDATE (queued -> running) tagged
+with a token unique to the claim, which is safe with any number of workers
+on SQLite and PostgreSQL alike. The worker's main thread sends heartbeats
+for all the jobs it is running, whatever they are waiting on (retries and
+fallbacks before the first token included). A worker that dies leaves its
+jobs running with a stale heartbeat; the next sweep queues them again, up
+to CHAT_QUEUE_MAX_ATTEMPTS tries.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import logs
+from .errors import AIServiceError
+from .idempotency import finish
+from .models import Conversation, Job, Message
+from .purge import purge_user
+from .services import DeepSeekService
+from .turns import Turn, TurnTimer, save_reply, turn_result
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """More than CHAT_QUEUE_MAX_DEPTH jobs are waiting; try again later"""
+
+
+class JobLost(Exception):
+    """The job was given to another worker while this one was running it"""
+
+
+# Job.kind -> function(job) that runs it
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function as the runner for jobs of this kind"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def ensure_room():
+    """Raise QueueFull when the backlog is at its limit"""
+    # Backpressure: past this point the workers can't catch up anyway, and
+    # an honest "try again" beats a reply that arrives minutes later
+    if Job.objects.filter(status='queued').count() >= settings.CHAT_QUEUE_MAX_DEPTH:
+        raise QueueFull(f"{settings.CHAT_QUEUE_MAX_DEPTH} jobs are already waiting")
+
+
+def enqueue(kind, payload, user_id=None):
+    """Queue a job, or raise QueueFull when the backlog is at its limit"""
+    ensure_room()
+    return Job.objects.create(kind=kind, payload=payload, user_id=user_id)
+
+
+def claim_jobs(limit, worker_id, kinds=None):
+    """
+    Take up to `limit` of the oldest queued jobs (of these kinds, if given)
+    for this worker. Two queries however many jobs come back.
+    """
+    token = f"{worker_id}/{uuid.uuid4().hex[:8]}"
+    now = timezone.now()
+    queued = Job.objects.filter(status='queued')
+    if kinds:
+        queued = queued.filter(kind__in=kinds)
+    oldest = queued.order_by('id').values('id')[:limit]
+    # status='queued' is checked again by the UPDATE itself, so a job another
+    # worker took in the meantime is simply skipped
+    claimed = Job.objects.filter(id__in=oldest, status='queued').update(
+        status='running', lock_token=token, attempts=F('attempts') + 1,
+        started_at=now, heartbeat_at=now)
+    if not claimed:
+        return []
+    return list(Job.objects.filter(lock_token=token, status='running').order_by('id'))
+
+
+def heartbeat(job, output=None):
+    """
+    Show the job is still alive, and flush its partial output if given.
+    False if the job is no longer held by this claim
+    """
+    updates = {'heartbeat_at': timezone.now()}
+    if output is not None:
+        updates['output'] = output
+    return bool(_owned(job).update(**updates))
+
+
+def heartbeat_all(jobs):
+    """One heartbeat for all these jobs, those still held by their claims"""
+    if jobs:
+        Job.objects.filter(pk__in=[job.pk for job in jobs], status='running',
+                           lock_token__in={job.lock_token for job in jobs}).update(heartbeat_at=timezone.now())
+
+
+def _owned(job):
+    """The job's row, as long as this claim still holds it"""
+    return Job.objects.filter(pk=job.pk, status='running', lock_token=job.lock_token)
+
+
+def complete(job, result):
+    """
+    Mark the job done. Call it inside the transaction that saves the job's
+    work: if the job was requeued and taken by another worker meanwhile,
+    JobLost rolls that work back.
+    """
+    if not _owned(job).update(status='done', result=result, finished_at=timezone.now()):
+        raise JobLost(f"Job {job.pk} is no longer held by this worker")
+    job.status = 'done'
+
+
+def fail(job, error):
+    _owned(job).update(status='failed', error=error, finished_at=timezone.now())
+    job.status = 'failed'
+
+
+def requeue_stale():
+    """
+    Put running jobs whose worker stopped sending heartbeats back in the
+    queue, or fail them once they've used up their attempts
+    """
+    stale = Job.objects.filter(
+        status='running',
+        heartbeat_at__lt=timezone.now() - timedelta(seconds=settings.CHAT_QUEUE_JOB_TIMEOUT))
+    stale.filter(attempts__gte=settings.CHAT_QUEUE_MAX_ATTEMPTS).update(
+        status='failed', error='Worker stopped responding', finished_at=timezone.now())
+    return stale.update(status='queued', lock_token='')
+
+
+def run_job(job, **options):
+    """Run one claimed job and record how it went; options go to its handler"""
+    run = HANDLERS.get(job.kind)
+    # Logged under the id of the request that queued it, if there was one
+    logs.set_request_id(job.payload.get('request_id') or f"job-{job.pk}")
+    try:
+        if run is None:
+            raise ValueError(f"No handler for job kind {job.kind!r}")
+        result = run(job, **options)
+        # Handlers that save work of their own complete the job in the
+        # same transaction; the rest just return their result
+        if job.status != 'done':
+            complete(job, result)
+    except JobLost as e:
+        logger.warning("Job %s (%s) dropped: %s", job.pk, job.kind, e, extra={'event': 'job.dropped', 'job_id': job.pk})
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind, extra={'event': 'job.failed', 'job_id': job.pk})
+        fail(job, str(e))
+
+
+class Worker:
+    """
+    Claims queued jobs and runs them on a thread pool until stop() is
+    called. Used by the run_worker command; the benchmark runs one in-process.
+    """
+
+    def __init__(self, threads=None, poll_interval=None):
+        self.threads = threads or settings.CHAT_QUEUE_WORKER_THREADS
+        self.poll_interval = poll_interval or settings.CHAT_QUEUE_POLL_INTERVAL
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._running = {}  # Job id -> job, for the pool's jobs
+        self._running_lock = threading.Lock()
+
+    def stop(self):
+        """Stop claiming jobs; run() returns once the running ones finish"""
+        self._stopping.set()
+        self._wake.set()
+
+    def run_once(self):
+        """Claim what there is room for and run it in this thread (tests use this)"""
+        jobs = claim_jobs(self.threads, self.worker_id)
+        for job in jobs:
+            run_job(job)
+        return len(jobs)
+
+    def beat(self):
+        """Heartbeat for every job the pool is running"""
+        with self._running_lock:
+            jobs = list(self._running.values())
+        heartbeat_all(jobs)
+
+    def run(self):
+        pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='chat-job')
+        last_sweep = 0
+        last_beat = time.monotonic()
+        try:
+            while not self._stopping.is_set():
+                if time.monotonic() - last_sweep > settings.CHAT_QUEUE_JOB_TIMEOUT / 2:
+                    requeue_stale()
+                    last_sweep = time.monotonic()
+                # From here, not the job's own thread: that one may be busy
+                # retrying upstream for longer than the timeout
+                if time.monotonic() - last_beat > settings.CHAT_QUEUE_JOB_TIMEOUT / 4:
+                    self.beat()
+                    last_beat = time.monotonic()
+
+                with self._running_lock:
+                    free = self.threads - len(self._running)
+                jobs = claim_jobs(free, self.worker_id) if free else []
+                with self._running_lock:
+                    self._running.update((job.pk, job) for job in jobs)
+                for job in jobs:
+                    pool.submit(self._run, job)
+
+                # Sleep until the poll interval is up, or a thread frees up
+                # with more jobs likely waiting
+                if len(jobs) < free or not free:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+
+            # Stopping: keep the running jobs alive until they finish
+            while self._running:
+                if time.monotonic() - last_beat > settings.CHAT_QUEUE_JOB_TIMEOUT / 4:
+                    self.beat()
+                    last_beat = time.monotonic()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            pool.shutdown(wait=True)
+            connection.close()
+
+    def _run(self, job):
+        # Pool threads outlive any one job: drop connections past their age
+        close_old_connections()
+        try:
+            run_job(job)
+        finally:
+            with self._running_lock:
+                self._running.pop(job.pk, None)
+            self._wake.set()
+
+
+def enqueue_turn(turn):
+    """
+    Queue a chat turn for the worker. Its idempotency key (if any) is
+    finished now, with the job id, so a retry is pointed at the same job.
+    """
+    payload = {
+        'conversation_id': turn.conversation.id,
+        'message': turn.user_msg.content,
+        'history': turn.message_history,
+        'fresh': turn.fresh,
+        'request_id': logs.get_request_id(),
+    }
+    # Checked outside the transaction: on SQLite one that reads before it
+    # writes can't wait for the write lock and fails at once when busy
+    ensure_room()
+    with transaction.atomic():
+        job = Job.objects.create(kind='chat_turn', payload=payload, user_id=turn.conversation.user_id)
+        if turn.claim is not None:
+            finish(turn.claim, queued_result(job, turn.conversation.id))
+    return job
+
+
+def queued_result(job, conversation_id):
+    """What the chat API answers with for a queued turn"""
+    return {'status': 'queued', 'job_id': job.pk, 'conversation_id': conversation_id}
+
+
+@handler('chat_turn')
+def run_chat_turn(job):
+    """Get the reply for a queued turn, flushing it as it streams in, and save the turn"""
+    payload = job.payload
+    timer = TurnTimer()
+    with timer.phase('db_read'):
+        conversation = Conversation.objects.get(pk=payload['conversation_id'])
+    user_msg = Message(conversation=conversation, role='user', content=payload['message'])
+    turn = Turn(conversation, user_msg, payload['history'], payload['fresh'], None)
+
+    chunks = []
+    flushed = time.monotonic()
+    try:
+        with timer.phase('upstream'):
+            for delta in DeepSeekService.stream_message(turn.message_history, fresh=turn.fresh):
+                chunks.append(delta)
+                if time.monotonic() - flushed >= settings.CHAT_QUEUE_FLUSH_INTERVAL:
+                    heartbeat(job, ''.join(chunks))
+                    flushed = time.monotonic()
+    except AIServiceError as e:
+        # As in the stream view: keep the user's message and any partial
+        # reply, never the error text; the job fails with the error
+        with timer.phase('db_write'):
+            save_reply(turn, ''.join(chunks) or None)
+        timer.log(turn, 'upstream_error', error=e, job_id=job.pk)
+        raise
+
+    reply = ''.join(chunks)
+    result = turn_result(turn, reply)
+    # A worker dying after this commits finds the job done, not queued
+    # again to save the turn a second time
+    with timer.phase('db_write'), transaction.atomic():
+        save_reply(turn, reply)
+        complete(job, result)
+    timer.log(turn, 'ok', reply_chars=len(reply), job_id=job.pk)
+    return result
+
+
+def enqueue_account_deletion(user):
+    """
+    Deactivate the user now and queue the deletion of their data. Not
+    subject to CHAT_QUEUE_MAX_DEPTH: a chat backlog mustn't stop it
+    """
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+    # No user on the job itself: the deletion would cascade to it
+    return Job.objects.create(kind='delete_account', payload={'user_id': user.pk})
+
+
+@handler('delete_account')
+def run_account_deletion(job, batch_size=None, pause=None):
+    # Safe to run twice: if the worker dies part way the job is requeued,
+    # and the next run just finds less left to delete
+    user_id = job.payload['user_id']
+    last_beat = time.monotonic()
+
+    def progress():
+        # A big account takes longer than CHAT_QUEUE_JOB_TIMEOUT: without
+        # heartbeats a worker would requeue it and purge the user twice over
+        nonlocal last_beat
+        if time.monotonic() - last_beat < settings.CHAT_QUEUE_JOB_TIMEOUT / 4:
+            return
+        last_beat = time.monotonic()
+        if not heartbeat(job):
+            raise JobLost(f"Job {job.pk} is no longer held by this worker")
+
+    messages = purge_user(user_id, batch_size, pause, progress)
+    return {'user_id': user_id, 'messages_deleted': messages}
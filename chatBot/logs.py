@@ -0,0 +1,211 @@
+"""
+Structured logging, written off the request path.
+
+print() writes to stdout from the request's own thread: when whatever
+reads stdout (a container runtime, a log shipper) falls behind, the write
+blocks and the request waits with it. Here the chatBot loggers hand
+records to QueueJsonHandler, which only puts them on an in-memory queue; a
+background thread formats each as one line of JSON and writes it to
+stdout. A request pays for building the record, a few microseconds
+(benchmarks/bench_logging.py measures it). If the writer falls
+CHAT_LOG_QUEUE_SIZE records behind, new records are dropped, and counted in
+chat_log_records_total{result="dropped"}, rather than making a request wait.
+
+Every record carries the id of the request it was logged for (taken from
+an X-Request-ID header or made up, see RequestIdMiddleware) and any fields
+passed as extra=, which become keys of the JSON object. Records that say
+what happened name it in an `event` field (chat.turn, upstream.request,
+...); CHAT_LOG_SAMPLE_RATES keeps only a share of a high-volume event's
+records, e.g. {'upstream.request': 0.1}. Warnings and errors are always
+kept.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueListener
+
+from django.conf import settings
+
+from . import metrics
+
+# Id of the request being served, carried into sync_to_async threads with
+# the rest of the context
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+# What's taken from a client's X-Request-ID; anything else gets a new id
+REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+# Attributes every LogRecord has: the rest came from extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def set_request_id(request_id=None):
+    """Tag what's logged from here on with request_id (a new one if None). Returns the id"""
+    request_id = request_id or uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def request_id_for(header):
+    """The client's id if it's a sensible one, otherwise a new id"""
+    if header and REQUEST_ID.match(header):
+        return header
+    return uuid.uuid4().hex
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps the record with the current request id, in the thread that logged it"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Keeps CHAT_LOG_SAMPLE_RATES[event] of an event's records below WARNING"""
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = settings.CHAT_LOG_SAMPLE_RATES.get(getattr(record, 'event', None))
+        if rate is None:
+            return True
+        # Lets whoever counts records scale them back up
+        record.sample_rate = rate
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: the standard fields, then the extra= ones"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at the time (benchmarks swap it for /dev/null)"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room, where the stock one would fail on a full queue
+        self.queue.put(self._sentinel)
+
+
+class QueueJsonHandler(logging.Handler):
+    """
+    Queues records for a background thread that writes them to stdout as
+    JSON lines. Never blocks: a record that finds the queue full is dropped.
+    What logging.handlers.QueueHandler does, but dictConfig leaves it alone
+    (it treats QueueHandler subclasses specially on newer Pythons).
+    """
+
+    def __init__(self, queue_size=10000, target=None):
+        super().__init__()
+        self.queue_size = queue_size
+        if target is None:
+            target = _StdoutHandler()
+            target.setFormatter(JsonFormatter())
+        self.target = target
+        self.queue = None
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        # A forked worker process doesn't inherit the thread: it gets its
+        # own, and its own queue, or the parent's queued records would be
+        # written twice
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            self._listener = _Listener(self.queue, self.target)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # A copy the writer thread can format later: the message merged with
+        # its args now (they may change after this returns), the traceback
+        # kept as text. Formatting as JSON is left to the writer
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS.inc('dropped')
+            return
+        metrics.LOG_RECORDS.inc('queued')
+
+    def flush(self):
+        """Wait until the queued records have been written"""
+        if self._pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        # Writes out what's queued, then stops the thread
+        if self._pid == os.getpid() and self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+        self.target.close()
+        super().close()
+
+
+@atexit.register
+def _flush_at_exit():
+    # Before logging's own shutdown, which may close the handlers in any order
+    for handler in logging.getLogger('chatBot').handlers:
+        if isinstance(handler, QueueJsonHandler):
+            handler.close()
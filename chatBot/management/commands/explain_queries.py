@@ -0,0 +1,96 @@
+"""
+EXPLAIN every query on the chat request path and fail if one of them reads
+a whole table or sorts its rows instead of walking an index, or if a keyset
+query (one that starts from a cursor) uses the index without seeking on the
+cursor: it would walk the rows before the cursor on every call.
+
+    python manage.py explain_queries
+
+Works on SQLite and PostgreSQL. On PostgreSQL sequential scans and sorts
+are switched off for the check, so a small or fresh database can't make
+the planner pick them just because the table is tiny: if one still shows
+up in the plan, no index can serve the query.
+"""
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chatBot.context import _tail
+from chatBot.models import Conversation, Job, Message
+from chatBot.pagination import encode_cursor, page_query
+from chatBot.summaries import window_query
+
+# Plan lines that mean the query isn't served by an index
+BAD_PLAN = {
+    'sqlite': re.compile(r'\bSCAN\b|USE TEMP B-TREE'),
+    'postgresql': re.compile(r'Seq Scan|^\s*(->\s*)?(Incremental )?Sort\b', re.MULTILINE),
+}
+
+# What an index is searched with: `SEARCH t USING INDEX i (a=? AND b<?)`
+SEEK = {
+    'sqlite': re.compile(r'\bSEARCH .* USING (?:COVERING )?INDEX \S+ \((.*)\)'),
+    'postgresql': re.compile(r'Index Cond: (.*)'),
+}
+
+
+def hot_queries():
+    """
+    (name, queryset, columns) for each query the chat views run on every
+    request; columns are the ones the index must be searched on, for keyset
+    queries the cursor's (id only breaks timestamp ties, so it is filtered,
+    not sought)
+    """
+    now = timezone.now()
+    cursor = encode_cursor(Message(id=1, timestamp=now))
+    return [
+        ('sidebar', Conversation.objects.active_for(1).values(
+            'id', 'title', 'preview_text', 'message_count', 'updated_at'), ()),
+        ('latest conversation', Conversation.objects.active_for(1)[:1], ()),
+        ('newest message page', page_query(1), ()),
+        ('older message page', page_query(1, before=cursor), ('timestamp',)),
+        ('newer message page', page_query(1, after=cursor), ('timestamp',)),
+        ('context tail', _tail(1, now, 1, 0), ('timestamp',)),
+        ('summary window', window_query(1, now, 1), ('timestamp',)),
+        ('job queue claim', Job.objects.filter(status='queued').order_by('id').values('id')[:8], ()),
+    ]
+
+
+def unsought(plan, vendor, columns):
+    """The columns the plan doesn't search its index on"""
+    constraints = ' '.join(SEEK[vendor].findall(plan))
+    return [column for column in columns if not re.search(rf'\b{column}\b', constraints)]
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot chat queries and fail if any scans a table, sorts or misses its cursor"
+
+    def handle(self, *args, **options):
+        bad_plan = BAD_PLAN.get(connection.vendor)
+        if bad_plan is None:
+            raise CommandError(f"Don't know how to read {connection.vendor} query plans")
+
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    # SET LOCAL: only for this transaction
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+                    cursor.execute("SET LOCAL enable_sort = off")
+
+            for name, queryset, columns in hot_queries():
+                plan = queryset.explain()
+                missing = unsought(plan, connection.vendor, columns)
+                if bad_plan.search(plan) or missing:
+                    failures.append(name)
+                    reason = f" (doesn't seek on {', '.join(missing)})" if missing else ''
+                    self.stdout.write(self.style.ERROR(f"FAIL {name}{reason}"))
+                    self.stdout.write(plan)
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"ok   {name}"))
+                    if options['verbosity'] > 1:
+                        self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f"Not served by an index: {', '.join(failures)}")
@@ -0,0 +1,48 @@
+"""
+Export conversations and messages as NDJSON (see chatBot/export.py).
+
+    python manage.py export_conversations --output all.ndjson.gz --gzip
+    python manage.py export_conversations --user alice --since 2026-01-01T00:00:00Z > alice.ndjson
+
+Streams in constant memory, however big the database.
+"""
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chatBot.export import export_stream, parse_since
+
+
+class Command(BaseCommand):
+    help = "Export conversations and messages as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Username to export (default: everyone)")
+        parser.add_argument('--since', help="Only what changed at or after this ISO 8601 time")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output")
+        parser.add_argument('--output', default='-', help="File to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        user_id = None
+        if options['user']:
+            try:
+                user_id = User.objects.get(username=options['user']).id
+            except User.DoesNotExist:
+                raise CommandError(f"No such user: {options['user']}")
+        try:
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        chunks = export_stream(user_id, since, compress=options['gzip'])
+        if options['output'] == '-':
+            self.write(chunks, sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as output:
+                self.write(chunks, output)
+
+    def write(self, chunks, output):
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
@@ -0,0 +1,62 @@
+"""
+Import conversations and messages from NDJSON (see chatBot/importer.py).
+
+    python manage.py import_conversations export.ndjson.gz --create-users
+    python manage.py import_conversations old-bot.ndjson --batch-size 10000 --skip-invalid
+
+Each run is named (by default after the file) and checkpointed after every
+batch: run the same command again after a failure to carry on where it
+stopped, or pass --restart to start over.
+"""
+import gzip
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatBot.importer import Importer, InvalidRecord
+
+
+class Command(BaseCommand):
+    help = "Bulk import conversations and messages from NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, gzipped if it ends in .gz; - for stdin")
+        parser.add_argument('--name', help="Name of the run to resume (default: the file's name)")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Lines per transaction")
+        parser.add_argument('--create-users', action='store_true', help="Create users that don't exist yet")
+        parser.add_argument('--skip-invalid', action='store_true', help="Report and skip bad lines instead of stopping")
+        parser.add_argument('--restart', action='store_true', help="Forget earlier progress of this run")
+        parser.add_argument('--no-memory', action='store_true',
+                            help="Don't add the messages to the memory index (faster; they won't be recalled)")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        name = options['name'] or (path if path == '-' else os.path.basename(path))
+        importer = Importer.start(name, restart=options['restart'], create_users=options['create_users'],
+                                  skip_invalid=options['skip_invalid'], memory=not options['no_memory'],
+                                  report=self.stderr.write)
+        checkpoint = importer.checkpoint
+        if checkpoint.finished_at:
+            self.stdout.write(f"{name} was already imported: {checkpoint.messages} messages")
+            return
+        if checkpoint.offset:
+            self.stdout.write(f"Resuming {name} after line {checkpoint.lines}")
+
+        if path == '-':
+            stream = sys.stdin.buffer
+            stream.read(checkpoint.offset)  # Can't seek a pipe
+        else:
+            stream = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+            stream.seek(checkpoint.offset)
+        try:
+            checkpoint = importer.run(stream, options['batch_size'])
+        except InvalidRecord as e:
+            raise CommandError(f"{e} (fix it and run again to resume, or pass --skip-invalid)")
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {checkpoint.conversations} conversations and {checkpoint.messages} messages"
+            + (f", skipped {checkpoint.skipped} lines" if checkpoint.skipped else "")))
@@ -0,0 +1,57 @@
+"""
+Delete what the retention policy says has expired, and closed accounts
+(see chatBot/purge.py).
+
+    python manage.py purge                 # One pass, e.g. from cron
+    python manage.py purge --every 300     # Keep running, a pass every 5 minutes
+
+SIGTERM or Ctrl-C stops it at the end of the current pass.
+"""
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatBot.jobs import claim_jobs, run_job
+from chatBot.purge import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired conversations, jobs and idempotency keys, and closed accounts, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=0,
+                            help="Seconds between passes; without it, one pass and exit")
+        parser.add_argument('--batch-size', type=int, default=settings.CHAT_PURGE_BATCH_SIZE,
+                            help="Rows deleted per transaction")
+        parser.add_argument('--pause', type=float, default=settings.CHAT_PURGE_PAUSE,
+                            help="Seconds between batches")
+
+    def handle(self, *args, **options):
+        stopping = threading.Event()
+
+        def shut_down(signum, frame):
+            self.stdout.write("Stopping after this pass...")
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, shut_down)
+        signal.signal(signal.SIGINT, shut_down)
+
+        while True:
+            self.purge_pass(options['batch_size'], options['pause'])
+            if not options['every'] or stopping.wait(options['every']):
+                break
+
+    def purge_pass(self, batch_size, pause):
+        accounts = 0
+        # Claimed one at a time: a job claimed and left waiting behind a long
+        # one would be swept back into the queue as stale
+        while jobs := claim_jobs(1, 'purge', kinds=['delete_account']):
+            run_job(jobs[0], batch_size=batch_size, pause=pause)
+            accounts += 1
+        counts = purge_expired(batch_size, pause)
+        self.stdout.write(
+            f"Deleted {accounts} accounts, {counts['conversations']} conversations "
+            f"({counts['messages']} messages), {counts['jobs']} jobs, "
+            f"{counts['idempotency_keys']} idempotency keys")
@@ -0,0 +1,39 @@
+"""
+Run queued chat jobs (see chatBot/jobs.py).
+
+    python manage.py run_worker --threads 8
+
+Start as many of these as the upstream API and the database can take; they
+share the queue safely. SIGTERM or Ctrl-C stops taking new jobs and exits
+once the running ones have finished.
+"""
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatBot.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued chat jobs on a pool of threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.CHAT_QUEUE_WORKER_THREADS,
+                            help="Jobs to run at once")
+        parser.add_argument('--poll-interval', type=float, default=settings.CHAT_QUEUE_POLL_INTERVAL,
+                            help="Seconds between checks for new jobs when idle")
+
+    def handle(self, *args, **options):
+        worker = Worker(threads=options['threads'], poll_interval=options['poll_interval'])
+
+        def shut_down(signum, frame):
+            self.stdout.write("Finishing running jobs...")
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, shut_down)
+        signal.signal(signal.SIGINT, shut_down)
+
+        self.stdout.write(f"Worker {worker.worker_id} running {worker.threads} threads")
+        worker.run()
+        self.stdout.write("Worker stopped")
@@ -0,0 +1,239 @@
+"""
+Vector recall for long conversations.
+
+Every saved message is embedded and appended to its user's index on disk:
+``<user_id>-<embedder>.f32`` holds one float32 row per message and
+``<user_id>-<embedder>.ids`` the matching (message id, conversation id)
+pairs. Searching memory-maps the vectors and scores all of them with a
+single matrix-vector product, so older turns that are relevant to what the
+user just said can be spliced back into the context.
+
+That scan is bound by memory bandwidth, not arithmetic. It does not meet
+the sub-millisecond target for 100k messages per user: on one vCPU
+(benchmarks/bench_memory.py, p50/p99) a search takes about 4/7 ms at the
+default 64 dims, 2.4/3.6 ms at 32 and 1.0/1.8 ms at 16. Fewer dims
+(CHAT_MEMORY_DIM) are faster but recall less precisely. Narrower storage
+does not help here: numpy has no fast float16 or int8 product, and both
+measured slower than float32. Getting under 1 ms at 100k needs an
+approximate index (e.g. a compiled ANN library), not a faster scan.
+
+The embedder is pluggable (CHAT_MEMORY_EMBEDDER): any class with a ``name``,
+a ``dim`` and an ``embed(texts)`` returning an (n, dim) float32 array of
+unit vectors. The default HashingEmbedder needs no model download.
+"""
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock protects appends
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+ID_DTYPE = np.dtype('<i8')
+# Memory-mapped indexes kept open per process
+OPEN_INDEXES = 64
+
+
+class HashingEmbedder:
+    """
+    Feature-hashing bag of words: each word lands in one of ``dim`` buckets
+    with a +/-1 sign, counts are log-scaled and the vector is normalized.
+    Cheap and deterministic, good enough to find turns that share vocabulary.
+    """
+
+    def __init__(self, dim=None):
+        self.dim = dim or settings.CHAT_MEMORY_DIM
+        self.name = f"hash{self.dim}"
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in TOKEN_RE.findall(text.lower()):
+                h = zlib.crc32(token.encode())
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+_embedders = {}
+
+
+def get_embedder():
+    """The configured embedder, created once per process"""
+    path = settings.CHAT_MEMORY_EMBEDDER
+    if path not in _embedders:
+        _embedders[path] = import_string(path)()
+    return _embedders[path]
+
+
+class EmbeddingIndex:
+    """One user's vectors on disk, memory-mapped for search"""
+
+    def __init__(self, user_id, embedder=None):
+        self.embedder = embedder or get_embedder()
+        base = Path(settings.CHAT_MEMORY_DIR) / f"{user_id}-{self.embedder.name}"
+        self.vectors_path = base.with_suffix('.f32')
+        self.ids_path = base.with_suffix('.ids')
+        self._lock = threading.Lock()
+        self._size = -1
+        self._vectors = None
+        self._ids = None
+
+    def append(self, message_ids, conversation_ids, texts):
+        """Embed the messages and add them to the end of the index"""
+        vectors = np.ascontiguousarray(self.embedder.embed(texts), dtype=np.float32)
+        ids = np.column_stack([message_ids, conversation_ids]).astype(ID_DTYPE)
+        self.vectors_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.ids_path, 'ab') as ids_file:
+            if fcntl:
+                fcntl.flock(ids_file, fcntl.LOCK_EX)
+            with open(self.vectors_path, 'ab') as vectors_file:
+                # An append that failed half way (a crash, a full disk) left
+                # one file longer than the other: cut both back to the rows
+                # they share, or every row after would pair an id with the
+                # wrong vector. Readers never map past those rows
+                rows = self._rows(ids_file.tell(), vectors_file.tell())
+                if ids_file.tell() != rows * self._id_row or vectors_file.tell() != rows * self._vector_row:
+                    ids_file.truncate(rows * self._id_row)
+                    vectors_file.truncate(rows * self._vector_row)
+                # Vectors first: a reader only trusts rows that have an id
+                vectors_file.write(vectors.tobytes())
+            ids_file.write(ids.tobytes())
+
+    @property
+    def _id_row(self):
+        return 2 * ID_DTYPE.itemsize
+
+    @property
+    def _vector_row(self):
+        return 4 * self.embedder.dim
+
+    def _rows(self, ids_size, vectors_size):
+        """Complete rows in both files"""
+        return min(ids_size // self._id_row, vectors_size // self._vector_row)
+
+    def _load(self):
+        """(vectors, ids) mapped from disk, remapped only when the files grew"""
+        try:
+            size = os.path.getsize(self.ids_path)
+        except OSError:
+            return None, None
+        if size != self._size:
+            with self._lock:
+                rows = self._rows(size, os.path.getsize(self.vectors_path))
+                if rows == 0:
+                    return None, None
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                          shape=(rows, self.embedder.dim))
+                self._ids = np.memmap(self.ids_path, dtype=ID_DTYPE, mode='r', shape=(rows, 2))
+                self._size = size
+        return self._vectors, self._ids
+
+    def __len__(self):
+        vectors, _ = self._load()
+        return 0 if vectors is None else len(vectors)
+
+    def search(self, text, k, exclude_ids=(), min_score=0.0):
+        """
+        Top-k (message id, score) pairs by cosine similarity, best first
+        """
+        vectors, ids = self._load()
+        if vectors is None:
+            return []
+        query = self.embedder.embed([text])[0]
+        # Unit vectors, so the dot product is the cosine
+        scores = vectors @ query
+        # Ask for extra candidates so excluded ones don't eat into k
+        wanted = min(k + len(exclude_ids), len(scores))
+        top = np.argpartition(scores, -wanted)[-wanted:]
+        top = top[np.argsort(scores[top])[::-1]]
+
+        exclude = set(exclude_ids)
+        results = []
+        for row in top:
+            message_id = int(ids[row, 0])
+            score = float(scores[row])
+            if score < min_score:
+                break
+            if message_id in exclude:
+                continue
+            results.append((message_id, score))
+            if len(results) == k:
+                break
+        return results
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(user_id):
+    """The process-wide index object for a user (keeps its mapping warm)"""
+    key = (str(settings.CHAT_MEMORY_DIR), settings.CHAT_MEMORY_EMBEDDER, user_id)
+    with _indexes_lock:
+        index = _indexes.pop(key, None) or EmbeddingIndex(user_id)
+        _indexes[key] = index
+        if len(_indexes) > OPEN_INDEXES:
+            _indexes.popitem(last=False)
+        return index
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-memory')
+
+
+def remember(user_id, messages):
+    """Append saved messages to the user's index"""
+    if not settings.CHAT_MEMORY_ENABLED or not messages:
+        return
+    get_index(user_id).append(
+        [message.id for message in messages],
+        [message.conversation_id for message in messages],
+        [message.content for message in messages],
+    )
+
+
+def remember_later(user_id, messages):
+    """remember() on a background thread, off the request path"""
+    if settings.CHAT_MEMORY_ENABLED and messages:
+        _executor.submit(_remember, user_id, messages)
+
+
+def _remember(user_id, messages):
+    try:
+        remember(user_id, messages)
+    except Exception:
+        logger.exception("Memory indexing failed for user %s", user_id)
+
+
+def forget_user(user_id):
+    """Delete the user's indexes, for every embedder (account deletion)"""
+    with _indexes_lock:
+        for key in [key for key in _indexes if key[2] == user_id]:
+            del _indexes[key]
+    for path in Path(settings.CHAT_MEMORY_DIR).glob(f"{user_id}-*"):
+        if path.suffix in ('.f32', '.ids'):
+            path.unlink(missing_ok=True)
+
+
+def recall(user_id, text, exclude_ids=()):
+    """Ids of the user's messages most similar to text, best first"""
+    if not settings.CHAT_MEMORY_ENABLED:
+        return []
+    matches = get_index(user_id).search(text, settings.CHAT_MEMORY_TOP_K, exclude_ids,
+                                        settings.CHAT_MEMORY_MIN_SCORE)
+    return [message_id for message_id, _ in matches]
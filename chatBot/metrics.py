@@ -0,0 +1,408 @@
+"""
+Prometheus metrics, served at /metrics in the text exposition format.
+
+Recorded per process in plain dicts under a lock: an observation is a
+bisect and a few additions, about a microsecond (benchmarks/bench_metrics.py
+measures it). Every CHAT_METRICS_FLUSH_INTERVAL seconds a background thread
+writes the process's totals to CHAT_METRICS_DIR/<pid>.json, and /metrics
+adds up the files of every process, so a scrape gets the same totals
+whichever worker answers it. Counters and histograms only ever grow within
+a process, so summing them is exact; the few gauges (queue depth) are read
+from the database at scrape time instead.
+
+Each process holds a lock on <pid>.lock for as long as it runs. A scrape
+that can take the lock of a process that has exited folds its <pid>.json
+into _dead.json and removes both, so the directory doesn't grow with every
+process ever started and the exited process's counts stay in the totals. A
+new process given a pid that was used before folds the old file in the same
+way before its first write, rather than replacing it and making counters go
+backwards. Empty the directory when deploying, as with prometheus_client's
+multiprocess mode. Without fcntl (Windows) the files of exited processes are
+kept as they are. With CHAT_METRICS_DIR set to '' each process serves only
+its own numbers.
+
+Hit ratios are left to PromQL, e.g.
+    rate(chat_response_cache_requests_total{result="hit"}[5m])
+      / ignoring(result) sum without(result) (rate(chat_response_cache_requests_total[5m]))
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.dispatch import receiver
+
+try:
+    import fcntl
+except ImportError:  # Windows: the files of exited processes are kept
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}  # Label values -> value
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), self._copy(value)] for labels, value in self._series.items()]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    """Cumulative buckets are worked out at exposition; stored as [per-bucket counts..., +Inf, sum]"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _copy(self, value):
+        return list(value)
+
+
+REQUEST_DURATION = Histogram(
+    'chat_http_request_duration_seconds', "Time to produce a response (to its first byte when streamed)",
+    ('view', 'method'))
+REQUESTS = Counter('chat_http_requests_total', "Requests answered", ('view', 'method', 'status'))
+REQUEST_QUERIES = Histogram(
+    'chat_http_request_db_queries', "SQL queries made per request", ('view',), buckets=QUERY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram(
+    'chat_http_request_db_seconds', "Time spent in SQL queries per request", ('view',))
+UPSTREAM_DURATION = Histogram(
+    'chat_upstream_duration_seconds', "OpenRouter request time, to the end of the reply", ('model',))
+UPSTREAM_FIRST_TOKEN = Histogram(
+    'chat_upstream_first_token_seconds', "Time to the first streamed token from OpenRouter", ('model',))
+UPSTREAM_ERRORS = Counter(
+    'chat_upstream_errors_total',
+    "Failed OpenRouter requests by HTTP status (or connection/parse; cancelled for a hedge that lost)", ('model', 'code'))
+PROMPT_TOKENS = Counter('chat_upstream_prompt_tokens_total', "Prompt tokens billed, from usage", ('model',))
+COMPLETION_TOKENS = Counter(
+    'chat_upstream_completion_tokens_total', "Completion tokens billed, from usage", ('model',))
+RESPONSE_CACHE = Counter('chat_response_cache_requests_total', "Response cache lookups", ('result',))
+LOG_RECORDS = Counter(
+    'chat_log_records_total', "Log records queued for writing, or dropped with the queue full", ('result',))
+
+
+def upstream_request(model, seconds, code=None):
+    """One OpenRouter request finished: successfully, or with this error code"""
+    UPSTREAM_DURATION.observe(seconds, model)
+    if code is not None:
+        UPSTREAM_ERRORS.inc(model, str(code))
+
+
+def upstream_usage(model, usage):
+    """Count the tokens of a response's usage field (missing from some providers)"""
+    if not isinstance(usage, dict):
+        return
+    PROMPT_TOKENS.inc(model, amount=usage.get('prompt_tokens') or 0)
+    COMPLETION_TOKENS.inc(model, amount=usage.get('completion_tokens') or 0)
+
+
+# SQL queries of the request being served: [count, seconds], or None outside
+# one. Carried into sync_to_async threads with the rest of the context
+_request_db = contextvars.ContextVar('request_db', default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    totals = _request_db.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals[0] += 1
+        totals[1] += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    # Fired again on every reconnect of the same connection object. First in
+    # the list: connection.execute_wrapper() pops from the end
+    if settings.CHAT_METRICS_ENABLED and _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _time_query)
+
+
+def start_request():
+    """Begin counting the current request's queries; pass the token to finish_request()"""
+    return _request_db.set([0, 0.0])
+
+
+def finish_request(token, view, method, status, seconds):
+    totals = _request_db.get()
+    _request_db.reset(token)
+    REQUEST_DURATION.observe(seconds, view, method)
+    REQUESTS.inc(view, method, str(status))
+    REQUEST_QUERIES.observe(totals[0], view)
+    REQUEST_DB_SECONDS.observe(totals[1], view)
+    _flusher.start()
+
+
+# Aggregation across processes
+
+def snapshot():
+    return {name: metric.snapshot() for name, metric in REGISTRY.items()}
+
+
+# Counts of processes that have exited, and the lock taken to fold them in
+DEAD_FILE = '_dead.json'
+MERGE_LOCK = '_merge.lock'
+
+_write_lock = threading.Lock()
+_claim_lock = threading.Lock()
+_claim = None  # (pid, directory, open lock file) this process holds
+
+
+def _write_json(path, data):
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(data))
+    # Atomic, so a scrape never reads half a file
+    os.replace(temporary, path)
+
+
+def write_snapshot():
+    directory = settings.CHAT_METRICS_DIR
+    if not directory:
+        return
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    _claim_pid(directory)
+    with _write_lock:  # The flush thread and a scrape share the temporary file
+        _write_json(Path(directory) / f"{os.getpid()}.json", snapshot())
+
+
+@contextmanager
+def _merged(directory):
+    """Held while dead processes' files are folded in, and while a scrape reads the files"""
+    if fcntl is None:
+        yield
+        return
+    with open(Path(directory) / MERGE_LOCK, 'a') as lock_file:
+        # Also keeps this process's threads apart: each opens the file anew
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _claim_pid(directory):
+    """Lock <pid>.lock for the rest of this process, folding in a file an earlier holder of the pid left"""
+    global _claim
+    pid = os.getpid()
+    if fcntl is None or _claim is not None and _claim[:2] == (pid, directory):
+        return
+    with _claim_lock:
+        if _claim is not None:
+            if _claim[:2] == (pid, directory):
+                return
+            # Inherited from the parent of a fork: its lock stays the parent's
+            _claim[2].close()
+        with _merged(directory):
+            lock_file = open(Path(directory) / f"{pid}.lock", 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _retire(directory, pid)
+        _claim = (pid, directory, lock_file)
+
+
+def _retire(directory, pid):
+    """Add the process's counts to the dead processes' and remove its file"""
+    path = Path(directory) / f"{pid}.json"
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        return
+    dead_path = Path(directory) / DEAD_FILE
+    try:
+        dead = json.loads(dead_path.read_text())
+    except FileNotFoundError:
+        dead = {}
+    totals = _add_up([dead, data])
+    _write_json(dead_path, {name: [[list(labels), value] for labels, value in series.items()]
+                            for name, series in totals.items() if series})
+    path.unlink()
+
+
+def _sweep(directory):
+    """Fold in the files of processes that have exited: nobody holds their lock any more"""
+    for lock_path in Path(directory).glob('[0-9]*.lock'):
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:  # Still running
+                continue
+            _retire(directory, int(lock_path.stem))
+            lock_path.unlink()
+
+
+def _add_up(snapshots):
+    """{metric name: {label values: value}}, the snapshots' series summed"""
+    totals = {name: {} for name in REGISTRY}
+    for data in snapshots:
+        for name, series in data.items():
+            if name not in totals:  # From an older release
+                continue
+            merged = totals[name]
+            for labels, value in series:
+                labels = tuple(labels)
+                if isinstance(value, list):
+                    current = merged.setdefault(labels, [0] * len(value))
+                    if len(current) == len(value):  # Buckets changed between releases otherwise
+                        merged[labels] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[labels] = merged.get(labels, 0) + value
+    return totals
+
+
+def collect():
+    """Every process's series added up: {metric name: {label values: value}}"""
+    write_snapshot()
+    directory = settings.CHAT_METRICS_DIR
+    if not directory:
+        return _add_up([snapshot()])
+
+    snapshots = []
+    # Under the lock, so a file being folded in isn't counted twice
+    with _merged(directory):
+        if fcntl is not None:
+            _sweep(directory)
+        for path in Path(directory).glob('*.json'):
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):  # Replaced or removed meanwhile
+                continue
+    return _add_up(snapshots)
+
+
+class _Flusher:
+    """Writes this process's snapshot every CHAT_METRICS_FLUSH_INTERVAL seconds"""
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Cheap when already running; a forked child starts its own
+        if self._pid == os.getpid() or not settings.CHAT_METRICS_DIR:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(settings.CHAT_METRICS_FLUSH_INTERVAL)
+            try:
+                write_snapshot()
+            except OSError as e:
+                logger.warning("Could not write metrics: %s", e)
+
+
+_flusher = _Flusher()
+
+
+@atexit.register
+def _flush_at_exit():
+    if _flusher._pid == os.getpid():
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+# Exposition
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def queue_depth():
+    """Jobs by status, read at scrape time"""
+    from .models import Job
+    counts = dict(Job.objects.values_list('status').annotate(n=Count('id')).order_by())
+    return {status: counts.get(status, 0) for status in ('queued', 'running')}
+
+
+def exposition():
+    """The text exposition format of every metric, all processes added up"""
+    lines = []
+    for name, series in collect().items():
+        metric = REGISTRY[name]
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in sorted(series.items()):
+            if metric.kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip((*metric.buckets, '+Inf'), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(float(bound))
+                    lines.append(f"{name}_bucket{_label_text(metric.labels, labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_label_text(metric.labels, labels)} {_number(float(value[-1]))}")
+                lines.append(f"{name}_count{_label_text(metric.labels, labels)} {cumulative}")
+            else:
+                lines.append(f"{name}{_label_text(metric.labels, labels)} {_number(value)}")
+
+    lines.append("# HELP chat_jobs Chat jobs waiting or running")
+    lines.append("# TYPE chat_jobs gauge")
+    for status, count in queue_depth().items():
+        lines.append(f'chat_jobs{{status="{status}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Start every metric over, in this process (tests use this)"""
+    for metric in REGISTRY.values():
+        metric.reset()
@@ -0,0 +1,184 @@
+"""
+Request middleware for the chat app.
+"""
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+
+from . import logs, metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware:
+    """
+    Records each request's latency, status and SQL queries by URL name (see
+    metrics.py). Sync or async to match the stack, so an async view isn't
+    pushed through a thread for it. First in MIDDLEWARE, to time the rest.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.CHAT_METRICS_ENABLED
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        token = metrics.start_request()
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.finish(request, response, token, start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        token = metrics.start_request()
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.finish(request, response, token, start)
+        return response
+
+    def finish(self, request, response, token, start):
+        match = request.resolver_match
+        # Unmatched URLs all go under one name, or scanners would make a series each
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        metrics.finish_request(token, view, request.method, response.status_code, time.perf_counter() - start)
+
+
+class RequestIdMiddleware:
+    """
+    Gives each request an id, the client's X-Request-ID if it sent a usable
+    one, for everything logged while serving it (see logs.py), and sends it
+    back in the response's X-Request-ID.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Not reset afterwards: a streamed body is generated after this
+        # returns, and its records belong to the request too. The next
+        # request in this thread sets its own
+        request_id = logs.set_request_id(logs.request_id_for(request.headers.get('X-Request-ID')))
+        response = self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
+
+    async def __acall__(self, request):
+        request_id = logs.set_request_id(logs.request_id_for(request.headers.get('X-Request-ID')))
+        response = await self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the sampled requests and those a staff user asked for (see
+    profiling.py). After AuthenticationMiddleware, to know who's asking.
+    A streamed response is profiled to the end of its body.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Read once: this runs on every request, and mostly decides to do nothing
+        self.enabled = settings.CHAT_PROFILE_ENABLED
+        self.sample_rate = settings.CHAT_PROFILE_SAMPLE_RATE
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled or not (self.sample_rate or 'HTTP_X_PROFILE' in request.META):
+            return self.get_response(request)
+        trigger = self.trigger(request, request.user if 'HTTP_X_PROFILE' in request.META else None)
+        if trigger is None:
+            return self.get_response(request)
+
+        profile = profiling.start(request, trigger)
+        token = profiling.activate(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiling.deactivate(token)
+        if response.streaming:
+            response.streaming_content = self._stream(response.streaming_content, profile, request, response,
+                                                      request.user)
+        else:
+            self.save(profile, request, response, request.user)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled or not (self.sample_rate or 'HTTP_X_PROFILE' in request.META):
+            return await self.get_response(request)
+        trigger = self.trigger(request, await request.auser() if 'HTTP_X_PROFILE' in request.META else None)
+        if trigger is None:
+            return await self.get_response(request)
+
+        profile = profiling.start(request, trigger)
+        token = profiling.activate(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.deactivate(token)
+        user = await request.auser()
+        if response.streaming:
+            stream = self._astream if response.is_async else self._stream
+            response.streaming_content = stream(response.streaming_content, profile, request, response, user)
+        else:
+            await sync_to_async(self.save)(profile, request, response, user)
+        return response
+
+    def trigger(self, request, user):
+        """'header', 'sample' or None: why to profile the request. user is the sender of an X-Profile header"""
+        if user is not None and user.is_staff:
+            return 'header'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sample'
+        return None
+
+    def _stream(self, content, profile, request, response, user):
+        token = profiling.activate(profile)
+        try:
+            yield from content
+        finally:
+            profiling.deactivate(token)
+            self.save(profile, request, response, user)
+
+    async def _astream(self, content, profile, request, response, user):
+        token = profiling.activate(profile)
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            profiling.deactivate(token)
+            await sync_to_async(self.save)(profile, request, response, user)
+
+    def save(self, profile, request, response, user):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else ''
+        try:
+            profiling.save(profile, request, response.status_code, view, user)
+        except DatabaseError as e:
+            # Never at the cost of the response
+            logger.warning("Could not save the profile of %s: %s", request.path, e)
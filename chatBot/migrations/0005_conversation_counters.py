@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:37
+
+from django.db import migrations, models
+from django.db.models import Case, Count, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Concat, Length, Substr
+from django.db.models.lookups import GreaterThan
+
+
+def backfill_counters(apps, schema_editor):
+    # Same as Conversation.recount() at the time of writing, for every
+    # conversation in one UPDATE
+    Conversation = apps.get_model('chatBot', 'Conversation')
+    Message = apps.get_model('chatBot', 'Message')
+    messages = Message.objects.filter(conversation=OuterRef('pk')).order_by()
+    count = messages.values('conversation').annotate(n=Count('id')).values('n')
+    last = messages.order_by('-timestamp').values('timestamp')[:1]
+    head = Subquery(messages.filter(role='user').order_by('timestamp', 'id').annotate(
+        head=Substr('content', 1, 101)).values('head')[:1])
+    Conversation.objects.update(
+        message_count=Coalesce(Subquery(count), 0),
+        last_message_at=Subquery(last),
+        preview_text=Case(
+            When(GreaterThan(Length(head), 100), then=Concat(Substr(head, 1, 100), Value('...'))),
+            default=Coalesce(head, Value('')),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatBot', '0004_conversationsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='preview_text',
+            field=models.CharField(blank=True, max_length=103),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
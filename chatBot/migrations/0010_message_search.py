@@ -0,0 +1,98 @@
+# Full-text index over message content (see chatBot/search.py)
+
+from django.db import migrations
+
+# External-content FTS5 table: the text stays in chatBot_message, the index
+# holds the messages of live conversations only. Triggers keep it in step
+# with inserts, edits and deletes of messages and with conversations being
+# soft-deleted or restored. Rows must only be 'delete'd from the index if
+# they are in it, hence the is_active checks.
+#
+# SQLite drops a table's triggers when a migration rebuilds it (most
+# AlterField/AddField on Message or Conversation do): such a migration has
+# to create them again.
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE chatBot_message_fts USING fts5("
+    "content, content='chatBot_message', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')",
+
+    """CREATE TRIGGER chatBot_message_fts_insert AFTER INSERT ON chatBot_message
+    WHEN (SELECT is_active FROM chatBot_conversation WHERE id = new.conversation_id)
+    BEGIN
+        INSERT INTO chatBot_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+
+    """CREATE TRIGGER chatBot_message_fts_delete AFTER DELETE ON chatBot_message
+    WHEN (SELECT is_active FROM chatBot_conversation WHERE id = old.conversation_id)
+    BEGIN
+        INSERT INTO chatBot_message_fts(chatBot_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+
+    """CREATE TRIGGER chatBot_message_fts_update AFTER UPDATE OF content ON chatBot_message
+    WHEN (SELECT is_active FROM chatBot_conversation WHERE id = new.conversation_id)
+    BEGIN
+        INSERT INTO chatBot_message_fts(chatBot_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO chatBot_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+
+    """CREATE TRIGGER chatBot_conversation_fts_hide AFTER UPDATE OF is_active ON chatBot_conversation
+    WHEN old.is_active AND NOT new.is_active
+    BEGIN
+        INSERT INTO chatBot_message_fts(chatBot_message_fts, rowid, content)
+        SELECT 'delete', id, content FROM chatBot_message WHERE conversation_id = new.id;
+    END""",
+
+    """CREATE TRIGGER chatBot_conversation_fts_show AFTER UPDATE OF is_active ON chatBot_conversation
+    WHEN new.is_active AND NOT old.is_active
+    BEGIN
+        INSERT INTO chatBot_message_fts(rowid, content)
+        SELECT id, content FROM chatBot_message WHERE conversation_id = new.id;
+    END""",
+
+    """INSERT INTO chatBot_message_fts(rowid, content)
+    SELECT m.id, m.content FROM chatBot_message m
+    JOIN chatBot_conversation c ON c.id = m.conversation_id WHERE c.is_active""",
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS chatBot_conversation_fts_show",
+    "DROP TRIGGER IF EXISTS chatBot_conversation_fts_hide",
+    "DROP TRIGGER IF EXISTS chatBot_message_fts_update",
+    "DROP TRIGGER IF EXISTS chatBot_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chatBot_message_fts_insert",
+    "DROP TABLE IF EXISTS chatBot_message_fts",
+]
+
+# A generated column follows the message's content by itself. It can't see
+# the conversation, so soft-deleted conversations are filtered at query time
+POSTGRES_FORWARDS = [
+    """ALTER TABLE "chatBot_message" ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', content)) STORED""",
+    """CREATE INDEX message_search_idx ON "chatBot_message" USING GIN (search_vector)""",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS message_search_idx",
+    """ALTER TABLE "chatBot_message" DROP COLUMN IF EXISTS search_vector""",
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatBot', '0009_job'),
+    ]
+
+    operations = [
+        # Other databases get no index: search falls back to LIKE there
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRES_FORWARDS}),
+            run({'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRES_BACKWARDS}),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_watermarks(apps, schema_editor):
+    # The newest timestamp among the messages the id watermark covered: the
+    # watermark message's own, unless ids and timestamps had drifted apart
+    ConversationSummary = apps.get_model('chatBot', 'ConversationSummary')
+    Message = apps.get_model('chatBot', 'Message')
+    covered = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id'), id__lte=OuterRef('summarized_through_id')
+    ).order_by('-timestamp').values('timestamp')[:1]
+    ConversationSummary.objects.filter(summarized_through_id__gt=0).update(summarized_through_at=Subquery(covered))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatBot', '0012_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='summarized_through_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
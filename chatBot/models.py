@@ -1,58 +1,352 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Concat, Greatest, Length, Substr
+from django.db.models.lookups import GreaterThan
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+DEFAULT_TITLE = "New Conversation"
+PREVIEW_LENGTH = 100
+EMPTY_PREVIEW = "Empty conversation"
+
+
+def make_title(content):
+    """Conversation title from its first user message"""
+    return f"{content[:50]}..." if len(content) > 50 else content
+
+
+def make_preview(content):
+    """Sidebar preview of a conversation's first user message"""
+    return content[:PREVIEW_LENGTH] + '...' if len(content) > PREVIEW_LENGTH else content
+
+
+def latest(timestamp):
+    """
+    last_message_at moved on to timestamp, never back: a turn committed late
+    can be older than one committed before it. Coalesce, as SQLite's
+    MAX() is NULL if any argument is
+    """
+    return Greatest(Coalesce(F('last_message_at'), Value(timestamp)), Value(timestamp))
+
+
+class ConversationQuerySet(models.QuerySet):
+    def active_for(self, user):
+        """A user's live conversations, most recently updated first"""
+        return self.filter(user=user, is_active=True).order_by('-updated_at')
+
 
 # Enhanced conversation model to support multiple conversations per user
 class Conversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')  # Changed to ForeignKey
-    title = models.CharField(max_length=255, default="New Conversation")  # Added title field
+    title = models.CharField(max_length=255, default=DEFAULT_TITLE)  # Added title field
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)  # Added for soft delete
+    # Denormalized for the sidebar, kept up to date by save_turn() and Message.save()/delete()
+    message_count = models.PositiveIntegerField(default=0)
+    preview_text = models.CharField(max_length=PREVIEW_LENGTH + 3, blank=True)  # First user message
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ConversationQuerySet.as_manager()
 
     class Meta:
         ordering = ['-updated_at']  # Most recent first
+        indexes = [
+            # The sidebar and "latest conversation" lookups: filter and order in one
+            # index. Partial rather than (user, is_active, -updated_at) because
+            # SQLite compares booleans as a bare "is_active", which can't seek into
+            # an index column; deleted conversations stay out of it too
+            models.Index(fields=['user', '-updated_at'], condition=Q(is_active=True),
+                         name='conversation_user_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
     
     @property
-    def message_count(self):
-        return self.messages.count()
+    def preview(self):
+        return self.preview_text or EMPTY_PREVIEW
     
-    @property
-    def preview_text(self):
-        """Get preview text from first user message"""
-        first_user_message = self.messages.filter(role='user').first()
-        if first_user_message:
-            content = first_user_message.content
-            return content[:100] + '...' if len(content) > 100 else content
-        return "Empty conversation"
+    def count_message(self, message):
+        """
+        Account for a newly inserted message with one UPDATE. F() makes the
+        increment safe when two turns land at once; the preview is only set
+        if the conversation doesn't have one yet.
+        """
+        updates = {
+            'message_count': F('message_count') + 1,
+            'last_message_at': latest(message.timestamp),
+        }
+        if message.role == 'user':
+            updates['preview_text'] = Case(
+                When(preview_text='', then=Value(make_preview(message.content))),
+                default=F('preview_text'),
+            )
+        Conversation.objects.filter(pk=self.pk).update(**updates)
+    
+    def save_turn(self, user_message, reply=None):
+        """
+        Persist a chat turn in one transaction and two statements: one INSERT
+        for the user's message and the reply (if there is one), one UPDATE for
+        the title, counters and updated_at. The title and preview are only
+        set if the conversation doesn't have them yet. Returns the messages.
+        """
+        messages = [user_message] + ([reply] if reply is not None else [])
+        # Stamped now, not when the user's message arrived: a turn that took
+        # long upstream or sat in the job queue must not land behind turns
+        # that were saved before it, or behind the summary's watermark.
+        # The reply ties with the question; the id comes after it
+        now = timezone.now()
+        for message in messages:
+            message.conversation = self
+            message.timestamp = now
+        title = make_title(user_message.content)
+        preview = make_preview(user_message.content)
+        
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            Conversation.objects.filter(pk=self.pk).update(
+                title=Case(When(title=DEFAULT_TITLE, then=Value(title)), default=F('title')),
+                preview_text=Case(When(preview_text='', then=Value(preview)), default=F('preview_text')),
+                message_count=F('message_count') + len(messages),
+                last_message_at=latest(now),
+                updated_at=now,
+            )
+        
+        # Mirror the UPDATE instead of reloading the row (message_count is
+        # left alone: other turns may have moved it)
+        if self.title == DEFAULT_TITLE:
+            self.title = title
+        self.preview_text = self.preview_text or preview
+        self.last_message_at = max(self.last_message_at or now, now)
+        self.updated_at = now
+        return messages
+    
+    @staticmethod
+    def recount(conversation_ids):
+        """
+        Recompute the denormalized columns from the messages table, for after
+        messages were deleted (one UPDATE for all the conversations)
+        """
+        messages = Message.objects.filter(conversation=OuterRef('pk')).order_by()
+        count = messages.values('conversation').annotate(n=Count('id')).values('n')
+        last = messages.order_by('-timestamp').values('timestamp')[:1]
+        # One character more than the preview keeps, to know when to add '...'
+        head = Subquery(messages.filter(role='user').order_by('timestamp', 'id').annotate(
+            head=Substr('content', 1, PREVIEW_LENGTH + 1)).values('head')[:1])
+        Conversation.objects.filter(pk__in=conversation_ids).update(
+            message_count=Coalesce(Subquery(count), 0),
+            last_message_at=Subquery(last),
+            preview_text=Case(
+                When(GreaterThan(Length(head), PREVIEW_LENGTH),
+                     then=Concat(Substr(head, 1, PREVIEW_LENGTH), Value('...'))),
+                default=Coalesce(head, Value('')),
+            ),
+        )
+
+class MessageQuerySet(models.QuerySet):
+    def after(self, timestamp, message_id):
+        """
+        Messages after (timestamp, id) in conversation order. The OR alone
+        can't seek message_conv_time_idx, so each query would walk the
+        conversation from one end to the cursor: the plain bound on
+        timestamp is what the index seeks on, the OR settles ties.
+        """
+        return self.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id),
+                           timestamp__gte=timestamp)
+
+    def before(self, timestamp, message_id):
+        """Messages before (timestamp, id) in conversation order, as after()"""
+        return self.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id),
+                           timestamp__lte=timestamp)
+
+    def delete(self):
+        # Deletes cascading from a conversation or user don't come through
+        # here, which is fine: the counters go away with the conversation
+        with transaction.atomic():
+            conversation_ids = list(self.order_by().values_list('conversation_id', flat=True).distinct())
+            result = super().delete()
+            Conversation.recount(conversation_ids)
+        return result
+
 
 # Enhanced message model
 class Message(models.Model):
-    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    # Indexed by message_conv_time_idx below, which leads with the conversation
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages',
+                                     db_index=False)
     role = models.CharField(max_length=10, choices=[('user', 'User'), ('assistant', 'Assistant')])
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so imported messages keep their own times. Chat
+    # turns are stamped as they are saved (see Conversation.save_turn)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    objects = MessageQuerySet.as_manager()
 
     class Meta:
-        ordering = ['timestamp']
+        # id breaks timestamp ties so pages and context windows are stable
+        ordering = ['timestamp', 'id']
+        indexes = [
+            # Message pages and the context tail walk this index in either direction
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conv_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.role}: {self.content[:50]}"
     
     def save(self, *args, **kwargs):
-        # Auto-generate conversation title from first user message
-        if self.role == 'user' and self.conversation.title == "New Conversation":
-            if len(self.content) > 50:
-                self.conversation.title = f"{self.content[:50]}..."
-            else:
-                self.conversation.title = self.content
-            self.conversation.save()
-        
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        with transaction.atomic():
+            # Auto-generate conversation title from first user message
+            if self.role == 'user' and self.conversation.title == DEFAULT_TITLE:
+                self.conversation.title = make_title(self.content)
+                # Only these fields: a full save would write back stale counters
+                self.conversation.save(update_fields=['title', 'updated_at'])
+            
+            super().save(*args, **kwargs)
+            if adding:
+                self.conversation.count_message(self)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Conversation.recount([self.conversation_id])
+        return result
+
+class ConversationSummary(models.Model):
+    """
+    Rolling summary of the turns that have fallen out of the live context
+    window. It only ever moves forward: new turns are folded into the
+    existing summary, old turns are never summarized twice.
+    """
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, related_name='summary')
+    content = models.TextField(blank=True)
+    # Every message up to and including this one, in (timestamp, id) order,
+    # is covered by the summary; no timestamp while nothing is
+    summarized_through_at = models.DateTimeField(null=True, blank=True)
+    summarized_through_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of {self.conversation_id} through message {self.summarized_through_id}"
+
+class IdempotencyKey(models.Model):
+    """
+    A chat request's client-supplied idempotency key. The first request to
+    insert the row does the work; duplicates wait for it to finish and get
+    its stored result instead of calling the model again.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    result = models.JSONField(null=True, blank=True)  # What the original request returned
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.status})"
+
+class Job(models.Model):
+    """
+    A piece of background work in the database-backed queue (see jobs.py).
+    Web requests insert it; a run_worker process claims and runs it.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=30)  # Picks the handler in jobs.HANDLERS
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='jobs', null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    output = models.TextField(blank=True)  # Partial output, flushed while the job runs
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    lock_token = models.CharField(max_length=64, blank=True)  # The worker claim that took it
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Running jobs touch this as they go
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers take the oldest queued jobs first
+            models.Index(fields=['status', 'id'], name='job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+class ImportCheckpoint(models.Model):
+    """
+    How far an import_conversations run has got. Saved in the same
+    transaction as each batch, so a run that dies resumes exactly after
+    the last batch that made it in (see importer.py).
+    """
+    name = models.CharField(max_length=255, unique=True)
+    offset = models.PositiveBigIntegerField(default=0)  # Bytes of input imported
+    lines = models.PositiveBigIntegerField(default=0)
+    # The conversation being imported when the batch ended: its messages may
+    # carry on in the next one
+    source_conversation = models.CharField(max_length=255, blank=True)  # Its id in the input, as JSON
+    conversation = models.ForeignKey(Conversation, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='+')
+    conversations = models.PositiveIntegerField(default=0)  # Imported so far
+    messages = models.PositiveBigIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)  # Invalid lines left out
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.messages} messages"
+
+class RequestProfile(models.Model):
+    """
+    One profiled request (see profiling.py): where its time went, in SQL,
+    OpenRouter calls and timed sections, with stack samples if it asked for
+    them. Only the newest CHAT_PROFILE_KEEP are kept.
+    """
+    TRIGGER_CHOICES = [
+        ('sample', 'Sampled'),
+        ('header', 'Requested'),  # A staff user's X-Profile header
+    ]
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    request_id = models.CharField(max_length=64, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    view = models.CharField(max_length=100, blank=True)  # URL name
+    status = models.PositiveSmallIntegerField(null=True)
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    duration_ms = models.FloatField()  # To the end of the body when streamed
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    duplicate_queries = models.PositiveIntegerField(default=0)  # Same SQL and parameters as an earlier one
+    upstream_ms = models.FloatField(default=0)
+    data = models.JSONField(default=dict)  # The statements, calls, sections and stacks themselves
+
+    class Meta:
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
 
 # Keep  existing signals but update them for the new model structure
 @receiver(post_save, sender=User)
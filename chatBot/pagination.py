@@ -0,0 +1,126 @@
+"""
+Keyset pagination over a conversation's messages.
+
+Pages are cut on (timestamp, id) instead of with OFFSET, so the hundredth
+page back costs the same single indexed query as the first. Cursors are
+opaque to the client: they encode the (timestamp, id) of the message at
+the edge of a page.
+"""
+import base64
+from datetime import datetime
+
+from django.conf import settings
+
+from .models import Message
+
+
+class PaginationError(ValueError):
+    """Bad cursor or limit in the query string"""
+
+
+def encode_cursor(message):
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor made by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError as e:  # Also covers bad base64 and bad UTF-8
+        raise PaginationError(f"Invalid cursor: {cursor}") from e
+
+
+def page_size(limit):
+    """The requested page size, clamped to CHAT_PAGE_MAX"""
+    if not limit:
+        return settings.CHAT_PAGE_SIZE
+    try:
+        size = int(limit)
+    except ValueError as e:
+        raise PaginationError(f"Invalid limit: {limit}") from e
+    if size < 1:
+        raise PaginationError(f"Invalid limit: {limit}")
+    return min(size, settings.CHAT_PAGE_MAX)
+
+
+def page_number(page):
+    """1-based page number for offset-paged results (search)"""
+    if not page:
+        return 1
+    try:
+        number = int(page)
+    except ValueError as e:
+        raise PaginationError(f"Invalid page: {page}") from e
+    if number < 1:
+        raise PaginationError(f"Invalid page: {page}")
+    return number
+
+
+class MessagePage:
+    """One page of messages, oldest first, and where to go from it"""
+
+    def __init__(self, messages, has_older, has_newer):
+        self.messages = messages
+        self.has_older = has_older
+        self.has_newer = has_newer
+
+    @property
+    def before(self):
+        """Cursor for the page before this one, if there is one"""
+        return encode_cursor(self.messages[0]) if self.has_older and self.messages else None
+
+    @property
+    def after(self):
+        """Cursor for the page after this one, if there is one"""
+        return encode_cursor(self.messages[-1]) if self.has_newer and self.messages else None
+
+    def to_json(self):
+        return {
+            'messages': [
+                {
+                    'id': msg.id,
+                    'role': msg.role,
+                    'content': msg.content,
+                    'timestamp': msg.timestamp.isoformat()
+                }
+                for msg in self.messages
+            ],
+            'has_older': self.has_older,
+            'has_newer': self.has_newer,
+            'before': self.before,
+            'after': self.after,
+        }
+
+
+def page_query(conversation_id, before=None, after=None, size=None):
+    """
+    The rows for one page plus one, in the order they are walked: newest
+    first, unless paging forward from an `after` cursor
+    """
+    size = size or settings.CHAT_PAGE_SIZE
+    messages = Message.objects.filter(conversation_id=conversation_id).only('id', 'role', 'content', 'timestamp')
+    if after:
+        timestamp, message_id = decode_cursor(after)
+        return messages.after(timestamp, message_id).order_by('timestamp', 'id')[:size + 1]
+    if before:
+        timestamp, message_id = decode_cursor(before)
+        messages = messages.before(timestamp, message_id)
+    return messages.order_by('-timestamp', '-id')[:size + 1]
+
+
+def message_page(conversation_id, before=None, after=None, limit=None):
+    """
+    A page of the conversation: the newest messages by default, the ones
+    just older than the `before` cursor, or just newer than `after`.
+    One query either way; one row more than the page tells us if there's more.
+    """
+    if before and after:
+        raise PaginationError("Pass either before or after, not both")
+    size = page_size(limit)
+    rows = list(page_query(conversation_id, before, after, size))
+    if after:
+        return MessagePage(rows[:size], has_older=True, has_newer=len(rows) > size)
+    return MessagePage(rows[:size][::-1], has_older=len(rows) > size, has_newer=bool(before))
@@ -0,0 +1,222 @@
+"""
+Per-request profiles, for finding out where a slow request's time went.
+
+ProfilingMiddleware profiles a request when
+
+  - it is one of the CHAT_PROFILE_SAMPLE_RATE share picked at random, or
+  - a staff user sent it with an X-Profile header (`X-Profile: 1`, or
+    `X-Profile: stacks` for stack samples as well)
+
+and saves a RequestProfile, viewable in the admin, with:
+
+  - every SQL statement with its time, statements run again with the same
+    parameters (duplicates) and the same SQL run many times over (an N+1)
+  - each OpenRouter request: model, time, error code
+  - timed sections, such as rendering chat.html (see section())
+  - optionally, statistical stack samples: every CHAT_PROFILE_STACK_INTERVAL
+    seconds a thread records where the request's threads are (the one it
+    arrived on and any that ran its SQL), in the collapsed format
+    flamegraph.pl and speedscope read
+
+Query parameters are used to spot duplicates but never stored: they hold
+users' messages. Only the newest CHAT_PROFILE_KEEP profiles are kept.
+
+A request that isn't profiled costs a header check in the middleware and a
+context variable lookup per SQL query and upstream call, well under a
+microsecond each (benchmarks/bench_profiling.py). A profiled one pays for its profile: a few microseconds per query,
+plus the INSERT of the profile when it's over.
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .logs import get_request_id
+
+# The profile of the request being served, or None: carried into
+# sync_to_async threads with the rest of the context
+_active = contextvars.ContextVar('profile', default=None)
+
+# SQL statements stored per profile; the rest are only counted
+MAX_QUERIES = 500
+# Distinct stacks stored per profile, the most sampled first
+MAX_STACKS = 200
+# Frames kept per stack sample, innermost last
+STACK_DEPTH = 60
+
+
+class Profile:
+    """What one request spent its time on, collected while it runs"""
+
+    def __init__(self, trigger, stacks=False):
+        self.trigger = trigger
+        self.start = time.perf_counter()
+        self.queries = []  # (sql, parameters, seconds); parameters None for executemany()
+        self.upstream = []  # (model, seconds, code)
+        self.sections = {}  # Name -> seconds
+        self.threads = {threading.get_ident()}
+        self.sampler = StackSampler(self) if stacks else None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        """(duplicate query count, the data saved with the profile)"""
+        by_sql = {}
+        seen = set()
+        duplicates = 0
+        for sql, parameters, seconds in self.queries:
+            group = by_sql.setdefault(sql, {'sql': sql, 'count': 0, 'duplicates': 0, 'ms': 0.0})
+            group['count'] += 1
+            group['ms'] += seconds * 1000
+            if parameters is not None:
+                if (sql, parameters) in seen:
+                    group['duplicates'] += 1
+                    duplicates += 1
+                seen.add((sql, parameters))
+        repeated = sorted((g for g in by_sql.values() if g['count'] > 1), key=lambda g: -g['ms'])
+        data = {
+            'queries': [{'sql': sql, 'ms': round(seconds * 1000, 3)}
+                        for sql, _, seconds in self.queries[:MAX_QUERIES]],
+            'queries_not_stored': max(len(self.queries) - MAX_QUERIES, 0),
+            'repeated': [{**g, 'ms': round(g['ms'], 3)} for g in repeated],
+            'upstream': [{'model': model, 'ms': round(seconds * 1000, 1), 'code': code}
+                         for model, seconds, code in self.upstream],
+            'sections': {name: round(seconds * 1000, 3) for name, seconds in self.sections.items()},
+        }
+        if self.sampler is not None:
+            data['stack_interval'] = self.sampler.interval
+            data['stacks'] = self.sampler.collapsed()
+        return duplicates, data
+
+
+class StackSampler:
+    """Records the request's threads' stacks every interval seconds on a thread of its own"""
+
+    def __init__(self, profile, interval=None):
+        self.profile = profile
+        self.interval = interval or settings.CHAT_PROFILE_STACK_INTERVAL
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.profile.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[_collapse(frame)] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """[(semicolon-separated stack, samples)], the most sampled first"""
+        return self.samples.most_common(MAX_STACKS)
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None and len(names) < STACK_DEPTH:
+        code = frame.f_code
+        path = code.co_filename
+        names.append(f"{os.path.basename(os.path.dirname(path))}/{os.path.basename(path)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def activate(profile):
+    """Profile what runs in this context from now on; pass the token to deactivate()"""
+    profile.threads.add(threading.get_ident())
+    return _active.set(profile)
+
+
+def deactivate(token):
+    try:
+        _active.reset(token)
+    except ValueError:  # A stream closed from another context
+        _active.set(None)
+
+
+@contextmanager
+def section(name):
+    """Time a block of the current request, if it's being profiled"""
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    profile.threads.add(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] = profile.sections.get(name, 0.0) + time.perf_counter() - start
+
+
+def upstream_request(model, seconds, code=None):
+    """One OpenRouter request of the current request finished"""
+    profile = _active.get()
+    if profile is not None:
+        profile.upstream.append((model, seconds, code))
+
+
+def _capture_query(execute, sql, params, many, context):
+    profile = _active.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    profile.threads.add(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        # repr(), not the parameters: they may be mutated after this
+        profile.queries.append((sql, None if many else repr(params), time.perf_counter() - start))
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if settings.CHAT_PROFILE_ENABLED and _capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _capture_query)
+
+
+def start(request, trigger):
+    stacks = request.headers.get('X-Profile') == 'stacks' if trigger == 'header' else settings.CHAT_PROFILE_STACKS
+    return Profile(trigger, stacks=stacks)
+
+
+def save(profile, request, status, view, user):
+    """Store the finished profile, dropping the oldest beyond CHAT_PROFILE_KEEP"""
+    from .models import RequestProfile
+
+    duration = profile.elapsed()
+    if profile.sampler is not None:
+        profile.sampler.stop()
+    duplicates, data = profile.summary()
+    saved = RequestProfile.objects.create(
+        request_id=get_request_id() or '',
+        user=user if user is not None and user.is_authenticated else None,
+        method=request.method,
+        path=request.path[:255],
+        view=view,
+        status=status,
+        trigger=profile.trigger,
+        duration_ms=round(duration * 1000, 1),
+        query_count=len(profile.queries),
+        query_ms=round(sum(seconds for _, _, seconds in profile.queries) * 1000, 3),
+        duplicate_queries=duplicates,
+        upstream_ms=round(sum(seconds for _, seconds, _ in profile.upstream) * 1000, 1),
+        data=data,
+    )
+    # A ring buffer by id: one indexed DELETE, whatever the table's size
+    RequestProfile.objects.filter(id__lte=saved.id - settings.CHAT_PROFILE_KEEP).delete()
+    return saved
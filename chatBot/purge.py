@@ -0,0 +1,109 @@
+"""
+Deleting old data in bounded batches.
+
+delete_conversation only hides a conversation (is_active=False), and
+finished jobs and idempotency keys are kept after they're needed. The
+retention policy says how long each is kept:
+
+  soft-deleted conversations  CHAT_RETENTION_DELETED_DAYS after deletion
+  finished jobs               CHAT_RETENTION_JOB_DAYS after they finished
+  idempotency keys            CHAT_IDEMPOTENCY_WINDOW after they were made
+
+`manage.py purge` deletes what has expired. Account deletion goes the same
+way, as a delete_account job: the user is deactivated at once, and their
+data deleted afterwards.
+
+Nothing is deleted in one go: rows go CHAT_PURGE_BATCH_SIZE at a time, one
+short transaction per batch, with CHAT_PURGE_PAUSE seconds between batches
+so the chat requests' queries keep getting their turn at the database. No
+transaction touches more rows than a batch, however big the user.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.utils import timezone
+
+from .memory import forget_user
+from .models import Conversation, IdempotencyKey, Job, Message
+
+
+def delete_in_batches(queryset, batch_size=None, pause=None, progress=None):
+    """
+    Delete the queryset's rows a batch at a time (each batch re-selects, so
+    the queryset may keep matching new rows), calling progress() after each.
+    Returns how many went.
+    """
+    batch_size = batch_size or settings.CHAT_PURGE_BATCH_SIZE
+    pause = settings.CHAT_PURGE_PAUSE if pause is None else pause
+    model = queryset.model
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            # The plain QuerySet.delete(): Message's own recounts the
+            # conversation, which is pointless for one that's on its way out
+            deleted += models.QuerySet.delete(model.objects.filter(pk__in=ids))[1].get(model._meta.label, 0)
+        if progress is not None:
+            progress()
+        if len(ids) < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def purge_conversation(conversation_id, batch_size=None, pause=None, progress=None):
+    """Delete a conversation: its messages in batches, then the rest in one small transaction"""
+    messages = delete_in_batches(Message.objects.filter(conversation_id=conversation_id), batch_size, pause,
+                                 progress)
+    # Only the conversation row and its summary are left
+    Conversation.objects.filter(pk=conversation_id).delete()
+    return messages
+
+
+def purge_user(user_id, batch_size=None, pause=None, progress=None):
+    """
+    Delete a user and everything of theirs, a batch at a time. progress() is
+    called after every batch (a job's heartbeat)
+    """
+    messages = 0
+    # Ids read up front: no cursor left open on a table being deleted from
+    for conversation_id in list(Conversation.objects.filter(user_id=user_id).values_list('id', flat=True)):
+        messages += purge_conversation(conversation_id, batch_size, pause, progress)
+    delete_in_batches(IdempotencyKey.objects.filter(user_id=user_id), batch_size, pause, progress)
+    delete_in_batches(Job.objects.filter(user_id=user_id), batch_size, pause, progress)
+    # What's left is a handful of rows (settings, a few contact messages)
+    User.objects.filter(pk=user_id).delete()
+    forget_user(user_id)
+    return messages
+
+
+def expired_conversations():
+    cutoff = timezone.now() - timedelta(days=settings.CHAT_RETENTION_DELETED_DAYS)
+    # delete_conversation sets updated_at when it hides the conversation
+    return Conversation.objects.filter(is_active=False, updated_at__lt=cutoff)
+
+
+def expired_jobs():
+    cutoff = timezone.now() - timedelta(days=settings.CHAT_RETENTION_JOB_DAYS)
+    return Job.objects.filter(status__in=['done', 'failed'], finished_at__lt=cutoff)
+
+
+def expired_idempotency_keys():
+    cutoff = timezone.now() - timedelta(seconds=settings.CHAT_IDEMPOTENCY_WINDOW)
+    # A pending key that old belongs to a request that died long ago
+    return IdempotencyKey.objects.filter(created_at__lt=cutoff)
+
+
+def purge_expired(batch_size=None, pause=None):
+    """Delete everything past its retention period. Returns counts by kind"""
+    counts = {'conversations': 0, 'messages': 0}
+    for conversation_id in list(expired_conversations().values_list('id', flat=True)):
+        counts['messages'] += purge_conversation(conversation_id, batch_size, pause)
+        counts['conversations'] += 1
+    counts['jobs'] = delete_in_batches(expired_jobs(), batch_size, pause)
+    counts['idempotency_keys'] = delete_in_batches(expired_idempotency_keys(), batch_size, pause)
+    return counts
@@ -0,0 +1,241 @@
+"""
+Per-user limits on the chat endpoints.
+
+Three limits, each answered with 429 and a Retry-After when hit:
+
+  rate        - a token bucket of CHAT_RATE_LIMIT_BURST requests, refilled
+                at CHAT_RATE_LIMIT_PER_MINUTE
+  concurrency - at most CHAT_RATE_LIMIT_CONCURRENT generations in flight;
+                a streamed reply counts until its stream ends, and with
+                the job queue on, a queued turn until its job finishes
+  tokens      - once CHAT_RATE_LIMIT_TOKENS_PER_MINUTE tokens (prompt plus
+                reply, estimated) have been used in the current minute, no
+                new turns until the next one
+
+State lives in the Django cache named by CHAT_RATE_LIMIT_ALIAS, so with a
+shared backend the limits hold across processes. A process-local backend
+(the default LocMemCache) would give every worker process its own
+counters, and a user N times every limit: outside DEBUG the chatBot.E002
+check refuses one for this alias and CHAT_BREAKER_ALIAS. Only atomic cache
+operations (add/incr/decr) are used, and the common path is three cache
+calls: with a local Redis or memcached the check costs a fraction of a
+millisecond (benchmarks/bench_rate_limit.py measures it).
+
+The bucket is kept as GCRA: one number per user, the time at which the
+bucket will be full again ("theoretical arrival time"), pushed forward
+by one refill interval per request with incr.
+"""
+import functools
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import Error, register
+from django.http import JsonResponse
+
+from .models import Job
+
+KEY_PREFIX = 'ratelimit:'
+
+# Backends whose entries only one process sees
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class RateLimiter:
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _incr(self, key, delta, timeout):
+        """incr() that creates the key first if it's missing or expired"""
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            self.cache.add(key, 0, timeout=timeout)
+            return self.cache.incr(key, delta)
+
+    def _interval(self):
+        """Milliseconds to refill one request"""
+        return 60_000 // settings.CHAT_RATE_LIMIT_PER_MINUTE
+
+    def take_request(self, user_id, now=None):
+        """Take one request from the user's bucket. Returns 0, or seconds until one is free"""
+        now_ms = int((now or time.time()) * 1000)
+        interval = self._interval()
+        capacity = interval * settings.CHAT_RATE_LIMIT_BURST  # ms of requests the bucket holds
+        key = f"{KEY_PREFIX}bucket:{user_id}"
+        timeout = math.ceil(capacity / 1000) + 1
+
+        full_at = self._incr(key, interval, timeout)
+        if full_at < now_ms + interval:
+            # The bucket has been full for a while: count from now. Two
+            # requests racing here can both pass, never more
+            full_at = now_ms + interval
+            self.cache.set(key, full_at, timeout=timeout)
+        if full_at - now_ms > capacity:
+            self.cache.decr(key, interval)
+            return (full_at - now_ms - capacity) / 1000
+        return 0
+
+    def refund_request(self, user_id):
+        """Put back a request taken by take_request()"""
+        try:
+            self.cache.decr(f"{KEY_PREFIX}bucket:{user_id}", self._interval())
+        except ValueError:
+            pass
+
+    def acquire_slot(self, user_id, queued=0):
+        """
+        Count a generation in flight, on top of `queued` ones the user already
+        has in the job queue. Returns False (and counts nothing) if at the cap
+        """
+        key = f"{KEY_PREFIX}inflight:{user_id}"
+        # Expires in case a process dies with slots held
+        if self._incr(key, 1, settings.CHAT_RATE_LIMIT_SLOT_TIMEOUT) + queued > settings.CHAT_RATE_LIMIT_CONCURRENT:
+            self.release_slot(user_id)
+            return False
+        return True
+
+    def release_slot(self, user_id):
+        try:
+            self.cache.decr(f"{KEY_PREFIX}inflight:{user_id}")
+        except ValueError:  # Expired meanwhile
+            pass
+
+    def _token_key(self, user_id, now):
+        return f"{KEY_PREFIX}tokens:{user_id}:{int(now // 60)}"
+
+    def tokens_exhausted(self, user_id, now=None):
+        """0, or seconds until the user's token budget for this minute resets"""
+        now = now or time.time()
+        used = self.cache.get(self._token_key(user_id, now), 0)
+        if used >= settings.CHAT_RATE_LIMIT_TOKENS_PER_MINUTE:
+            return 60 - now % 60
+        return 0
+
+    def add_tokens(self, user_id, tokens, now=None):
+        self._incr(self._token_key(user_id, now or time.time()), tokens, timeout=120)
+
+    def check(self, user_id, queued=0):
+        """
+        Admit one chat request: returns None with a slot held (release it
+        with release_slot), or (limit name, retry after seconds). `queued`
+        is the user's turns waiting in or being run by the job queue
+        """
+        wait = self.tokens_exhausted(user_id)
+        if wait:
+            return 'tokens', wait
+        wait = self.take_request(user_id)
+        if wait:
+            return 'rate', wait
+        if not self.acquire_slot(user_id, queued):
+            # Turned away without being served: don't charge the bucket
+            self.refund_request(user_id)
+            return 'concurrency', settings.CHAT_RATE_LIMIT_SLOT_RETRY
+        return None
+
+
+def get_rate_limiter():
+    return RateLimiter(caches[settings.CHAT_RATE_LIMIT_ALIAS])
+
+
+async def queued_turns(user_id):
+    """The user's chat turns queued or running, with the job queue on"""
+    if not settings.CHAT_QUEUE_ENABLED:
+        return 0
+    return await Job.objects.filter(user_id=user_id, kind='chat_turn', status__in=['queued', 'running']).acount()
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    """The limiter's and the circuit breakers' state must be seen by every process"""
+    if settings.DEBUG:
+        return []
+    aliases = {'CHAT_BREAKER_ALIAS': settings.CHAT_BREAKER_ALIAS}
+    if settings.CHAT_RATE_LIMIT_ENABLED:
+        aliases['CHAT_RATE_LIMIT_ALIAS'] = settings.CHAT_RATE_LIMIT_ALIAS
+    errors = []
+    for name, alias in aliases.items():
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend in LOCAL_BACKENDS:
+            errors.append(Error(
+                f"{name} names the cache {alias!r}, whose backend ({backend}) keeps its entries in one process",
+                hint="Point it at a cache every worker process shares, e.g. Redis or Memcached",
+                id='chatBot.E002'))
+    return errors
+
+
+def record_tokens(user_id, tokens):
+    """Charge a finished turn's tokens to the user's budget for this minute"""
+    if settings.CHAT_RATE_LIMIT_ENABLED:
+        get_rate_limiter().add_tokens(user_id, tokens)
+
+
+MESSAGES = {
+    'rate': "You're sending messages too quickly. Please wait a moment.",
+    'concurrency': "Please wait for your other replies to finish.",
+    'tokens': "You've used a lot of the AI service in the last minute. Please wait a moment.",
+}
+
+
+def _too_many_requests(limit, retry_after):
+    response = JsonResponse({'status': 'error', 'message': MESSAGES[limit], 'limit': limit}, status=429)
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def _release_when_streamed(response, release):
+    """Hold the slot until a streamed reply has been sent (or abandoned)"""
+    if response.is_async:
+        content = response.streaming_content
+
+        async def released():
+            try:
+                async for chunk in content:
+                    yield chunk
+            finally:
+                release()
+    else:
+        content = response.streaming_content
+
+        def released():
+            try:
+                yield from content
+            finally:
+                release()
+    response.streaming_content = released()
+
+
+def rate_limited(view):
+    """Apply the per-user chat limits to an async chat view (POST only)"""
+    @functools.wraps(view)
+    async def wrapped(request, *args, **kwargs):
+        if not settings.CHAT_RATE_LIMIT_ENABLED or request.method != 'POST':
+            return await view(request, *args, **kwargs)
+        user = await request.auser()
+        if not user.is_authenticated:
+            return await view(request, *args, **kwargs)
+
+        # Plain sync cache calls: each is one quick round trip, far cheaper
+        # than the thread hop of the async cache API
+        limiter = get_rate_limiter()
+        # The queued turns hold no slot: the request that queued one is over
+        denied = limiter.check(user.id, await queued_turns(user.id))
+        if denied:
+            return _too_many_requests(*denied)
+
+        release = functools.partial(limiter.release_slot, user.id)
+        try:
+            response = await view(request, *args, **kwargs)
+        except BaseException:
+            release()
+            raise
+        if response.streaming:
+            _release_when_streamed(response, release)
+        else:
+            release()
+        return response
+    return wrapped
@@ -0,0 +1,227 @@
+"""
+Circuit breaker and retries around each OpenRouter model.
+
+Every model has a circuit breaker whose state lives in the Django cache
+named by CHAT_BREAKER_ALIAS, so with a shared backend (Redis, Memcached,
+the database cache) every worker process sees the same circuit:
+
+  closed    - requests go through. CHAT_BREAKER_THRESHOLD upstream failures
+              in a row, within CHAT_BREAKER_WINDOW seconds, open it
+  open      - requests fail at once with CircuitOpen, for
+              CHAT_BREAKER_COOLDOWN seconds, instead of each one waiting out
+              the timeout; the fallback chain moves on to the next model
+  half-open - after the cooldown, one request (across all processes) is let
+              through as a probe: success closes the circuit, failure opens
+              it for another cooldown
+
+Retryable failures (5xx, 429, timeouts, dropped connections) are retried up
+to CHAT_RETRY_ATTEMPTS times with exponential backoff and full jitter,
+waiting at least as long as a Retry-After header asks. A Retry-After
+longer than CHAT_RETRY_MAX_DELAY isn't waited out here: the next model is
+tried instead.
+"""
+import asyncio
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .errors import AIServiceError, CircuitOpen
+from .hedging import ahedged, hedged
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'circuit:'
+
+
+class CircuitBreaker:
+    """One model's circuit, kept in a Django cache"""
+
+    def __init__(self, name, cache):
+        self.name = name
+        self.cache = cache
+        self._failures = f"{KEY_PREFIX}{name}:failures"
+        self._opened_at = f"{KEY_PREFIX}{name}:opened_at"
+        self._probe = f"{KEY_PREFIX}{name}:probe"
+
+    def state(self):
+        opened_at = self.cache.get(self._opened_at)
+        if opened_at is None:
+            return 'closed'
+        if time.time() - opened_at < settings.CHAT_BREAKER_COOLDOWN:
+            return 'open'
+        return 'half_open'
+
+    def retry_after(self):
+        """Seconds until the circuit lets a probe through (0 unless open)"""
+        opened_at = self.cache.get(self._opened_at)
+        if opened_at is None:
+            return 0
+        return max(opened_at + settings.CHAT_BREAKER_COOLDOWN - time.time(), 0)
+
+    def allow(self):
+        """May a request go out now?"""
+        state = self.state()
+        if state == 'closed':
+            return True
+        if state == 'open':
+            return False
+        # Half-open: add() is atomic in the cache, so exactly one caller wins
+        # the probe; it expires in case the prober dies without reporting back
+        return self.cache.add(self._probe, 1, timeout=settings.CHAT_BREAKER_COOLDOWN)
+
+    def record_success(self):
+        self.cache.delete_many([self._failures, self._opened_at, self._probe])
+
+    def record_failure(self):
+        state = self.state()
+        if state == 'half_open':
+            # The probe failed: another full cooldown
+            self._open()
+            return
+        if state == 'open':
+            return
+        self.cache.add(self._failures, 0, timeout=settings.CHAT_BREAKER_WINDOW)
+        try:
+            failures = self.cache.incr(self._failures)
+        except ValueError:  # Expired between add() and incr()
+            failures = 1
+            self.cache.set(self._failures, failures, timeout=settings.CHAT_BREAKER_WINDOW)
+        if failures >= settings.CHAT_BREAKER_THRESHOLD:
+            logger.warning("Circuit for %s opened after %s failures", self.name, failures,
+                           extra={'event': 'circuit.open', 'model': self.name})
+            self._open()
+
+    def _open(self):
+        self.cache.set(self._opened_at, time.time(), timeout=None)
+        self.cache.delete_many([self._failures, self._probe])
+
+    def check(self):
+        """Raise CircuitOpen unless a request may go out now"""
+        if not self.allow():
+            raise CircuitOpen("The AI service is having problems right now. Please try again shortly.",
+                              retry_after=self.retry_after() or settings.CHAT_BREAKER_COOLDOWN)
+
+    def record(self, error):
+        """Count an error against the circuit if it was upstream's fault"""
+        if error.retryable:
+            self.record_failure()
+        else:
+            # Upstream answered, it just didn't like the request
+            self.record_success()
+
+
+def get_breaker(model):
+    return CircuitBreaker(model, caches[settings.CHAT_BREAKER_ALIAS])
+
+
+def circuit_states():
+    """{model: state} for every model in CHAT_MODELS"""
+    return {model: get_breaker(model).state() for model in settings.CHAT_MODELS}
+
+
+def backoff_delay(attempt, error):
+    """Seconds to wait before retry number attempt + 1"""
+    # Full jitter: spread the retries of many requests failing together
+    delay = random.uniform(0, min(settings.CHAT_RETRY_BASE_DELAY * 2 ** attempt, settings.CHAT_RETRY_MAX_DELAY))
+    if error.retry_after is not None:
+        delay = max(delay, error.retry_after)
+    return delay
+
+
+def should_retry(error, attempt):
+    if not error.retryable or attempt >= settings.CHAT_RETRY_ATTEMPTS:
+        return False
+    # Upstream wants a longer break than we'll make the user wait
+    return error.retry_after is None or error.retry_after <= settings.CHAT_RETRY_MAX_DELAY
+
+
+def call_model(model, call):
+    """
+    call(), a completion request to `model`, behind the model's circuit
+    breaker, hedged and retried with backoff
+    """
+    breaker = get_breaker(model)
+    attempt = 0
+    while True:
+        breaker.check()
+        try:
+            result = hedged(call, model)
+        except AIServiceError as e:
+            breaker.record(e)
+            if not should_retry(e, attempt):
+                raise
+            time.sleep(backoff_delay(attempt, e))
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+async def acall_model(model, acall):
+    """Async version of call_model(): acall() is awaited"""
+    breaker = get_breaker(model)
+    attempt = 0
+    while True:
+        breaker.check()
+        try:
+            result = await ahedged(acall, model)
+        except AIServiceError as e:
+            breaker.record(e)
+            if not should_retry(e, attempt):
+                raise
+            await asyncio.sleep(backoff_delay(attempt, e))
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+def stream_model(model, open_stream):
+    """
+    Relay open_stream(), a streamed completion from `model`, behind its
+    circuit breaker. A stream that fails before its first token is retried
+    like call_model(); once tokens have gone out it can't be.
+    """
+    breaker = get_breaker(model)
+    attempt = 0
+    while True:
+        breaker.check()
+        started = False
+        try:
+            for delta in open_stream():
+                started = True
+                yield delta
+        except AIServiceError as e:
+            breaker.record(e)
+            if started or not should_retry(e, attempt):
+                raise
+            time.sleep(backoff_delay(attempt, e))
+            attempt += 1
+            continue
+        breaker.record_success()
+        return
+
+
+async def astream_model(model, open_stream):
+    """Async version of stream_model(); open_stream() returns an async iterator"""
+    breaker = get_breaker(model)
+    attempt = 0
+    while True:
+        breaker.check()
+        started = False
+        try:
+            async for delta in open_stream():
+                started = True
+                yield delta
+        except AIServiceError as e:
+            breaker.record(e)
+            if started or not should_retry(e, attempt):
+                raise
+            await asyncio.sleep(backoff_delay(attempt, e))
+            attempt += 1
+            continue
+        breaker.record_success()
+        return
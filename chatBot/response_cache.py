@@ -0,0 +1,158 @@
+"""
+Exact-match cache for chat completions.
+
+Replies are keyed on a hash of the canonical request payload (model,
+messages and generation parameters), so only an identical request is
+answered from the cache. It is meant for the openers many users send with
+no prior context ("hi", "what can you do?"): requests carrying more than
+CHAT_RESPONSE_CACHE_MAX_MESSAGES messages skip it, so long conversations
+that will never repeat don't push those entries out.
+
+CHAT_RESPONSE_CACHE picks the backend:
+  'local'  - an in-process LRU with a TTL, for a single worker
+  'django' - the Django cache named by CHAT_RESPONSE_CACHE_ALIAS, shared by
+             every worker; how it evicts is up to that cache's own config
+Anything else (the default, '') turns the cache off.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+KEY_PREFIX = 'chat-reply:'
+
+
+def cache_key(payload):
+    """Hash of everything in the request that shapes the reply"""
+    # Streamed or not, the reply is the same
+    canonical = {key: value for key, value in payload.items() if key != 'stream'}
+    raw = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class LocalResponseCache:
+    """Size-bounded LRU with a TTL, guarded by a lock for worker threads"""
+
+    def __init__(self, max_entries, ttl, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (expires_at, reply), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                del self._entries[key]
+                self._counts['expirations'] += 1
+                entry = None
+            if entry is None:
+                self._counts['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counts['hits'] += 1
+            return entry[1]
+
+    def set(self, key, reply):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._counts, 'size': len(self._entries)}
+
+
+class DjangoResponseCache:
+    """
+    Replies in a Django cache shared by every worker. Hit and miss counts are
+    kept in the same cache so they cover all processes; evictions happen
+    inside the cache backend and can't be counted from here.
+    """
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def _count(self, name):
+        key = f"{KEY_PREFIX}stats:{name}"
+        try:
+            self.cache.incr(key)
+        except ValueError:  # First one (or the backend dropped it)
+            self.cache.add(key, 0, timeout=None)
+            self.cache.incr(key)
+
+    def get(self, key):
+        reply = self.cache.get(KEY_PREFIX + key)
+        self._count('hits' if reply is not None else 'misses')
+        return reply
+
+    def set(self, key, reply):
+        self.cache.set(KEY_PREFIX + key, reply, timeout=self.ttl)
+
+    def stats(self):
+        names = ['hits', 'misses']
+        counts = self.cache.get_many([f"{KEY_PREFIX}stats:{name}" for name in names])
+        return {name: counts.get(f"{KEY_PREFIX}stats:{name}", 0) for name in names}
+
+
+_cache = None
+_cache_config = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The configured cache (rebuilt if the settings change), or None when off"""
+    global _cache, _cache_config
+    config = (settings.CHAT_RESPONSE_CACHE, settings.CHAT_RESPONSE_CACHE_ALIAS,
+              settings.CHAT_RESPONSE_CACHE_SIZE, settings.CHAT_RESPONSE_CACHE_TTL)
+    if config != _cache_config:
+        with _cache_lock:
+            if config != _cache_config:
+                backend, alias, size, ttl = config
+                if backend == 'local':
+                    _cache = LocalResponseCache(size, ttl)
+                elif backend == 'django':
+                    _cache = DjangoResponseCache(alias, ttl)
+                else:
+                    _cache = None
+                _cache_config = config
+    return _cache
+
+
+def reset_response_cache():
+    """Drop the cache object (tests and settings changes use this)"""
+    global _cache, _cache_config
+    with _cache_lock:
+        _cache = None
+        _cache_config = None
+
+
+def cached_reply(payload):
+    """The stored reply for this request payload, or None"""
+    cache = get_response_cache()
+    if cache is None or len(payload['messages']) > settings.CHAT_RESPONSE_CACHE_MAX_MESSAGES:
+        return None
+    reply = cache.get(cache_key(payload))
+    metrics.RESPONSE_CACHE.inc('hit' if reply is not None else 'miss')
+    return reply
+
+
+def store_reply(payload, reply):
+    """Remember a successful reply to this request payload"""
+    cache = get_response_cache()
+    if cache is None or len(payload['messages']) > settings.CHAT_RESPONSE_CACHE_MAX_MESSAGES:
+        return
+    cache.set(cache_key(payload), reply)
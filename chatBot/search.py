@@ -0,0 +1,194 @@
+"""
+Full-text search over a user's messages.
+
+Backed by the index made in migration 0010: an FTS5 table on SQLite, a GIN
+indexed tsvector column on Postgres. Other databases fall back to an
+unindexed LIKE, which is fine for a development database and nothing more.
+
+Results are messages ranked by relevance (bm25 / ts_rank), with a snippet
+around the match. Snippets come back HTML-escaped with the matched words
+in <mark>, so the client can insert them as they are.
+
+SQLite drops a table's triggers without a word when a migration rebuilds
+the table, and search would quietly stop seeing new messages. The
+chatBot.E001 check (run by migrate and the test runner) fails when any
+part of the index is missing.
+"""
+import re
+
+from django.core.checks import Error, Tags, register
+from django.db import connection, connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from .models import Message
+
+# Words of context either side of a match in a snippet
+SNIPPET_WORDS = 16
+# Snippet markers from the database, swapped for <mark> after escaping
+START, STOP = '\x02', '\x03'
+
+WORD = re.compile(r'\w+')
+
+# What migration 0010 made, by database
+INDEX_MIGRATION = '0010_message_search'
+SQLITE_INDEX = (
+    'chatBot_message_fts',
+    'chatBot_message_fts_insert',
+    'chatBot_message_fts_delete',
+    'chatBot_message_fts_update',
+    'chatBot_conversation_fts_hide',
+    'chatBot_conversation_fts_show',
+)
+POSTGRES_INDEX = ('search_vector', 'message_search_idx')
+
+
+def search_terms(query):
+    """The words of a search box query; punctuation and operators are dropped"""
+    return WORD.findall(query.lower())
+
+
+def match_expression(terms):
+    """
+    FTS5 query for all the terms, the last one as a prefix so results show
+    up while the user is still typing it. Each term is quoted: user input
+    never reaches FTS5 as syntax.
+    """
+    return ' '.join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+
+
+def ts_query(terms):
+    """The Postgres counterpart of match_expression()"""
+    return ' & '.join(terms[:-1] + [f"{terms[-1]}:*"])
+
+
+def highlight(snippet):
+    return escape(snippet).replace(START, '<mark>').replace(STOP, '</mark>')
+
+
+def _sqlite_search(terms, user_id, limit, offset):
+    # One query: the index finds and ranks the rows, the joins scope them to
+    # the user (soft-deleted conversations aren't in the index)
+    sql = f"""
+        SELECT m.id, m.conversation_id, m.role, m.timestamp, c.title AS conversation_title,
+               snippet(chatBot_message_fts, 0, %s, %s, '...', {SNIPPET_WORDS}) AS snippet
+        FROM chatBot_message_fts
+        JOIN chatBot_message m ON m.id = chatBot_message_fts.rowid
+        JOIN chatBot_conversation c ON c.id = m.conversation_id
+        WHERE chatBot_message_fts MATCH %s AND c.user_id = %s
+        ORDER BY chatBot_message_fts.rank, m.id DESC
+        LIMIT %s OFFSET %s
+    """
+    return Message.objects.raw(sql, [START, STOP, match_expression(terms), user_id, limit, offset])
+
+
+def _postgres_search(terms, user_id, limit, offset):
+    # Same config as the generated column, or the index can't be used
+    sql = f"""
+        SELECT m.id, m.conversation_id, m.role, m.timestamp, c.title AS conversation_title,
+               ts_headline('english', m.content, q.query,
+                           'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords={SNIPPET_WORDS * 2}, '
+                           'MinWords={SNIPPET_WORDS // 2}') AS snippet
+        FROM "chatBot_message" m
+        JOIN "chatBot_conversation" c ON c.id = m.conversation_id,
+             to_tsquery('english', %s) AS q(query)
+        WHERE m.search_vector @@ q.query AND c.user_id = %s AND c.is_active
+        ORDER BY ts_rank(m.search_vector, q.query) DESC, m.id DESC
+        LIMIT %s OFFSET %s
+    """
+    return Message.objects.raw(sql, [START, STOP, ts_query(terms), user_id, limit, offset])
+
+
+def _like_search(terms, user_id, limit, offset):
+    messages = Message.objects.filter(conversation__user_id=user_id, conversation__is_active=True)
+    for term in terms:
+        messages = messages.filter(content__icontains=term)
+    rows = list(messages.select_related('conversation').order_by('-timestamp', '-id')[offset:offset + limit])
+    for message in rows:
+        message.conversation_title = message.conversation.title
+        message.snippet = _python_snippet(message.content, terms)
+    return rows
+
+
+def _python_snippet(content, terms):
+    words = content.split()
+    hits = [i for i, word in enumerate(words) if any(term in word.lower() for term in terms)]
+    start = max(hits[0] - SNIPPET_WORDS // 2, 0) if hits else 0
+    shown = [f"{START}{word}{STOP}" if i in hits else word
+             for i, word in enumerate(words[start:start + SNIPPET_WORDS], start)]
+    return ('...' if start else '') + ' '.join(shown) + ('...' if start + SNIPPET_WORDS < len(words) else '')
+
+
+SEARCHES = {
+    'sqlite': _sqlite_search,
+    'postgresql': _postgres_search,
+}
+
+
+def search_messages(user_id, query, limit, offset=0):
+    """
+    The user's messages matching every word of query, best match first:
+    up to `limit` messages with conversation_title and snippet attributes
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    search = SEARCHES.get(connection.vendor, _like_search)
+    return list(search(terms, user_id, limit, offset))
+
+
+def matching_messages(query):
+    """
+    Every message in a live conversation, whoever it belongs to, matching
+    query, unordered (for the admin search)
+    """
+    terms = search_terms(query)
+    if not terms:
+        return Message.objects.none()
+    messages = Message.objects.filter(conversation__is_active=True)
+    if connection.vendor == 'sqlite':
+        return messages.filter(id__in=RawSQL(
+            "SELECT rowid FROM chatBot_message_fts WHERE chatBot_message_fts MATCH %s", [match_expression(terms)]))
+    if connection.vendor == 'postgresql':
+        # search_vector is the generated column, not a model field
+        return messages.alias(matched=RawSQL(
+            '"chatBot_message"."search_vector" @@ to_tsquery(\'english\', %s)', [ts_query(terms)],
+            output_field=BooleanField())).filter(matched=True)
+    for term in terms:
+        messages = messages.filter(content__icontains=term)
+    return messages
+
+
+def missing_index(db):
+    """Names of the tables, triggers, columns or indexes of the search index missing from the database"""
+    with db.cursor() as cursor:
+        if db.vendor == 'sqlite':
+            cursor.execute(
+                f"SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') "
+                f"AND name IN ({', '.join(['%s'] * len(SQLITE_INDEX))})", SQLITE_INDEX)
+            found = {name for name, in cursor.fetchall()}
+            return [name for name in SQLITE_INDEX if name not in found]
+        if db.vendor == 'postgresql':
+            found = {column.name for column in db.introspection.get_table_description(cursor, Message._meta.db_table)}
+            found |= set(db.introspection.get_constraints(cursor, Message._meta.db_table))
+            return [name for name in POSTGRES_INDEX if name not in found]
+    return []
+
+
+@register(Tags.database)
+def check_search_index(app_configs, databases=None, **kwargs):
+    errors = []
+    for alias in databases or []:
+        db = connections[alias]
+        if ('chatBot', INDEX_MIGRATION) not in MigrationRecorder(db).applied_migrations():
+            continue
+        missing = missing_index(db)
+        if missing:
+            errors.append(Error(
+                f"The full-text search index of database {alias!r} is missing {', '.join(missing)}",
+                hint="A migration that rebuilt chatBot_message or chatBot_conversation dropped them: "
+                     "create them again there, as chatBot/migrations/0010_message_search.py does",
+                id='chatBot.E001'))
+    return errors
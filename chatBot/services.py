@@ -1,79 +1,530 @@
 import os
+import asyncio
+import threading
+import time
+import weakref
+import httpx
 import requests
 import json
+import logging
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from django.conf import settings
 
+from . import metrics, profiling
+from .errors import AIServiceError, NotConfigured, UpstreamError, error_for_response
+from .hedging import awith_fallbacks, chat_models, current_attempt, get_upstream_stats, with_fallbacks
+from .resilience import acall_model, astream_model, call_model, stream_model
+from .response_cache import cached_reply, store_reply
+
+MISSING_API_KEY_MESSAGE = "Error: OpenRouter API key not configured. Please check your .env file."
+
+# Characters of an upstream error body kept in the log: enough to see what
+# went wrong without writing out whole HTML error pages
+ERROR_DETAIL_CHARS = 300
+
+logger = logging.getLogger(__name__)
+
+# One HTTP session per process, shared by every worker thread, so each chat
+# turn reuses a kept-alive connection to OpenRouter instead of paying a new
+# TCP + TLS handshake
+_http_session = None
+_http_session_lock = threading.Lock()
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_session():
+    """
+    Return the process-wide pooled session used for OpenRouter calls
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = _build_http_session()
+    return _http_session
+
+
+def reset_http_session():
+    """
+    Close the shared session (tests and settings changes use this)
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is not None:
+            _http_session.close()
+        _http_session = None
+
+
+class _HedgedConnection:
+    """
+    Tells the hedged attempt a request runs for (see hedging.Attempt) which
+    connection it is on, so the attempt can be cancelled if it loses
+    """
+
+    def request(self, *args, **kwargs):
+        attempt = current_attempt()
+        if attempt is not None and not attempt.track(self):
+            raise ConnectionAbortedError("The other request of the hedged pair already answered")
+        return super().request(*args, **kwargs)
+
+
+class _HedgedHTTPConnection(_HedgedConnection, HTTPConnection):
+    pass
+
+
+class _HedgedHTTPSConnection(_HedgedConnection, HTTPSConnection):
+    pass
+
+
+class _HedgedPool:
+    def _put_conn(self, conn):
+        # Back in the pool, the connection is no longer the attempt's to cut
+        attempt = current_attempt()
+        if attempt is not None and conn is not None:
+            attempt.untrack(conn)
+        super()._put_conn(conn)
+
+
+class _HedgedHTTPConnectionPool(_HedgedPool, HTTPConnectionPool):
+    ConnectionCls = _HedgedHTTPConnection
+
+
+class _HedgedHTTPSConnectionPool(_HedgedPool, HTTPSConnectionPool):
+    ConnectionCls = _HedgedHTTPSConnection
+
+
+def _build_http_session():
+    session = requests.Session()
+    # The session is shared between threads, so never keep cookies on it
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # pool_block keeps the number of open sockets bounded: when every
+    # connection is busy, the next thread waits for one instead of opening more
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.OPENROUTER_POOL_SIZE,
+        pool_block=True,
+        max_retries=0,
+    )
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': _HedgedHTTPConnectionPool,
+        'https': _HedgedHTTPSConnectionPool,
+    }
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_async_http_client():
+    """
+    Return the pooled async client for the running event loop
+
+    httpx connections belong to the loop that opened them, so each loop
+    (normally just the one ASGI loop) gets its own client.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None:
+        pool_size = settings.OPENROUTER_ASYNC_POOL_SIZE
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(settings.OPENROUTER_READ_TIMEOUT, connect=settings.OPENROUTER_CONNECT_TIMEOUT),
+        )
+        _async_http_clients[loop] = client
+    return client
+
+
+def _timeouts():
+    # (connect, read) timeouts: fail fast on a dead host, but give the
+    # model time to generate
+    return (settings.OPENROUTER_CONNECT_TIMEOUT, settings.OPENROUTER_READ_TIMEOUT)
+
+
+def parse_stream_line(line):
+    """
+    Return the text carried by one SSE line of a streamed completion:
+    '' for keep-alives/comments/empty deltas, None once the stream is [DONE]
+    """
+    if not line or not line.startswith('data:'):
+        return ''
+    data = line[len('data:'):].strip()
+    if data == '[DONE]':
+        return None
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        return ''
+    choices = chunk.get('choices') or []
+    if not choices:
+        return ''
+    return (choices[0].get('delta') or {}).get('content') or ''
+
+
+def log_upstream(model, seconds, code, messages, detail=None):
+    """One upstream.request record per OpenRouter request, a warning if it failed"""
+    fields = {
+        'event': 'upstream.request',
+        'model': model,
+        'code': code,
+        'duration_ms': round(seconds * 1000, 1),
+        'messages_sent': messages,
+    }
+    if code is None:
+        logger.info("OpenRouter request to %s done", model, extra=fields)
+        return
+    if detail:
+        fields['detail'] = detail[:ERROR_DETAIL_CHARS]
+    logger.warning("OpenRouter request to %s failed (%s)", model, code, extra=fields)
+
+
+def parse_stream_usage(line):
+    """The usage field of a streamed chunk (the last one carries it), or None"""
+    try:
+        return json.loads(line[len('data:'):]).get('usage')
+    except (ValueError, AttributeError):
+        return None
+
+
 class DeepSeekService:
     @staticmethod
-    def send_message(message_history):
+    def build_request(message_history, stream=False, max_tokens=None, model=None):
         """
-        Send messages to OpenRouter API and return the response
+        Build the (url, headers, payload) for one chat completion request,
+        to the first of CHAT_MODELS unless a model is given
         """
-        api_key = settings.DEEPSEEK_API_KEY
-        
-        if not api_key:
-            return "Error: OpenRouter API key not configured. Please check your .env file."
-        
         # OpenRouter API endpoint (NOT DeepSeek direct)
-        url = "https://openrouter.ai/api/v1/chat/completions"
+        url = settings.OPENROUTER_API_URL
         
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
+            "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
             "HTTP-Referer": "http://localhost:8000",  #  OpenRouter
             "X-Title": "chatBot"  #  OpenRouter
         }
         
         payload = {
-            "model": "deepseek/deepseek-chat",  # OpenRouter model format
+            "model": model or chat_models()[0],  # OpenRouter model format
             "messages": message_history,
-            "stream": False,
-            "max_tokens": 2048
+            "stream": stream,
+            "max_tokens": max_tokens or settings.CHAT_MAX_TOKENS
         }
+        return url, headers, payload
+    
+    @staticmethod
+    def complete(message_history, max_tokens=None):
+        """
+        Send messages to OpenRouter API and return the reply text, hedging
+        slow requests and falling back along CHAT_MODELS (see hedging.py),
+        each model behind a circuit breaker with retries (see resilience.py).
+        Raises AIServiceError (with a user-facing message) if every model fails
+        """
+        if not settings.DEEPSEEK_API_KEY:
+            raise NotConfigured(MISSING_API_KEY_MESSAGE)
+        
+        return with_fallbacks(lambda model: call_model(
+            model, lambda: DeepSeekService.complete_once(model, message_history, max_tokens)))
+    
+    @staticmethod
+    def complete_once(model, message_history, max_tokens=None):
+        """One completion request to one model. Raises AIServiceError if it fails"""
+        url, headers, payload = DeepSeekService.build_request(message_history, max_tokens=max_tokens, model=model)
+        start = time.perf_counter()
+        code = None
+        detail = None
         
         try:
-            print(f"Sending request to OpenRouter API...")
-            print(f"API Key exists: {bool(api_key)}")
-            print(f"Message history length: {len(message_history)}")
+            response = get_http_session().post(url, headers=headers, json=payload, timeout=_timeouts())
             
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
+            if response.status_code != 200:
+                code = response.status_code
+                detail = response.text
+                raise error_for_response(response.status_code, detail, response.headers.get('Retry-After'))
             
-            print(f"Response status: {response.status_code}")
+            result = response.json()
+            reply = result['choices'][0]['message']['content']
+            metrics.upstream_usage(model, result.get('usage'))
+            return reply
+        
+        except requests.exceptions.RequestException as e:
+            attempt = current_attempt()
+            # The losing request of a hedged pair, cut off on purpose
+            code = 'cancelled' if attempt is not None and attempt.cancelled else 'connection'
+            detail = str(e)
+            raise UpstreamError(f"Sorry, I'm having trouble connecting to the AI service. Error: {str(e)}") from e
+        
+        except (KeyError, IndexError) as e:
+            code = 'parse'
+            detail = response.text
+            raise AIServiceError("Sorry, I encountered an error processing the AI response.") from e
+        
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.upstream_request(model, seconds, code)
+            profiling.upstream_request(model, seconds, code)
+            log_upstream(model, seconds, code, len(message_history), detail)
+    
+    @staticmethod
+    async def acomplete(message_history, max_tokens=None):
+        """Async version of complete(), awaited on the event loop"""
+        if not settings.DEEPSEEK_API_KEY:
+            raise NotConfigured(MISSING_API_KEY_MESSAGE)
+        
+        return await awith_fallbacks(lambda model: acall_model(
+            model, lambda: DeepSeekService.acomplete_once(model, message_history, max_tokens)))
+    
+    @staticmethod
+    async def acomplete_once(model, message_history, max_tokens=None):
+        """Async version of complete_once()"""
+        url, headers, payload = DeepSeekService.build_request(message_history, max_tokens=max_tokens, model=model)
+        start = time.perf_counter()
+        code = None
+        detail = None
+        
+        try:
+            response = await get_async_http_client().post(url, headers=headers, json=payload)
             
-            # If we get a non-200 response, show the error
             if response.status_code != 200:
-                error_detail = response.text
-                print(f"API Error {response.status_code}: {error_detail}")
-                return f"API Error {response.status_code}: {error_detail}"
-            
-            response.raise_for_status()
+                code = response.status_code
+                detail = response.text
+                raise error_for_response(response.status_code, detail, response.headers.get('Retry-After'))
             
             result = response.json()
-            print(f"API Response received successfully")
-            print(f"Model used: {result.get('model', 'Unknown')}")
-            return result['choices'][0]['message']['content']
+            reply = result['choices'][0]['message']['content']
+            metrics.upstream_usage(model, result.get('usage'))
+            return reply
+        
+        except httpx.HTTPError as e:
+            code = 'connection'
+            detail = str(e)
+            raise UpstreamError(f"Sorry, I'm having trouble connecting to the AI service. Error: {str(e)}") from e
+        
+        except (KeyError, IndexError, ValueError) as e:
+            code = 'parse'
+            detail = str(e)
+            raise AIServiceError("Sorry, I encountered an error processing the AI response.") from e
+        
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.upstream_request(model, seconds, code)
+            profiling.upstream_request(model, seconds, code)
+            log_upstream(model, seconds, code, len(message_history), detail)
+    
+    @staticmethod
+    def send_message(message_history, fresh=False):
+        """
+        Send messages to OpenRouter API and return the response. An
+        identical earlier request may be answered from the response cache
+        unless fresh is set. Raises AIServiceError if the call failed: the
+        error is never a reply to save.
+        """
+        payload = DeepSeekService.build_request(message_history)[2]
+        if not fresh:
+            reply = cached_reply(payload)
+            if reply is not None:
+                return reply
+        
+        reply = DeepSeekService.complete(message_history)
+        store_reply(payload, reply)
+        return reply
+    
+    @staticmethod
+    async def asend_message(message_history, fresh=False):
+        """
+        Async version of send_message for ASGI: the OpenRouter call is awaited
+        on the event loop instead of holding a worker thread until it returns
+        """
+        payload = DeepSeekService.build_request(message_history)[2]
+        if not fresh:
+            reply = cached_reply(payload)
+            if reply is not None:
+                return reply
+        
+        reply = await DeepSeekService.acomplete(message_history)
+        store_reply(payload, reply)
+        return reply
+    
+    @staticmethod
+    def stream_message(message_history, fresh=False):
+        """
+        Stream the reply from OpenRouter, yielding text chunks as they arrive.
+        A cached reply comes back as a single chunk. A model that fails
+        before sending anything is passed over for the next in CHAT_MODELS.
+        Raises AIServiceError when no model can answer, or one fails mid-reply.
+        """
+        payload = DeepSeekService.build_request(message_history, stream=True)[2]
+        if not fresh:
+            reply = cached_reply(payload)
+            if reply is not None:
+                yield reply
+                return
+        
+        if not settings.DEEPSEEK_API_KEY:
+            raise NotConfigured(MISSING_API_KEY_MESSAGE)
+        
+        stats = get_upstream_stats()
+        stats.count('requests')
+        models = chat_models()
+        chunks = []
+        for index, model in enumerate(models):
+            if index:
+                stats.count('fallbacks')
+            try:
+                for delta in stream_model(model, lambda: DeepSeekService._stream_once(model, message_history)):
+                    chunks.append(delta)
+                    yield delta
+            except AIServiceError as e:
+                # Too late to switch models once part of the reply is out
+                if chunks or index == len(models) - 1:
+                    stats.count('failures')
+                    raise
+                logger.warning("Model %s failed: %s", model, e, extra={'event': 'upstream.fallback', 'model': model})
+                continue
+            # Only reached if the stream wasn't cut short
+            store_reply(payload, ''.join(chunks))
+            return
+    
+    @staticmethod
+    def _stream_once(model, message_history):
+        """Stream one model's reply. Raises AIServiceError if the request fails"""
+        url, headers, payload = DeepSeekService.build_request(message_history, stream=True, model=model)
+        start = time.perf_counter()
+        first_token = True
+        code = None
+        detail = None
+        try:
+            with get_http_session().post(url, headers=headers, json=payload,
+                                         timeout=_timeouts(), stream=True) as response:
+                if response.status_code != 200:
+                    code = response.status_code
+                    detail = response.text
+                    raise error_for_response(response.status_code, detail, response.headers.get('Retry-After'))
+                
+                # SSE is always UTF-8; chunk_size=None hands lines over as soon as they arrive
+                response.encoding = 'utf-8'
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    delta = parse_stream_line(line)
+                    if delta is None:
+                        break
+                    if delta:
+                        if first_token:
+                            metrics.UPSTREAM_FIRST_TOKEN.observe(time.perf_counter() - start, model)
+                            first_token = False
+                        yield delta
+                    elif '"usage"' in line:
+                        metrics.upstream_usage(model, parse_stream_usage(line))
         
         except requests.exceptions.RequestException as e:
-            print(f"API Request Error: {e}")
-            return f"Sorry, I'm having trouble connecting to the AI service. Error: {str(e)}"
+            code = 'connection'
+            detail = str(e)
+            raise UpstreamError(f"Sorry, I'm having trouble connecting to the AI service. Error: {str(e)}") from e
         
-        except (KeyError, IndexError) as e:
-            print(f"Response parsing error: {e}")
-            if 'response' in locals():
-                print(f"Response content: {response.text}")
-            return "Sorry, I encountered an error processing the AI response."
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.upstream_request(model, seconds, code)
+            profiling.upstream_request(model, seconds, code)
+            log_upstream(model, seconds, code, len(message_history), detail)
     
     @staticmethod
-    def format_message_history(messages_queryset):
+    async def astream_message(message_history, fresh=False):
         """
-        Convert Django messages queryset to API format
+        Async version of stream_message for ASGI, so a long generation
+        doesn't hold a worker thread
+        """
+        payload = DeepSeekService.build_request(message_history, stream=True)[2]
+        if not fresh:
+            reply = cached_reply(payload)
+            if reply is not None:
+                yield reply
+                return
+        
+        if not settings.DEEPSEEK_API_KEY:
+            raise NotConfigured(MISSING_API_KEY_MESSAGE)
+        
+        stats = get_upstream_stats()
+        stats.count('requests')
+        models = chat_models()
+        chunks = []
+        for index, model in enumerate(models):
+            if index:
+                stats.count('fallbacks')
+            try:
+                async for delta in astream_model(model, lambda: DeepSeekService._astream_once(model, message_history)):
+                    chunks.append(delta)
+                    yield delta
+            except AIServiceError as e:
+                if chunks or index == len(models) - 1:
+                    stats.count('failures')
+                    raise
+                logger.warning("Model %s failed: %s", model, e, extra={'event': 'upstream.fallback', 'model': model})
+                continue
+            store_reply(payload, ''.join(chunks))
+            return
+    
+    @staticmethod
+    async def _astream_once(model, message_history):
+        """Async version of _stream_once()"""
+        url, headers, payload = DeepSeekService.build_request(message_history, stream=True, model=model)
+        start = time.perf_counter()
+        first_token = True
+        code = None
+        detail = None
+        try:
+            async with get_async_http_client().stream('POST', url, headers=headers, json=payload) as response:
+                if response.status_code != 200:
+                    code = response.status_code
+                    detail = (await response.aread()).decode('utf-8', 'replace')
+                    raise error_for_response(response.status_code, detail, response.headers.get('Retry-After'))
+                
+                async for line in response.aiter_lines():
+                    delta = parse_stream_line(line)
+                    if delta is None:
+                        break
+                    if delta:
+                        if first_token:
+                            metrics.UPSTREAM_FIRST_TOKEN.observe(time.perf_counter() - start, model)
+                            first_token = False
+                        yield delta
+                    elif '"usage"' in line:
+                        metrics.upstream_usage(model, parse_stream_usage(line))
+        
+        except httpx.HTTPError as e:
+            code = 'connection'
+            detail = str(e)
+            raise UpstreamError(f"Sorry, I'm having trouble connecting to the AI service. Error: {str(e)}") from e
+        
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.upstream_request(model, seconds, code)
+            profiling.upstream_request(model, seconds, code)
+            log_upstream(model, seconds, code, len(message_history), detail)
+    
+    @staticmethod
+    def format_message_history(messages_queryset, summary='', recalled=()):
+        """
+        Convert Django messages queryset to API format, led by the rolling
+        summary of older turns and any older messages recalled as relevant
         """
         message_history = []
         
+        if summary:
+            message_history.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary}"
+            })
+        
+        if recalled:
+            lines = "\n".join(f"{msg.role}: {msg.content}" for msg in recalled)
+            message_history.append({
+                "role": "system",
+                "content": f"Earlier messages that may be relevant:\n{lines}"
+            })
+        
         for msg in messages_queryset:
             message_history.append({
                 "role": msg.role,
                 "content": msg.content
             })
             
-        return message_history
\ No newline at end of file
+        return message_history
@@ -5,6 +5,7 @@ from django.contrib import messages
 from django.core.mail import send_mail
 from django.conf import settings as django_settings
 from .models import UserSettings, ContactMessage
+from .jobs import enqueue_account_deletion
 from django.contrib.auth import logout
 
 @login_required
@@ -127,11 +128,12 @@ def account_view(request):
             user = request.user
             logout(request)
             
-            # Delete the user account
-            user.delete()
+            # Deactivated now, deleted by a worker (manage.py purge or
+            # run_worker) in batches: a big account is too much for one request
+            enqueue_account_deletion(user)
             
             # Show success message
-            messages.success(request, f'Account "{username}" has been permanently deleted.')
+            messages.success(request, f'Account "{username}" has been closed. Its data will be permanently deleted shortly.')
             return redirect('home')  # Goes to your home page
             
         else:
@@ -0,0 +1,167 @@
+"""
+Rolling summaries of long conversations.
+
+After each turn the view calls schedule_summary(), which hands the work to a
+single background thread. That thread folds every message that has left the
+live window (the newest CHAT_SUMMARY_WINDOW_TOKENS) into the conversation's
+ConversationSummary, a chunk at a time, and moves its watermark forward.
+Messages at or below the watermark, in (timestamp, id) order, are never
+summarized again, and the context builder never sends them raw.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .context import BATCH_SIZE, estimate_tokens, tokens_for_length, unsummarized
+from .models import ConversationSummary
+from .services import AIServiceError, DeepSeekService
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a long conversation between a user and an AI assistant. "
+    "Merge the new messages into the current summary. Keep facts about the user, names, preferences, "
+    "decisions, and open questions; drop small talk. Reply with the updated summary only."
+)
+
+# Most messages pulled into one summarization call
+CHUNK_MESSAGES = 200
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-summary')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def schedule_summary(conversation_id):
+    """
+    Queue a summary update for the conversation unless one is already queued
+    """
+    if not settings.CHAT_SUMMARY_ENABLED:
+        return
+    with _pending_lock:
+        if conversation_id in _pending:
+            return
+        _pending.add(conversation_id)
+    _executor.submit(_run, conversation_id)
+
+
+def _run(conversation_id):
+    try:
+        update_summary(conversation_id)
+    except AIServiceError as e:
+        # Try again after a later turn; the watermark hasn't moved
+        logger.info("Summary update skipped for conversation %s: %s", conversation_id, e)
+    except Exception:
+        logger.exception("Summary update failed for conversation %s", conversation_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(conversation_id)
+        # This thread outlives requests, so it must give its connection back itself
+        connection.close()
+
+
+def window_query(conversation_id, through_at, through_id):
+    """(timestamp, id, length) of the unsummarized messages, newest first"""
+    return (unsummarized(conversation_id, through_at, through_id)
+            .order_by('-timestamp', '-id')
+            .annotate(length=Length('content'))
+            .values_list('timestamp', 'id', 'length'))
+
+
+def _live_window_start(conversation_id, through_at, through_id):
+    """
+    (timestamp, id) of the oldest message in the live window, or None when
+    everything after the watermark still fits in it. Only the keys and
+    lengths are read.
+    """
+    tail = window_query(conversation_id, through_at, through_id)
+    tokens = 0
+    window_start = None
+    offset = 0
+    while True:
+        batch = list(tail[offset:offset + BATCH_SIZE])
+        for timestamp, message_id, length in batch:
+            tokens += tokens_for_length(length)
+            # The newest message is always in the window, however long
+            if window_start is not None and tokens > settings.CHAT_SUMMARY_WINDOW_TOKENS:
+                return window_start
+            window_start = (timestamp, message_id)
+        if len(batch) < BATCH_SIZE:
+            return None
+        offset += BATCH_SIZE
+
+
+def _next_chunk(conversation_id, through_at, through_id, window_start):
+    """Oldest unsummarized messages, up to CHAT_SUMMARY_CHUNK_TOKENS of them"""
+    messages = (unsummarized(conversation_id, through_at, through_id)
+                .before(*window_start)
+                .order_by('timestamp', 'id')
+                .only('id', 'role', 'content', 'timestamp')[:CHUNK_MESSAGES])
+    chunk = []
+    tokens = 0
+    for message in messages:
+        tokens += estimate_tokens(message.content)
+        if chunk and tokens > settings.CHAT_SUMMARY_CHUNK_TOKENS:
+            break
+        chunk.append(message)
+    return chunk
+
+
+def _summarize(summary, messages):
+    transcript = "\n".join(f"{message.role}: {message.content}" for message in messages)
+    return DeepSeekService.complete([
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"Current summary:\n{summary or '(none yet)'}\n\nNew messages:\n{transcript}"},
+    ], max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS)
+
+
+def update_summary(conversation_id):
+    """
+    Fold the messages between the summary watermark and the live window into
+    the stored summary. Returns True if the summary moved forward.
+    """
+    summary = ConversationSummary.objects.filter(conversation_id=conversation_id).first()
+    through = (summary.summarized_through_at, summary.summarized_through_id) if summary else (None, 0)
+
+    window_start = _live_window_start(conversation_id, *through)
+    if window_start is None:
+        return False
+
+    # Not worth an API call until enough has piled up
+    pending_length = (unsummarized(conversation_id, *through).before(*window_start)
+                      .aggregate(length=Sum(Length('content')))['length'] or 0)
+    if tokens_for_length(pending_length) < settings.CHAT_SUMMARY_MIN_TOKENS:
+        return False
+
+    if summary is None:
+        summary, _ = ConversationSummary.objects.get_or_create(conversation_id=conversation_id)
+
+    changed = False
+    while True:
+        chunk = _next_chunk(conversation_id, summary.summarized_through_at, summary.summarized_through_id,
+                            window_start)
+        if not chunk:
+            return changed
+
+        content = _summarize(summary.content, chunk)
+
+        # Only move the watermark if nobody else moved it meanwhile, so a
+        # turn can never be folded in twice
+        updated = ConversationSummary.objects.filter(
+            pk=summary.pk, summarized_through_at=summary.summarized_through_at,
+            summarized_through_id=summary.summarized_through_id,
+        ).update(content=content, summarized_through_at=chunk[-1].timestamp, summarized_through_id=chunk[-1].id,
+                 updated_at=timezone.now())
+        if not updated:
+            return changed
+
+        summary.content = content
+        summary.summarized_through_at = chunk[-1].timestamp
+        summary.summarized_through_id = chunk[-1].id
+        changed = True
@@ -0,0 +1,33 @@
+"""
+The test runner (settings.TEST_RUNNER): Django's, with the project's output
+kept out of the way while the tests run.
+
+  - the chatBot loggers write to a NullHandler instead of printing JSON
+    lines; tests that look at records use assertLogs, which adds a handler
+    of its own
+  - CHAT_METRICS_DIR is '', so requests made by tests don't leave files in
+    the real metrics directory; MetricsTests uses a temporary one
+  - the tests run in one process, so the rate limits and circuits may live
+    in the local-memory cache: chatBot.E002 is silenced
+"""
+import logging
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class ChatTestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._overrides = override_settings(CHAT_METRICS_DIR='', SILENCED_SYSTEM_CHECKS=['chatBot.E002'])
+        self._overrides.enable()
+        logger = logging.getLogger('chatBot')
+        self._handlers = logger.handlers[:]
+        logger.handlers = [logging.NullHandler()]
+
+    def teardown_test_environment(self, **kwargs):
+        logging.getLogger('chatBot').handlers = self._handlers
+        # CHAT_METRICS_DIR stays overridden: metrics are written once more
+        # at exit, after this
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,2018 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.backends.utils import CursorWrapper
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+
+from .context import build_context, estimate_tokens
+from .export import export_stream
+from . import hedging, logs, metrics, profiling
+from .memory import EmbeddingIndex, HashingEmbedder, get_index, recall, remember
+from .pagination import encode_cursor, page_query
+from .errors import CircuitOpen, RateLimited, UpstreamError, parse_retry_after
+from .hedging import get_upstream_stats, reset_upstream_stats
+from .idempotency import finish
+from .jobs import JobLost, Worker, claim_jobs, complete, enqueue, requeue_stale
+from .models import (Conversation, ConversationSummary, IdempotencyKey, ImportCheckpoint, Job, Message,
+                     RequestProfile)
+from .purge import delete_in_batches, purge_conversation, purge_expired
+from .ratelimit import check_shared_caches, get_rate_limiter
+from .response_cache import LocalResponseCache, get_response_cache, reset_response_cache
+from .resilience import get_breaker
+from .search import check_search_index, matching_messages, missing_index, search_messages
+from .services import AIServiceError, DeepSeekService, get_http_session, parse_stream_line, reset_http_session
+from .summaries import update_summary
+
+
+@override_settings(CHAT_SUMMARY_ENABLED=False, CHAT_MEMORY_ENABLED=False, CHAT_RATE_LIMIT_ENABLED=False)
+class ChatTestCase(TestCase):
+    """
+    Summaries, memory and rate limiting off unless a subclass turns them on,
+    and the memory index in a temporary directory either way. With username
+    set, every test gets that user, logged in, and the user's first
+    conversation.
+    """
+    username = None
+
+    def setUp(self):
+        memory_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(memory_dir.cleanup)
+        self.memory_dir = memory_dir.name
+        self.override(CHAT_MEMORY_DIR=self.memory_dir)
+        if self.username:
+            self.user = User.objects.create_user(self.username, password='testpass123')
+            self.client.force_login(self.user)
+            self.async_client.force_login(self.user)
+            # Made by the sign-up signal
+            self.conversation = Conversation.objects.get(user=self.user)
+
+    def override(self, **options):
+        """override_settings() for the rest of the test"""
+        overrides = override_settings(**options)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
+class HttpSessionTests(TestCase):
+    """The OpenRouter client is one pooled session shared by every thread"""
+
+    def setUp(self):
+        reset_http_session()
+        self.addCleanup(reset_http_session)
+
+    def test_session_is_shared_across_threads(self):
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(get_http_session())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(session) for session in sessions}), 1)
+
+    @override_settings(OPENROUTER_POOL_SIZE=7)
+    def test_pool_is_bounded_by_settings(self):
+        adapter = get_http_session().get_adapter('https://openrouter.ai/')
+
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertTrue(adapter._pool_block)
+
+    @override_settings(DEEPSEEK_API_KEY='test-key', OPENROUTER_CONNECT_TIMEOUT=2, OPENROUTER_READ_TIMEOUT=40)
+    def test_send_message_uses_pooled_session_with_phase_timeouts(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'choices': [{'message': {'content': 'Hi!'}}]}
+
+        with mock.patch.object(get_http_session(), 'post', return_value=response) as post:
+            reply = DeepSeekService.send_message([{'role': 'user', 'content': 'Hello'}])
+
+        self.assertEqual(reply, 'Hi!')
+        self.assertEqual(post.call_args.kwargs['timeout'], (2, 40))
+
+
+class StreamingTests(ChatTestCase):
+    """/send_message/stream/ relays the reply as SSE and saves it at the end"""
+
+    username = 'streamer'
+
+    def post_stream(self, client):
+        return client.post('/send_message/stream/', json.dumps({
+            'message': 'Hello',
+            'conversation_id': self.conversation.id,
+        }), content_type='application/json')
+
+    def test_parse_stream_line(self):
+        self.assertEqual(parse_stream_line('data: {"choices": [{"delta": {"content": "Hi"}}]}'), 'Hi')
+        self.assertEqual(parse_stream_line(': OPENROUTER PROCESSING'), '')
+        self.assertIsNone(parse_stream_line('data: [DONE]'))
+
+    @mock.patch.object(DeepSeekService, 'stream_message', return_value=iter(['Hel', 'lo!']))
+    def test_stream_relays_tokens_and_saves_reply(self, stream_message):
+        response = self.post_stream(self.client)
+        body = b''.join(response.streaming_content).decode()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('event: start', body)
+        self.assertIn('data: {"delta": "Hel"}', body)
+        self.assertTrue(body.rstrip().endswith('"conversation_id": %d}' % self.conversation.id))
+        self.assertEqual(self.conversation.messages.last().content, 'Hello!')
+
+    @mock.patch.object(DeepSeekService, 'stream_message', return_value=iter(['Partial', ' reply', ' lost']))
+    def test_client_disconnect_keeps_partial_reply(self, stream_message):
+        response = self.post_stream(self.client)
+        stream = iter(response.streaming_content)
+        next(stream)  # start
+        next(stream)  # "Partial"
+        response.close()
+
+        reply = self.conversation.messages.last()
+        self.assertEqual((reply.role, reply.content), ('assistant', 'Partial'))
+
+    async def test_asgi_stream_uses_async_upstream(self):
+        async def tokens(message_history, fresh=False):
+            for token in ['As', 'ync']:
+                yield token
+
+        with mock.patch.object(DeepSeekService, 'astream_message', side_effect=tokens):
+            response = await self.post_stream(self.async_client)
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        self.assertIn('event: done', body)
+        reply = await Message.objects.filter(conversation=self.conversation).alast()
+        self.assertEqual(reply.content, 'Async')
+
+
+class AsyncSendMessageTests(ChatTestCase):
+    """Under ASGI send_message awaits the async upstream client"""
+
+    username = 'async_user'
+
+    @mock.patch.object(DeepSeekService, 'send_message')
+    @mock.patch.object(DeepSeekService, 'asend_message', return_value='Async hello')
+    async def test_send_message_awaits_async_service(self, asend_message, send_message):
+        response = await self.async_client.post('/send_message/', json.dumps({'message': 'Hi'}),
+                                                content_type='application/json')
+        data = response.json()
+
+        self.assertEqual((data['status'], data['ai_response']), ('success', 'Async hello'))
+        self.assertFalse(send_message.called)
+        self.assertEqual(asend_message.call_args.args[0], [{'role': 'user', 'content': 'Hi'}])
+        roles = [msg.role async for msg in Message.objects.filter(conversation_id=data['conversation_id'])]
+        self.assertEqual(roles, ['user', 'assistant'])
+
+
+class ContextBuilderTests(ChatTestCase):
+    """History sent upstream is the newest tail that fits the token budget"""
+
+    username = 'context_user'
+
+    def setUp(self):
+        super().setUp()
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user' if i % 2 == 0 else 'assistant',
+                    content=f"message {i:03d} " + 'x' * 36)
+            for i in range(200)
+        ])
+
+    def test_keeps_newest_messages_oldest_first_within_budget(self):
+        per_message = estimate_tokens('message 000 ' + 'x' * 36)
+        messages = build_context(self.conversation.id, budget=per_message * 10).messages
+
+        self.assertEqual([msg.content[:11] for msg in messages], [f"message {i:03d}" for i in range(190, 200)])
+
+    def test_only_queries_the_tail_it_needs(self):
+        # One query for the summary, then the tail
+        with self.assertNumQueries(2):
+            build_context(self.conversation.id, budget=100)
+        # A budget bigger than the conversation walks back batch by batch
+        with self.assertNumQueries(6):
+            self.assertEqual(len(build_context(self.conversation.id, budget=10 ** 6).messages), 200)
+
+    @override_settings(CHAT_CONTEXT_TOKENS=1000, CHAT_MAX_TOKENS=900, CHAT_MEMORY_ENABLED=False)
+    def test_reply_tokens_are_reserved_from_the_budget(self):
+        messages = build_context(self.conversation.id).messages
+
+        self.assertLessEqual(sum(estimate_tokens(msg.content) for msg in messages), 100)
+        self.assertEqual(messages[-1].content[:11], 'message 199')
+
+
+@override_settings(CHAT_SUMMARY_WINDOW_TOKENS=60, CHAT_SUMMARY_MIN_TOKENS=20, CHAT_SUMMARY_CHUNK_TOKENS=10 ** 6)
+class RollingSummaryTests(ChatTestCase):
+    """Turns that leave the live window are folded into the summary once"""
+
+    username = 'summary_user'
+
+    def add_messages(self, start, count):
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user' if i % 2 == 0 else 'assistant',
+                    content=f"turn {i:02d} " + 'x' * 32)  # 14 tokens each
+            for i in range(start, start + count)
+        ])
+
+    @mock.patch.object(DeepSeekService, 'complete', return_value='Summary v1')
+    def test_old_turns_are_folded_and_never_resummarized(self, complete):
+        self.add_messages(0, 10)
+
+        self.assertTrue(update_summary(self.conversation.id))
+        transcript = complete.call_args.args[0][1]['content']
+        # The newest four messages (56 tokens) stay in the live window
+        self.assertIn('turn 05', transcript)
+        self.assertNotIn('turn 06', transcript)
+
+        self.add_messages(10, 2)
+        complete.return_value = 'Summary v2'
+        self.assertTrue(update_summary(self.conversation.id))
+        transcript = complete.call_args.args[0][1]['content']
+        self.assertIn('Current summary:\nSummary v1', transcript)
+        self.assertNotIn('turn 05', transcript)
+        self.assertIn('turn 06', transcript)
+        self.assertIn('turn 07', transcript)
+
+    @mock.patch.object(DeepSeekService, 'complete', return_value='Summary v1')
+    def test_context_sends_summary_instead_of_folded_turns(self, complete):
+        self.add_messages(0, 10)
+        update_summary(self.conversation.id)
+
+        window = build_context(self.conversation.id)
+        history = DeepSeekService.format_message_history(window.messages, summary=window.summary)
+
+        self.assertEqual(history[0]['role'], 'system')
+        self.assertIn('Summary v1', history[0]['content'])
+        self.assertEqual([msg['content'][:7] for msg in history[1:]], ['turn 06', 'turn 07', 'turn 08', 'turn 09'])
+
+    @mock.patch.object(DeepSeekService, 'complete', return_value='Summary v1')
+    def test_every_message_is_summarized_or_sent_once_when_ids_and_times_disagree(self, complete):
+        # Turns saved concurrently: a higher id can carry an earlier timestamp
+        start = timezone.now() - timedelta(hours=1)
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user', content=f"turn {i:02d} " + 'x' * 32,
+                    timestamp=start + timedelta(seconds=i))
+            for i in (1, 0, 3, 2, 5, 4, 7, 6, 9, 8, 11, 10)
+        ])
+
+        self.assertTrue(update_summary(self.conversation.id))
+        transcript = complete.call_args.args[0][1]['content']
+        summarized = [f"turn {i:02d}" for i in range(12) if f"turn {i:02d}" in transcript]
+        sent = [message.content[:7] for message in build_context(self.conversation.id).messages]
+
+        self.assertEqual(summarized + sent, [f"turn {i:02d}" for i in range(12)])
+        summary = ConversationSummary.objects.get()
+        self.assertEqual(Message.objects.get(pk=summary.summarized_through_id).timestamp,
+                         summary.summarized_through_at)
+
+    @mock.patch.object(DeepSeekService, 'complete')
+    def test_waits_until_enough_has_left_the_window(self, complete):
+        self.add_messages(0, 5)
+
+        self.assertFalse(update_summary(self.conversation.id))
+        self.assertFalse(complete.called)
+        self.assertFalse(ConversationSummary.objects.exists())
+
+
+@override_settings(CHAT_MEMORY_ENABLED=True, CHAT_MEMORY_MIN_SCORE=0.3)
+class VectorMemoryTests(ChatTestCase):
+    """Older messages similar to the newest one are recalled into context"""
+
+    username = 'memory_user'
+
+    def test_search_ranks_by_cosine_and_skips_excluded(self):
+        index = EmbeddingIndex(self.user.id, HashingEmbedder(dim=256))
+        index.append([1, 2, 3], [9, 9, 9], [
+            'my dog is called Biscuit',
+            'the weather in Nairobi is sunny',
+            'Biscuit the dog loves the park',
+        ])
+
+        matches = index.search('is my dog Biscuit at the park', k=2)
+        self.assertEqual({message_id for message_id, _ in matches}, {1, 3})
+        self.assertGreaterEqual(matches[0][1], matches[1][1])
+        excluded = index.search('is my dog Biscuit at the park', k=2, exclude_ids=[1, 3])
+        self.assertEqual([message_id for message_id, _ in excluded], [2])
+        self.assertEqual(len(index), 3)
+
+    def test_half_written_append_is_cut_back_before_the_next(self):
+        index = EmbeddingIndex(self.user.id, HashingEmbedder(dim=256))
+        index.append([1], [9], ['my dog is called Biscuit'])
+        # Died after writing the vectors, before the ids
+        with open(index.vectors_path, 'ab') as f:
+            f.write(HashingEmbedder(dim=256).embed(['half written'])[0].tobytes()[:100])
+        with open(index.vectors_path, 'ab') as f:
+            f.write(HashingEmbedder(dim=256).embed(['orphan'])[0].tobytes())
+
+        index.append([2], [9], ['the weather in Nairobi is sunny'])
+
+        self.assertEqual(len(index), 2)
+        # Each id still gets its own vector back
+        for message_id, text in ((1, 'my dog is called Biscuit'), (2, 'the weather in Nairobi is sunny')):
+            [(found, score)] = index.search(text, k=1)
+            self.assertEqual(found, message_id)
+            self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_recalled_turns_are_spliced_into_the_context(self):
+        old = Message.objects.create(conversation=self.conversation, role='user',
+                                     content='My sister Wanjiru lives in Mombasa')
+        filler = [Message.objects.create(conversation=self.conversation, role='assistant',
+                                         content=f"filler reply number {i}") for i in range(20)]
+        newest = Message.objects.create(conversation=self.conversation, role='user',
+                                        content='Where does my sister Wanjiru live?')
+        remember(self.user.id, [old, *filler, newest])
+
+        window = build_context(self.conversation.id, budget=estimate_tokens('filler reply number 10') * 5,
+                               user_id=self.user.id)
+        history = DeepSeekService.format_message_history(window.messages, recalled=window.recalled)
+
+        self.assertNotIn(old, window.messages)
+        self.assertEqual(window.recalled, [old])
+        self.assertEqual(history[0]['role'], 'system')
+        self.assertIn('Wanjiru lives in Mombasa', history[0]['content'])
+        self.assertEqual(history[-1]['content'], newest.content)
+
+
+class ConversationCounterTests(ChatTestCase):
+    """Sidebar columns are kept on the conversation row"""
+
+    username = 'counter_user'
+
+    def test_counters_follow_inserts_and_deletes(self):
+        Message.objects.create(conversation=self.conversation, role='assistant', content='Welcome')
+        first = Message.objects.create(conversation=self.conversation, role='user', content='q' * 120)
+        last = Message.objects.create(conversation=self.conversation, role='user', content='Second question')
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 3)
+        self.assertEqual(self.conversation.preview_text, 'q' * 100 + '...')
+        self.assertEqual(self.conversation.last_message_at, last.timestamp)
+
+        first.delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.message_count, self.conversation.preview_text), (2, 'Second question'))
+
+        self.conversation.messages.filter(role='user').delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.message_count, self.conversation.preview), (1, 'Empty conversation'))
+
+    def test_admin_edit_leaves_the_counters_alone(self):
+        conversation_admin = admin.site._registry[Conversation]
+        request = RequestFactory().post('/admin/chatBot/conversation/')
+        request.user = User.objects.create_superuser('counter_admin', password='testpass123')
+        # Loaded by the changelist, then a turn is saved before the admin submits it
+        stale = Conversation.objects.get(pk=self.conversation.pk)
+        self.conversation.save_turn(Message(role='user', content='Sent meanwhile'))
+
+        # The form get_changelist_formset() makes for each row
+        form_class = conversation_admin.get_changelist_form(request, fields=conversation_admin.list_editable)
+        form = form_class({'title': 'Renamed', 'is_active': 'on'}, instance=stale)
+        self.assertTrue(form.is_valid())
+        conversation_admin.save_model(request, form.save(commit=False), form, change=True)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.title, self.conversation.message_count, self.conversation.preview_text),
+                         ('Renamed', 1, 'Sent meanwhile'))
+
+    def test_sidebar_is_one_query_however_many_conversations(self):
+        for i in range(20):
+            conversation = Conversation.objects.create(user=self.user)
+            Message.objects.create(conversation=conversation, role='user', content=f"Question {i}")
+
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/conversations/history/').json()['conversations']
+
+        # Everything else is the session and user lookups
+        app_queries = [query['sql'] for query in queries if 'chatBot_' in query['sql']]
+        self.assertEqual(len(app_queries), 1)
+        self.assertNotIn('chatBot_message', app_queries[0])
+
+        newest = data['today'][0]
+        self.assertEqual((newest['preview'], newest['message_count']), ('Question 19', 1))
+        self.assertEqual(sum(len(group) for group in data.values()), 21)
+
+
+@override_settings(CHAT_PAGE_SIZE=20, CHAT_PAGE_MAX=50)
+class MessagePaginationTests(ChatTestCase):
+    """Conversation APIs page through messages with (timestamp, id) cursors"""
+
+    username = 'pager'
+
+    def setUp(self):
+        super().setUp()
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user', content=f"message {i:03d}")
+            for i in range(105)
+        ])
+        self.url = f'/api/conversations/{self.conversation.id}/'
+
+    def contents(self, page):
+        return [msg['content'][-3:] for msg in page['messages']]
+
+    def test_walks_back_from_the_newest_page(self):
+        page = self.client.get(self.url).json()['conversation']
+        self.assertEqual(self.contents(page), [f"{i:03d}" for i in range(85, 105)])
+        self.assertEqual((page['has_older'], page['has_newer'], page['after']), (True, False, None))
+
+        seen = self.contents(page)
+        while page['before']:
+            with CaptureQueriesContext(connection) as queries:
+                page = self.client.get(self.url, {'before': page['before']}).json()['conversation']
+            # Same cost for every page: one query for the conversation, one for the page
+            self.assertEqual(len([q for q in queries if 'chatBot_' in q['sql']]), 2)
+            seen = self.contents(page) + seen
+
+        self.assertEqual(seen, [f"{i:03d}" for i in range(105)])
+        self.assertFalse(page['has_older'])
+
+    def test_after_cursor_and_limit(self):
+        oldest = self.client.get('/get_messages/', {'conversation_id': self.conversation.id,
+                                                     'limit': 500}).json()
+        self.assertEqual(len(oldest['messages']), 50)  # Clamped to CHAT_PAGE_MAX
+
+        page = self.client.get(self.url, {'before': oldest['before'], 'limit': 5}).json()['conversation']
+        newer = self.client.get(self.url, {'after': page['before'], 'limit': 3}).json()['conversation']
+        self.assertEqual(self.contents(newer), self.contents(page)[1:4])
+        self.assertTrue(newer['has_newer'])
+
+    def test_deep_cursor_pages_seek_to_the_cursor(self):
+        # A page far back only costs what the newest does if the index seeks
+        # on the cursor's timestamp, not just on the conversation
+        second = Message.objects.filter(conversation=self.conversation).order_by('timestamp', 'id')[1]
+        cursor = encode_cursor(second)
+        seek = {'sqlite': r'\(conversation_id=\? AND timestamp[<>]=?\?\)',
+                'postgresql': r'Index Cond: .*conversation_id.*timestamp'}[connection.vendor]
+
+        for query in (page_query(self.conversation.id, before=cursor), page_query(self.conversation.id, after=cursor)):
+            self.assertRegex(query.explain(), seek)
+        self.assertEqual([m.id for m in page_query(self.conversation.id, before=cursor)],
+                         [Message.objects.filter(conversation=self.conversation).order_by('timestamp', 'id')[0].id])
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['status'], 'error')
+
+
+class QueryPlanTests(TestCase):
+    """Every hot query is served by an index"""
+
+    def test_hot_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertNotIn('FAIL', out.getvalue())
+
+    def test_unindexed_query_fails_the_check(self):
+        from .management.commands import explain_queries
+        unindexed = [('by content', Message.objects.filter(content='hello').order_by('role'), ())]
+
+        with mock.patch.object(explain_queries, 'hot_queries', return_value=unindexed):
+            with self.assertRaisesMessage(CommandError, 'by content'):
+                call_command('explain_queries', stdout=io.StringIO())
+
+    def test_keyset_query_must_seek_on_its_cursor(self):
+        from .management.commands import explain_queries
+        # Served by the index, but only sought on the conversation: every
+        # page would walk the messages newer than its cursor
+        unbounded = [('unbounded page', Message.objects.filter(
+            Q(timestamp__lt=timezone.now()) | Q(timestamp=timezone.now(), id__lt=1), conversation_id=1
+        ).order_by('-timestamp', '-id')[:21], ('timestamp',))]
+
+        out = io.StringIO()
+        with mock.patch.object(explain_queries, 'hot_queries', return_value=unbounded):
+            with self.assertRaisesMessage(CommandError, 'unbounded page'):
+                call_command('explain_queries', stdout=out)
+        self.assertIn("doesn't seek on timestamp", out.getvalue())
+
+
+class TurnPersistenceTests(ChatTestCase):
+    """A chat turn is written with one INSERT and one UPDATE"""
+
+    username = 'turn_user'
+
+    def test_save_turn_statements(self):
+        user_msg = Message(role='user', content='What is the capital of Kenya?')
+        reply = Message(role='assistant', content='Nairobi.')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.conversation.save_turn(user_msg, reply)
+
+        statements = [query['sql'].split()[0] for query in queries if 'chatBot_' in query['sql']]
+        self.assertEqual(statements, ['INSERT', 'UPDATE'])
+        self.assertIsNotNone(reply.id)
+        # Stamped as saved: the reply ties with the question and comes after it by id
+        self.assertEqual(user_msg.timestamp, reply.timestamp)
+        self.assertLess(user_msg.id, reply.id)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'What is the capital of Kenya?')
+        self.assertEqual((self.conversation.message_count, self.conversation.preview_text),
+                         (2, 'What is the capital of Kenya?'))
+
+        # Title and preview come from the first turn only
+        self.conversation.save_turn(Message(role='user', content='And of Uganda?'))
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.title, self.conversation.message_count),
+                         ('What is the capital of Kenya?', 3))
+
+    def test_last_message_at_never_moves_back(self):
+        # A turn that commits after a later one doesn't rewind the conversation
+        later = timezone.now() + timedelta(minutes=5)
+        Conversation.objects.filter(pk=self.conversation.pk).update(last_message_at=later)
+        self.conversation.save_turn(Message(role='user', content='Late'), Message(role='assistant', content='Yes'))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_at, later)
+
+    @mock.patch.object(DeepSeekService, 'send_message', return_value='Nairobi.')
+    def test_send_message_query_count(self, send_message):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/send_message/', json.dumps({
+                'message': 'What is the capital of Kenya?',
+                'conversation_id': self.conversation.id,
+            }), content_type='application/json')
+
+        self.assertEqual(response.json()['status'], 'success')
+        # Conversation, summary, history tail, then the turn's INSERT and UPDATE
+        app_queries = [query['sql'].split()[0] for query in queries if 'chatBot_' in query['sql']]
+        self.assertEqual(app_queries, ['SELECT', 'SELECT', 'SELECT', 'INSERT', 'UPDATE'])
+
+
+@override_settings(CHAT_RESPONSE_CACHE='local', CHAT_RESPONSE_CACHE_SIZE=2, DEEPSEEK_API_KEY='test-key')
+class ResponseCacheTests(TestCase):
+    """Identical short requests are answered from the response cache"""
+
+    HELLO = [{'role': 'user', 'content': 'hi'}]
+
+    def setUp(self):
+        reset_response_cache()
+        self.addCleanup(reset_response_cache)
+
+    def test_lru_and_ttl_eviction(self):
+        now = [0.0]
+        cache = LocalResponseCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        self.assertEqual(cache.get('a'), 'A')  # a is now the most recently used
+        cache.set('c', 'C')
+
+        self.assertIsNone(cache.get('b'))
+        now[0] = 11
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'evictions': 1, 'expirations': 1, 'size': 1})
+
+    @mock.patch.object(DeepSeekService, 'complete', side_effect=['Hello!', 'Hi there!', 'Sure.', 'Again.'])
+    def test_send_message_hits_skip_openrouter(self, complete):
+        self.assertEqual(DeepSeekService.send_message(self.HELLO), 'Hello!')
+        self.assertEqual(DeepSeekService.send_message(self.HELLO), 'Hello!')
+        self.assertEqual(complete.call_count, 1)
+
+        # Asking for fresh output goes upstream and refreshes the entry
+        self.assertEqual(DeepSeekService.send_message(self.HELLO, fresh=True), 'Hi there!')
+        self.assertEqual(DeepSeekService.send_message(self.HELLO), 'Hi there!')
+
+        # Requests with history don't use the cache at all
+        history = self.HELLO + [{'role': 'assistant', 'content': 'Hi!'}, {'role': 'user', 'content': 'hi'}]
+        DeepSeekService.send_message(history)
+        DeepSeekService.send_message(history)
+        self.assertEqual(complete.call_count, 4)
+        self.assertEqual(get_response_cache().stats()['hits'], 2)
+
+    @mock.patch.object(DeepSeekService, 'complete', side_effect=AIServiceError('API Error 500'))
+    def test_errors_are_not_cached(self, complete):
+        for _ in range(2):
+            with self.assertRaises(AIServiceError):
+                DeepSeekService.send_message(self.HELLO)
+        self.assertEqual(complete.call_count, 2)
+
+    @override_settings(CHAT_RESPONSE_CACHE='django', CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'replies'}})
+    def test_django_cache_backend_is_shared(self):
+        with mock.patch.object(DeepSeekService, 'complete', return_value='Hello!') as complete:
+            DeepSeekService.send_message(self.HELLO)
+            replies = list(DeepSeekService.stream_message(self.HELLO))
+
+        self.assertEqual(replies, ['Hello!'])
+        self.assertEqual(complete.call_count, 1)
+        self.assertEqual(get_response_cache().stats(), {'hits': 1, 'misses': 1})
+
+
+class IdempotencyTests(ChatTestCase):
+    """Retries with the same Idempotency-Key never call the model twice"""
+
+    username = 'retry_user'
+
+    def post(self, client, key, message='Hello'):
+        return client.post('/send_message/', json.dumps({'message': message}),
+                           content_type='application/json', headers={'Idempotency-Key': key})
+
+    @mock.patch.object(DeepSeekService, 'send_message', return_value='Hi!')
+    def test_retry_replays_the_stored_result(self, send_message):
+        first = self.post(self.client, 'key-1').json()
+        retry = self.post(self.client, 'key-1').json()
+
+        self.assertEqual(retry, first)
+        self.assertEqual(send_message.call_count, 1)
+        self.assertEqual(Message.objects.filter(conversation__user=self.user).count(), 2)
+
+        # The stream endpoint replays the same turn
+        body = b''.join(self.client.post('/send_message/stream/', json.dumps({'message': 'Hello'}),
+                                         content_type='application/json',
+                                         headers={'Idempotency-Key': 'key-1'}).streaming_content).decode()
+        self.assertIn('"delta": "Hi!"', body)
+        self.assertEqual(send_message.call_count, 1)
+
+    @mock.patch.object(DeepSeekService, 'asend_message', return_value='Should not be called')
+    async def test_concurrent_duplicate_waits_for_the_original(self, asend_message):
+        conversation = await Conversation.objects.aget(user=self.user)
+        claim = await IdempotencyKey.objects.acreate(user=self.user, key='key-2')
+
+        async def original_finishes():
+            await asyncio.sleep(0.3)
+            await sync_to_async(finish)(claim, {'user_message': 'Hello', 'ai_response': 'Original reply',
+                                               'conversation_id': conversation.id})
+
+        response, _ = await asyncio.gather(self.post(self.async_client, 'key-2'), original_finishes())
+
+        self.assertEqual(response.json()['ai_response'], 'Original reply')
+        self.assertFalse(asend_message.called)
+
+    @mock.patch.object(DeepSeekService, 'send_message', side_effect=[RuntimeError('boom'), 'Second try'])
+    def test_failed_request_gives_the_key_back(self, send_message):
+        self.assertEqual(self.post(self.client, 'key-3').json()['status'], 'error')
+        self.assertFalse(IdempotencyKey.objects.filter(key='key-3').exists())
+
+        self.assertEqual(self.post(self.client, 'key-3').json()['ai_response'], 'Second try')
+
+
+@override_settings(CHAT_QUEUE_ENABLED=True, CHAT_QUEUE_MAX_DEPTH=2, CHAT_QUEUE_JOB_TIMEOUT=60,
+                   CHAT_QUEUE_MAX_ATTEMPTS=2)
+class JobQueueTests(ChatTestCase):
+    """With the queue on, chat turns are run by a worker instead of the request"""
+
+    username = 'queue_user'
+
+    def post(self, message='Hello', **headers):
+        return self.client.post('/send_message/', json.dumps({'message': message}),
+                                content_type='application/json', headers=headers)
+
+    def test_send_message_enqueues_and_worker_saves_the_turn(self):
+        with mock.patch.object(DeepSeekService, 'stream_message') as stream_message:
+            response = self.post()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        # Nothing upstream and nothing saved yet
+        self.assertFalse(stream_message.called)
+        self.assertFalse(Message.objects.filter(conversation__user=self.user).exists())
+        self.assertEqual(self.client.get(f'/api/jobs/{job_id}/').json()['job']['status'], 'queued')
+
+        with mock.patch.object(DeepSeekService, 'stream_message', return_value=iter(['Hi', ' there!'])):
+            self.assertEqual(Worker(threads=4).run_once(), 1)
+
+        job = self.client.get(f'/api/jobs/{job_id}/').json()['job']
+        self.assertEqual((job['status'], job['result']['ai_response']), ('done', 'Hi there!'))
+        self.assertEqual(list(Message.objects.filter(conversation__user=self.user).values_list('role', 'content')),
+                         [('user', 'Hello'), ('assistant', 'Hi there!')])
+
+        other = User.objects.create_user('other_user', password='testpass123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(f'/api/jobs/{job_id}/').status_code, 404)
+
+    def test_retry_is_pointed_at_the_same_job(self):
+        first = self.post(**{'Idempotency-Key': 'queued-1'}).json()
+        retry = self.post(**{'Idempotency-Key': 'queued-1'})
+
+        self.assertEqual(retry.status_code, 202)
+        self.assertEqual(retry.json()['job_id'], first['job_id'])
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_full_queue_answers_503(self):
+        self.post()
+        self.post()
+        response = self.post(**{'Idempotency-Key': 'overflow'})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(Job.objects.count(), 2)
+        # The key is free for the retry once the queue drains
+        self.assertFalse(IdempotencyKey.objects.filter(key='overflow').exists())
+
+    def test_claims_do_not_overlap(self):
+        for i in range(3):
+            Job.objects.create(kind='chat_turn', payload={'n': i})
+
+        first = claim_jobs(2, 'worker-a')
+        second = claim_jobs(2, 'worker-b')
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({job.id for job in first} & {job.id for job in second})
+
+    def test_stale_jobs_are_requeued_then_failed(self):
+        job = enqueue('chat_turn', {})
+        [claimed] = claim_jobs(1, 'worker-a')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+
+        self.assertEqual(requeue_stale(), 1)
+        [retaken] = claim_jobs(1, 'worker-b')
+        self.assertEqual(retaken.attempts, 2)
+
+        # The first worker lost the job, so it can't complete it any more
+        with self.assertRaises(JobLost):
+            complete(claimed, {})
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+        requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    def test_worker_beats_for_jobs_still_waiting_upstream(self):
+        # Retrying upstream, no token yet: the job thread flushes nothing, the worker beats for it
+        worker = Worker(threads=2)
+        enqueue('chat_turn', {})
+        [running] = claim_jobs(1, worker.worker_id)
+        worker._running[running.pk] = running
+        lost = enqueue('chat_turn', {})
+        [lost_claim] = claim_jobs(1, 'worker-a')
+        Job.objects.filter(pk=lost.pk).update(lock_token='worker-b/1')
+        worker._running[lost.pk] = lost_claim
+        Job.objects.update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+
+        worker.beat()
+
+        self.assertEqual(requeue_stale(), 1)  # Only the job another worker holds
+        self.assertEqual(Job.objects.get(pk=running.pk).status, 'running')
+
+    @override_settings(CHAT_QUEUE_WAIT_TIMEOUT=0.05, CHAT_QUEUE_POLL_INTERVAL=0.01)
+    async def test_job_events_give_up_on_a_stuck_job(self):
+        user = await User.objects.acreate(username='queue_waiter')
+        await self.async_client.aforce_login(user)
+        job = await Job.objects.acreate(kind='chat_turn', payload={'conversation_id': 1}, user=user)
+
+        response = await self.async_client.get(f'/api/jobs/{job.pk}/events/')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        self.assertIn('event: error', body)
+        self.assertIn('Timed out waiting', body)
+
+
+@override_settings(DEEPSEEK_API_KEY='test-key', CHAT_MODELS=['primary/model', 'backup/model'],
+                   CHAT_HEDGE_ENABLED=True, CHAT_HEDGE_DELAY=0.05, CHAT_HEDGE_MIN_DELAY=0.01,
+                   CHAT_HEDGE_MIN_SAMPLES=5)
+class HedgingTests(TestCase):
+    """Slow requests are hedged, failing models fall back to the next one"""
+
+    HELLO = [{'role': 'user', 'content': 'hi'}]
+
+    def setUp(self):
+        reset_upstream_stats()
+        self.addCleanup(reset_upstream_stats)
+
+    def test_slow_request_is_hedged_and_the_hedge_wins(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def complete_once(model, message_history, max_tokens=None):
+            calls.append(model)
+            if len(calls) == 1:
+                release.wait(5)
+                return 'Slow reply'
+            return 'Fast reply'
+
+        with mock.patch.object(DeepSeekService, 'complete_once', side_effect=complete_once):
+            self.assertEqual(DeepSeekService.complete(self.HELLO), 'Fast reply')
+
+        # The hedge is the same request to the same model
+        self.assertEqual(calls, ['primary/model', 'primary/model'])
+        stats = get_upstream_stats().stats()
+        self.assertEqual((stats['requests'], stats['hedged'], stats['hedge_wins']), (1, 1, 1))
+        self.assertEqual(stats['hedge_rate'], 1.0)
+
+    def test_losing_sync_request_is_cut_off(self):
+        hung_up = threading.Event()
+        requests_seen = []
+
+        class Upstream(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                requests_seen.append(self.path)
+                if len(requests_seen) == 1:
+                    # Slow: wait for the reply to be wanted, or the client to go
+                    deadline = time.monotonic() + 5
+                    while time.monotonic() < deadline:
+                        if select.select([self.connection], [], [], 0.02)[0]:
+                            if not self.connection.recv(1, socket.MSG_PEEK):
+                                hung_up.set()
+                                return
+                body = json.dumps({'choices': [{'message': {'content': f'Reply {len(requests_seen)}'}}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        reset_http_session()
+        self.addCleanup(reset_http_session)
+
+        with override_settings(OPENROUTER_API_URL=f'http://127.0.0.1:{server.server_port}/chat'):
+            self.assertEqual(DeepSeekService.complete(self.HELLO), 'Reply 2')
+        # The slow request's connection is closed, not left to run on
+        self.assertTrue(hung_up.wait(2))
+
+    def test_hedge_delay_counts_from_when_the_request_goes_out(self):
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        with mock.patch.object(hedging, '_executor', pool):
+            # Every thread busy for longer than the hedge delay
+            pool.submit(time.sleep, 0.3)
+            self.assertEqual(hedging.hedged(lambda: time.sleep(0.01) or 'Reply', 'primary/model'), 'Reply')
+        self.assertEqual(get_upstream_stats().stats()['hedged'], 0)
+
+    def test_failing_model_falls_back_to_the_next(self):
+        def complete_once(model, message_history, max_tokens=None):
+            if model == 'primary/model':
+                raise AIServiceError('API Error 503')
+            return 'Backup reply'
+
+        with mock.patch.object(DeepSeekService, 'complete_once', side_effect=complete_once):
+            self.assertEqual(DeepSeekService.send_message(self.HELLO), 'Backup reply')
+
+        stats = get_upstream_stats().stats()
+        self.assertEqual((stats['fallbacks'], stats['failures'], stats['hedged']), (1, 0, 0))
+        self.assertIn('backup/model', stats['models'])
+
+    def test_async_hedge_cancels_the_loser(self):
+        cancelled = []
+
+        async def acomplete_once(model, message_history, max_tokens=None):
+            if not cancelled:
+                cancelled.append(False)
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled[0] = True
+                    raise
+            return 'Fast reply'
+
+        with mock.patch.object(DeepSeekService, 'acomplete_once', side_effect=acomplete_once):
+            self.assertEqual(asyncio.run(DeepSeekService.acomplete(self.HELLO)), 'Fast reply')
+        self.assertEqual(cancelled, [True])
+
+    def test_stream_falls_back_before_the_first_token(self):
+        def stream_once(model, message_history):
+            if model == 'primary/model':
+                raise AIServiceError('API Error 429')
+            yield 'Backup'
+            yield ' reply'
+
+        with mock.patch.object(DeepSeekService, '_stream_once', side_effect=stream_once):
+            self.assertEqual(list(DeepSeekService.stream_message(self.HELLO)), ['Backup', ' reply'])
+        self.assertEqual(get_upstream_stats().stats()['fallbacks'], 1)
+
+    def test_hedge_delay_follows_recent_latency(self):
+        stats = get_upstream_stats()
+        self.assertEqual(stats.hedge_delay('primary/model'), 0.05)
+        for seconds in [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 3.0]:
+            stats.record_latency('primary/model', seconds)
+        self.assertEqual(stats.hedge_delay('primary/model'), 3.0)
+
+
+@override_settings(DEEPSEEK_API_KEY='test-key', CHAT_MODELS=['primary/model'], CHAT_BREAKER_THRESHOLD=2,
+                   CHAT_BREAKER_COOLDOWN=30, CHAT_RETRY_ATTEMPTS=2, CHAT_RETRY_MAX_DELAY=5)
+class ResilienceTests(ChatTestCase):
+    """Upstream failures are retried, trip the circuit breaker and are never saved as replies"""
+
+    HELLO = [{'role': 'user', 'content': 'hi'}]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        sleep = mock.patch('chatBot.resilience.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def test_rate_limit_waits_for_retry_after(self):
+        with mock.patch.object(DeepSeekService, 'complete_once',
+                               side_effect=[RateLimited('API Error 429', retry_after=3), 'Hello!']):
+            self.assertEqual(DeepSeekService.complete(self.HELLO), 'Hello!')
+        self.assertGreaterEqual(self.sleep.call_args.args[0], 3)
+
+        # Longer than we'd make the user wait: no retry
+        with mock.patch.object(DeepSeekService, 'complete_once',
+                               side_effect=RateLimited('API Error 429', retry_after=60)) as complete_once:
+            with self.assertRaises(RateLimited):
+                DeepSeekService.complete(self.HELLO)
+        self.assertEqual(complete_once.call_count, 1)
+
+    def test_circuit_opens_then_lets_one_probe_through(self):
+        with mock.patch.object(DeepSeekService, 'complete_once',
+                               side_effect=UpstreamError('API Error 502')) as complete_once:
+            # The second failure opens the circuit, so the last retry never goes out
+            with self.assertRaises(CircuitOpen):
+                DeepSeekService.complete(self.HELLO)
+        self.assertEqual(complete_once.call_count, 2)
+        breaker = get_breaker('primary/model')
+        self.assertEqual(breaker.state(), 'open')
+
+        # Open: fail fast without a request
+        with mock.patch.object(DeepSeekService, 'complete_once') as complete_once:
+            with self.assertRaises(CircuitOpen) as raised:
+                DeepSeekService.complete(self.HELLO)
+        self.assertFalse(complete_once.called)
+        self.assertGreater(raised.exception.retry_after, 0)
+
+        # After the cooldown one caller probes, the rest still fail fast
+        with mock.patch('chatBot.resilience.time.time', return_value=time.time() + 31):
+            self.assertEqual(breaker.state(), 'half_open')
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.record_success()
+        self.assertEqual(breaker.state(), 'closed')
+
+    def test_client_errors_are_not_retried_or_counted(self):
+        with mock.patch.object(DeepSeekService, 'complete_once',
+                               side_effect=AIServiceError('API Error 400')) as complete_once:
+            for _ in range(3):
+                with self.assertRaises(AIServiceError):
+                    DeepSeekService.complete(self.HELLO)
+        self.assertEqual(complete_once.call_count, 3)
+        self.assertEqual(get_breaker('primary/model').state(), 'closed')
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('7'), 7)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertAlmostEqual(parse_retry_after(
+            (timezone.now() + timedelta(seconds=120)).strftime('%a, %d %b %Y %H:%M:%S GMT')), 120, delta=2)
+
+    def test_failed_turn_is_not_saved_as_a_reply(self):
+        user = User.objects.create_user('resilience_user', password='testpass123')
+        self.client.force_login(user)
+
+        with mock.patch.object(DeepSeekService, 'send_message', side_effect=CircuitOpen('Down', retry_after=12)):
+            response = self.client.post('/send_message/', json.dumps({'message': 'Hello'}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '12')
+        self.assertFalse(Message.objects.filter(conversation__user=user).exists())
+
+        def stream(message_history, fresh=False):
+            raise UpstreamError('API Error 502')
+            yield
+
+        with mock.patch.object(DeepSeekService, 'stream_message', side_effect=stream):
+            response = self.client.post('/send_message/stream/', json.dumps({'message': 'Hello'}),
+                                        content_type='application/json')
+            body = b''.join(response.streaming_content).decode()
+        self.assertIn('event: error', body)
+        # The user's message is kept, the error text is not
+        self.assertEqual(list(Message.objects.filter(conversation__user=user).values_list('role', flat=True)),
+                         ['user'])
+
+
+
+@override_settings(CHAT_RATE_LIMIT_ENABLED=True, CHAT_RATE_LIMIT_PER_MINUTE=60, CHAT_RATE_LIMIT_BURST=3,
+                   CHAT_RATE_LIMIT_CONCURRENT=1, CHAT_RATE_LIMIT_SLOT_RETRY=2, CHAT_RATE_LIMIT_TOKENS_PER_MINUTE=1000)
+class RateLimitTests(ChatTestCase):
+    """Per-user request rate, concurrency and token budget on the chat endpoints"""
+
+    username = 'limited_user'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def post(self, path='/send_message/'):
+        return self.client.post(path, json.dumps({'message': 'Hello'}), content_type='application/json')
+
+    @mock.patch.object(DeepSeekService, 'send_message', return_value='Hi')
+    def test_burst_then_429_with_retry_after(self, send_message):
+        for _ in range(3):
+            self.assertEqual(self.post().status_code, 200)
+        response = self.post()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['limit'], 'rate')
+        # One request refills every second
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(send_message.call_count, 3)
+
+        # Other users have their own bucket
+        self.client.force_login(User.objects.create_user('other_user', password='testpass123'))
+        self.assertEqual(self.post().status_code, 200)
+
+    def test_bucket_refills(self):
+        limiter = get_rate_limiter()
+        now = time.time()
+        for _ in range(3):
+            self.assertEqual(limiter.take_request(self.user.id, now), 0)
+        self.assertGreater(limiter.take_request(self.user.id, now), 0)
+        self.assertEqual(limiter.take_request(self.user.id, now + 1.01), 0)
+        self.assertGreater(limiter.take_request(self.user.id, now + 1.01), 0)
+
+    def test_stream_holds_a_slot_until_it_ends(self):
+        def stream(message_history, fresh=False):
+            yield 'Hi'
+
+        with mock.patch.object(DeepSeekService, 'stream_message', side_effect=stream):
+            streaming = self.post('/send_message/stream/')
+            # The first reply is still streaming
+            response = self.post()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.json()['limit'], 'concurrency')
+            self.assertEqual(response['Retry-After'], '2')
+
+            b''.join(streaming.streaming_content)
+            self.assertEqual(self.post('/send_message/stream/').status_code, 200)
+
+    @override_settings(CHAT_QUEUE_ENABLED=True)
+    def test_queued_turns_count_until_their_jobs_finish(self):
+        self.assertEqual(self.post().status_code, 202)
+        # The request is over, but its turn is still waiting for a worker
+        response = self.post()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['limit'], 'concurrency')
+
+        Job.objects.filter(user=self.user).update(status='done')
+        self.assertEqual(self.post().status_code, 202)
+
+    def test_process_local_cache_is_refused_outside_debug(self):
+        with override_settings(DEBUG=False):
+            errors = check_shared_caches(None)
+        self.assertEqual([error.id for error in errors], ['chatBot.E002'] * 2)
+        with override_settings(DEBUG=False, CHAT_RATE_LIMIT_ENABLED=False):
+            self.assertIn('CHAT_BREAKER_ALIAS', check_shared_caches(None)[0].msg)
+        with override_settings(DEBUG=False, CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'}}):
+            self.assertEqual(check_shared_caches(None), [])
+        with override_settings(DEBUG=True):
+            self.assertEqual(check_shared_caches(None), [])
+
+    @mock.patch.object(DeepSeekService, 'send_message', return_value='word ' * 2000)
+    def test_token_budget(self, send_message):
+        self.assertEqual(self.post().status_code, 200)
+        response = self.post()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['limit'], 'tokens')
+        self.assertLessEqual(int(response['Retry-After']), 60)
+        self.assertEqual(send_message.call_count, 1)
+
+
+class SearchTests(ChatTestCase):
+    """Full-text search over a user's messages, kept in step with the messages table"""
+
+    username = 'search_user'
+
+    def setUp(self):
+        super().setUp()
+        self.conversation.save_turn(Message(role='user', content='How do I repot a <b>cactus</b> in spring?'),
+                                    Message(role='assistant', content='Repot the cactus in a gritty mix.'))
+
+    def search(self, q, **params):
+        return self.client.get('/api/conversations/search/', {'q': q, **params}).json()
+
+    def test_ranked_highlighted_results(self):
+        self.conversation.save_turn(Message(role='user', content='Cactus, cactus, cactus: which cactus?'))
+        results = self.search('cactus')['results']
+        self.assertEqual(len(results), 3)
+        # The message that is mostly about cacti comes first
+        self.assertEqual(results[0]['snippet'], '<mark>Cactus</mark>, <mark>cactus</mark>, <mark>cactus</mark>: '
+                                                'which <mark>cactus</mark>?')
+        # Message text is escaped, only the highlights are markup
+        snippet = next(r['snippet'] for r in results if r['role'] == 'user' and 'repot' in r['snippet'])
+        self.assertIn('&lt;b&gt;<mark>cactus</mark>&lt;/b&gt;', snippet)
+        self.assertEqual(results[0]['conversation_title'], self.conversation.title)
+
+        # Stemmed, and the last word matches as a prefix
+        self.assertEqual(len(self.search('repotting')['results']), 2)
+        self.assertEqual(len(self.search('gritty cac')['results']), 1)
+        # Search syntax in the query is just punctuation
+        self.assertEqual(len(self.search('"cactus" -(gritty')['results']), 1)
+        self.assertEqual(self.search('?!')['results'], [])
+
+    def test_paginated(self):
+        for i in range(5):
+            self.conversation.save_turn(Message(role='user', content=f'Another cactus question {i}'))
+        first = self.search('cactus', limit=4)
+        second = self.search('cactus', limit=4, page=2)
+        self.assertTrue(first['has_more'])
+        self.assertFalse(second['has_more'])
+        ids = [r['message_id'] for r in first['results'] + second['results']]
+        self.assertEqual(len(set(ids)), 7)
+        self.assertEqual(self.client.get('/api/conversations/search/', {'q': 'x', 'page': '0'}).status_code, 400)
+
+    def test_scoped_to_the_user(self):
+        other = User.objects.create_user('other_searcher', password='testpass123')
+        Conversation.objects.active_for(other).first().save_turn(Message(role='user', content='My cactus died'))
+        self.assertEqual(len(search_messages(other.id, 'cactus', 10)), 1)
+        self.assertEqual(len(self.search('cactus')['results']), 2)
+        self.assertEqual(self.search('died')['results'], [])
+
+    def test_index_follows_deletes_and_soft_deletes(self):
+        self.conversation.messages.filter(role='assistant').delete()
+        self.assertEqual(len(self.search('cactus')['results']), 1)
+
+        self.client.post(f'/api/conversations/{self.conversation.id}/delete/')
+        self.assertEqual(self.search('cactus')['results'], [])
+        self.assertFalse(matching_messages('cactus').exists())
+
+        # Restored conversations are searchable again
+        self.conversation.is_active = True
+        self.conversation.save(update_fields=['is_active'])
+        self.assertEqual(len(self.search('cactus')['results']), 1)
+
+        message = self.conversation.messages.get()
+        message.content = 'Succulents are easy'
+        message.save()
+        self.assertEqual(self.search('cactus')['results'], [])
+        message.delete()
+        self.assertEqual(self.search('succulents')['results'], [])
+
+    def test_check_fails_when_a_rebuild_dropped_the_triggers(self):
+        self.assertEqual(missing_index(connection), [])
+        self.assertEqual(check_search_index(None, databases=['default']), [])
+
+        # What SQLite does to the triggers when a migration rebuilds the table
+        drop, name = {
+            'sqlite': ("DROP TRIGGER chatBot_message_fts_insert", 'chatBot_message_fts_insert'),
+            'postgresql': ("DROP INDEX message_search_idx", 'message_search_idx'),
+        }[connection.vendor]
+        with connection.cursor() as cursor:
+            cursor.execute(drop)
+        self.assertEqual(missing_index(connection), [name])
+        errors = check_search_index(None, databases=['default'])
+        self.assertEqual([error.id for error in errors], ['chatBot.E001'])
+        self.assertIn(name, errors[0].msg)
+
+    def test_admin_search_uses_the_index(self):
+        self.conversation.save_turn(Message(role='user', content='More about the cactus'))
+        admin = User.objects.create_superuser('search_admin', password='testpass123')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/chatBot/conversation/', {'q': 'cactus'})
+        # One row, however many of its messages match
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get('/admin/chatBot/message/', {'q': 'cactus'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+
+@override_settings(CHAT_EXPORT_BATCH_SIZE=2, CHAT_EXPORT_CHUNK_BYTES=100)
+class ExportTests(ChatTestCase):
+    """Streamed NDJSON exports of conversations and their messages"""
+
+    username = 'export_user'
+
+    def setUp(self):
+        super().setUp()
+        self.conversation.save_turn(Message(role='user', content='First question'),
+                                    Message(role='assistant', content='Answer'))
+        second = Conversation.objects.create(user=self.user)
+        second.save_turn(Message(role='user', content='Ünïcode and "quotes"'))
+        self.conversations = [self.conversation, second]
+        other = User.objects.create_user('not_exported', password='testpass123')
+        Conversation.objects.active_for(other).first().save_turn(Message(role='user', content='Private'))
+
+    def records(self, body):
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_each_conversation_then_its_messages(self):
+        response = self.client.get('/api/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = self.records(b''.join(response.streaming_content))
+        self.assertEqual([(r['type'], r.get('content')) for r in records], [
+            ('conversation', None), ('message', 'First question'), ('message', 'Answer'),
+            ('conversation', None), ('message', 'Ünïcode and "quotes"'),
+        ])
+        self.assertEqual(records[0]['user'], 'export_user')
+        self.assertEqual(records[4]['conversation'], self.conversations[1].id)
+
+    def test_queries_dont_grow_with_the_export(self):
+        for _ in range(5):
+            Conversation.objects.create(user=self.user).save_turn(Message(role='user', content='More'))
+        with CaptureQueriesContext(connection) as queries:
+            body = b''.join(export_stream(self.user.id))
+        self.assertEqual(len(self.records(body)), 5 + 10)
+        # Two queries, read a couple of rows at a time
+        self.assertEqual(len({q['sql'] for q in queries.captured_queries if 'chatBot_' in q['sql']}), 2)
+
+    def test_since_and_gzip(self):
+        since = timezone.now()
+        self.conversations[0].save_turn(Message(role='user', content='Later'))
+        response = self.client.get('/api/export/', {'since': since.isoformat(), 'format': 'gzip'})
+        records = self.records(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual([(r['type'], r['id']) for r in records],
+                         [('conversation', self.conversations[0].id), ('message', records[1]['id'])])
+        self.assertEqual(records[1]['content'], 'Later')
+        self.assertEqual(self.client.get('/api/export/', {'since': 'yesterday'}).status_code, 400)
+
+    async def test_asgi_streams_chunk_by_chunk(self):
+        response = await self.async_client.get('/api/export/')
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(len(self.records(b''.join(chunks))), 5)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/export.ndjson.gz"
+            call_command('export_conversations', output=path, gzip=True)
+            with gzip.open(path) as exported:
+                records = self.records(exported.read())
+        self.assertEqual(sum(r['type'] == 'message' for r in records), 4)
+        with self.assertRaises(CommandError):
+            call_command('export_conversations', user='nobody')
+
+
+@override_settings(CHAT_MEMORY_ENABLED=True)
+class ImportTests(ChatTestCase):
+    """Bulk NDJSON import with the counters Message.save() would keep, resumable"""
+
+    username = 'importer'
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, records, name='import.ndjson'):
+        path = f"{self.directory.name}/{name}"
+        with open(path, 'w') as f:
+            for record in records:
+                f.write((record if isinstance(record, str) else json.dumps(record)) + '\n')
+        return path
+
+    def history(self, source_id, user='importer', messages=3, start=0):
+        yield {'type': 'conversation', 'id': source_id, 'user': user, 'created_at': '2024-03-01T09:00:00Z'}
+        for i in range(start, start + messages):
+            yield {'type': 'message', 'conversation': source_id, 'role': 'user' if i % 2 == 0 else 'assistant',
+                   'content': f'Message {i} of {source_id}', 'timestamp': f'2024-03-01T10:00:{i:02d}Z'}
+
+    def imported(self):
+        return Conversation.objects.filter(user=self.user, created_at__year=2024).order_by('id')
+
+    def test_counters_titles_and_timestamps_across_batches(self):
+        path = self.write([*self.history('a', messages=5), *self.history(7, messages=2)])
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_conversations', path, batch_size=2, stdout=io.StringIO())
+        # A fixed handful of statements per batch, not per message
+        self.assertLessEqual(len([q for q in queries.captured_queries if 'chatBot_' in q['sql']]), 4 * 6 + 4)
+
+        first, second = self.imported()
+        self.assertEqual((first.message_count, second.message_count), (5, 2))
+        self.assertEqual(first.title, 'Message 0 of a')
+        self.assertEqual(first.preview_text, 'Message 0 of a')
+        self.assertEqual(first.created_at.isoformat(), '2024-03-01T09:00:00+00:00')
+        self.assertEqual(first.last_message_at.isoformat(), '2024-03-01T10:00:04+00:00')
+        self.assertEqual(first.updated_at, first.last_message_at)
+        self.assertEqual([m.content for m in first.messages.all()], [f'Message {i} of a' for i in range(5)])
+        # Searchable like any other message
+        self.assertEqual(len(search_messages(self.user.id, 'message', 20)), 7)
+
+    def test_round_trip_of_an_export(self):
+        conversation = self.conversation
+        conversation.save_turn(Message(role='user', content='Exported question'),
+                               Message(role='assistant', content='Exported answer'))
+        path = f"{self.directory.name}/export.ndjson"
+        call_command('export_conversations', user='importer', output=path)
+        Conversation.objects.filter(user=self.user).delete()
+
+        call_command('import_conversations', path, stdout=io.StringIO())
+        imported = Conversation.objects.get(user=self.user)
+        self.assertEqual((imported.title, imported.message_count, imported.created_at),
+                         (conversation.title, 2, conversation.created_at))
+
+    def test_resumes_after_a_bad_line(self):
+        records = [*self.history('a', messages=4), '{"type": "message", "conversation": "a"', *self.history('b')]
+        path = self.write(records)
+        with self.assertRaisesMessage(CommandError, 'Line 6'):
+            call_command('import_conversations', path, batch_size=2, stdout=io.StringIO())
+        # The batches before the bad one's are in
+        self.assertEqual(self.imported().get().message_count, 3)
+
+        records[5] = {'type': 'message', 'conversation': 'a', 'role': 'user', 'content': 'Fixed',
+                      'timestamp': '2024-03-01T10:00:30Z'}
+        self.write(records)
+        call_command('import_conversations', path, batch_size=2, stdout=io.StringIO())
+        first, second = self.imported()
+        self.assertEqual((first.message_count, second.message_count), (5, 3))
+        self.assertEqual(first.messages.count(), 5)
+        self.assertIsNotNone(ImportCheckpoint.objects.get(name='import.ndjson').finished_at)
+
+        # Done is done
+        call_command('import_conversations', path, stdout=io.StringIO())
+        self.assertEqual(Message.objects.filter(conversation__in=self.imported()).count(), 8)
+
+    def test_skip_invalid(self):
+        path = self.write([*self.history('a', user='nobody'), *self.history('b', messages=2), 'not json'])
+        with self.assertRaisesMessage(CommandError, 'No such user: nobody'):
+            call_command('import_conversations', path, stdout=io.StringIO())
+        errors = io.StringIO()
+        call_command('import_conversations', path, skip_invalid=True, stdout=io.StringIO(), stderr=errors)
+        # The conversation and its three messages, and the bad JSON
+        self.assertEqual(errors.getvalue().count('Skipped line'), 5)
+        self.assertEqual(self.imported().get().message_count, 2)
+
+        call_command('import_conversations', path, restart=True, create_users=True, skip_invalid=True,
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Conversation.objects.get(user__username='nobody', created_at__year=2024).message_count, 3)
+
+    def test_users_are_created_with_their_batch(self):
+        records = [*self.history('a', user='newcomer', messages=1), 'not json']
+        path = self.write(records)
+        with self.assertRaisesMessage(CommandError, 'Line 3'):
+            call_command('import_conversations', path, create_users=True, stdout=io.StringIO())
+        # The batch never went in, so neither did its user
+        self.assertFalse(User.objects.filter(username='newcomer').exists())
+
+        records[2] = {'type': 'message', 'conversation': 'a', 'role': 'assistant', 'content': 'Fixed',
+                      'timestamp': '2024-03-01T10:00:30Z'}
+        self.write(records)
+        call_command('import_conversations', path, create_users=True, stdout=io.StringIO())
+        self.assertEqual(Conversation.objects.get(user__username='newcomer', created_at__year=2024).message_count, 2)
+
+    def test_timestamps_are_kept_without_touching_the_model(self):
+        updated_at = Conversation._meta.get_field('updated_at')
+        flags = set()
+
+        def record(execute, sql, params, many, context):
+            flags.add(updated_at.auto_now)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            call_command('import_conversations', self.write(self.history('a')), stdout=io.StringIO())
+        # Another thread saving a conversation meanwhile still gets updated_at stamped
+        self.assertEqual(flags, {True})
+        self.assertEqual(self.imported().get().created_at.isoformat(), '2024-03-01T09:00:00+00:00')
+
+    def test_skipped_conversation_id_imports_nothing(self):
+        records = [*self.history(None, messages=2), *self.history('b', messages=2)]
+        errors = io.StringIO()
+        call_command('import_conversations', self.write(records), skip_invalid=True,
+                     stdout=io.StringIO(), stderr=errors)
+        # The bad conversation and both its messages
+        self.assertEqual(errors.getvalue().count('Skipped line'), 3)
+        self.assertEqual(self.imported().get().message_count, 2)
+        self.assertEqual(ImportCheckpoint.objects.get().conversations, 1)
+
+    def test_imported_messages_are_recalled(self):
+        records = [*self.history('a', messages=2), {
+            'type': 'message', 'conversation': 'a', 'role': 'user', 'timestamp': '2024-03-01T10:00:05Z',
+            'content': 'My grandmother kept bees in the orchard behind the farmhouse'}]
+        call_command('import_conversations', self.write(records), batch_size=2, stdout=io.StringIO())
+        beekeeping = Message.objects.get(content__startswith='My grandmother')
+
+        self.assertEqual(len(get_index(self.user.id)), 3)
+        self.assertIn(beekeeping.id, recall(self.user.id, 'bees in the orchard'))
+
+        other = User.objects.create_user('importer2', password='testpass123')
+        records = [*self.history('c', user='importer2', messages=2)]
+        call_command('import_conversations', self.write(records, 'quick.ndjson'), no_memory=True,
+                     stdout=io.StringIO())
+        self.assertEqual(len(get_index(other.id)), 0)
+
+
+@override_settings(CHAT_MEMORY_ENABLED=True, CHAT_PURGE_PAUSE=0)
+class PurgeTests(ChatTestCase):
+    """Retention and account deletion, deleting a bounded batch per transaction"""
+
+    username = 'purge_user'
+
+    def setUp(self):
+        super().setUp()
+        self.messages = Message.objects.bulk_create(
+            Message(conversation=self.conversation, role='user', content=f'Purgeable message {i}')
+            for i in range(25))
+
+    def age(self, queryset, days, **fields):
+        # update() leaves auto_now fields alone
+        queryset.update(**{field: timezone.now() - timedelta(days=days) for field in fields})
+
+    def test_deletes_a_bounded_batch_per_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            deleted = delete_in_batches(Message.objects.filter(conversation=self.conversation), batch_size=10)
+        self.assertEqual(deleted, 25)
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+        deletes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('DELETE')]
+        # 10 + 10 + 5: one DELETE per batch, each in its own transaction
+        self.assertEqual(len(deletes), 3)
+
+    def test_retention_respects_the_cutoffs(self):
+        other = Conversation.objects.create(user=self.user, title='Hidden yesterday', is_active=False)
+        Conversation.objects.filter(pk=self.conversation.pk).update(is_active=False)
+        self.age(Conversation.objects.filter(pk=self.conversation.pk), 31, updated_at=True)
+        old_job = Job.objects.create(kind='chat_turn', status='done', finished_at=timezone.now())
+        self.age(Job.objects.filter(pk=old_job.pk), 8, finished_at=True)
+        new_job = Job.objects.create(kind='chat_turn', status='failed', finished_at=timezone.now())
+        queued = Job.objects.create(kind='chat_turn')
+        self.age(Job.objects.filter(pk=queued.pk), 30, created_at=True)
+        key = IdempotencyKey.objects.create(user=self.user, key='old')
+        self.age(IdempotencyKey.objects.filter(pk=key.pk), 2, created_at=True)
+
+        with override_settings(CHAT_RETENTION_DELETED_DAYS=30, CHAT_RETENTION_JOB_DAYS=7):
+            counts = purge_expired(batch_size=10)
+
+        self.assertEqual(counts, {'conversations': 1, 'messages': 25, 'jobs': 1, 'idempotency_keys': 1})
+        self.assertEqual(list(Conversation.objects.filter(user=self.user)), [other])
+        self.assertEqual(set(Job.objects.values_list('id', flat=True)), {new_job.id, queued.id})
+
+    def test_account_deletion_is_queued_then_purged(self):
+        get_index(self.user.id).append([m.id for m in self.messages[:2]], [self.conversation.id] * 2,
+                                       ['Purgeable message 0', 'Purgeable message 1'])
+        self.client.login(username='purge_user', password='testpass123')
+        response = self.client.post('/settings/account/',
+                                    {'delete_account': '1', 'username_confirm': 'purge_user'})
+        self.assertEqual(response.status_code, 302)
+
+        # Nothing deleted in the request: the account is closed, the job queued
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(self.conversation.messages.count(), 25)
+        job = Job.objects.get(kind='delete_account')
+        self.assertEqual(job.payload, {'user_id': self.user.id})
+        self.assertFalse(self.client.login(username='purge_user', password='testpass123'))
+
+        output = io.StringIO()
+        pause_setting = settings.CHAT_PURGE_PAUSE
+        with mock.patch('chatBot.purge.time.sleep') as sleep:
+            call_command('purge', batch_size=10, pause=0.25, stdout=output)
+        self.assertIn('Deleted 1 accounts', output.getvalue())
+        # The options reach the account's deletion without touching the settings
+        sleep.assert_called_with(0.25)
+        self.assertEqual(settings.CHAT_PURGE_PAUSE, pause_setting)
+        self.assertFalse(User.objects.filter(pk=self.user.id).exists())
+        self.assertFalse(Message.objects.filter(conversation_id=self.conversation.id).exists())
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'done')
+        self.assertEqual(list(Path(self.memory_dir).glob(f"{self.user.id}-*")), [])
+
+    @override_settings(CHAT_QUEUE_JOB_TIMEOUT=1)
+    def test_account_purge_longer_than_the_job_timeout_keeps_its_job(self):
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        job = Job.objects.create(kind='delete_account', payload={'user_id': self.user.id})
+        sleep = time.sleep
+
+        def pause_and_sweep(seconds):
+            sleep(seconds)
+            # What a run_worker process does meanwhile
+            requeue_stale()
+
+        # Five batches 0.3s apart: longer than the timeout all told
+        with mock.patch('chatBot.purge.time.sleep', side_effect=pause_and_sweep):
+            call_command('purge', batch_size=5, pause=0.3, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('done', 1))
+        self.assertFalse(User.objects.filter(pk=self.user.id).exists())
+
+    def test_search_index_follows_the_purge(self):
+        hidden = Conversation.objects.create(user=self.user, title='Hidden', is_active=False)
+        Message.objects.create(conversation=hidden, role='user', content='Purgeable but hidden')
+        self.age(Conversation.objects.filter(pk=hidden.pk), 60, updated_at=True)
+        purge_expired()
+        self.assertEqual(len(search_messages(self.user.id, 'purgeable', 50)), 25)
+
+        purge_conversation(self.conversation.id, batch_size=10)
+        self.assertEqual(search_messages(self.user.id, 'purgeable', 50), [])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                # An external-content index with a row missing from the table fails this
+                cursor.execute("INSERT INTO chatBot_message_fts(chatBot_message_fts) VALUES ('integrity-check')")
+
+
+class RowCounter:
+    """Counts the rows the database hands back to Python while active"""
+
+    def __init__(self):
+        self.rows = 0
+
+    def __enter__(self):
+        counter = self
+
+        def fetchone(cursor):
+            row = cursor.cursor.fetchone()
+            counter.rows += row is not None
+            return row
+
+        def fetchmany(cursor, size=None):
+            rows = cursor.cursor.fetchmany(size) if size is not None else cursor.cursor.fetchmany()
+            counter.rows += len(rows)
+            return rows
+
+        def fetchall(cursor):
+            rows = cursor.cursor.fetchall()
+            counter.rows += len(rows)
+            return rows
+
+        def iterate(cursor):
+            for row in cursor.cursor:
+                counter.rows += 1
+                yield row
+
+        self.patches = [mock.patch.object(CursorWrapper, name, method, create=True) for name, method in
+                        (('fetchone', fetchone), ('fetchmany', fetchmany), ('fetchall', fetchall),
+                         ('__iter__', iterate))]
+        for patch in self.patches:
+            patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        for patch in reversed(self.patches):
+            patch.stop()
+
+
+# Fixture sizes the views are run at: (conversations, messages in the newest one),
+# every pairing so many conversations with few messages is covered too
+DATA_SIZES = list(itertools.product([1, 50, 500], [1, 100, 10_000]))
+
+
+class ViewBudget:
+    """
+    The most SQL queries one request to a view may make, the same at every
+    data size, and the most rows it may read: a number, or a function of
+    the fixture for views whose answer is all of the user's data
+    """
+
+    def __init__(self, name, url, queries, rows, method='get', data=None, headers=None):
+        self.name = name
+        self.url = url  # Function of the fixture
+        self.queries = queries
+        self.rows = rows
+        self.method = method
+        self.headers = headers
+        self.data = data  # A dict, or a function of the fixture
+
+    def row_limit(self, fixture):
+        return self.rows(fixture) if callable(self.rows) else self.rows
+
+
+def _chat(fixture):
+    return {'message': 'Hello', 'conversation_id': fixture['conversation']}
+
+
+# Counts include the session and user lookups (two queries, two rows)
+VIEW_BUDGETS = [
+    ViewBudget('home', lambda f: '/', queries=7, rows=54),
+    # The context walk stops once the token budget is spent
+    ViewBudget('send_message', lambda f: '/send_message/', queries=14, rows=55, method='post', data=_chat),
+    ViewBudget('send_message_stream', lambda f: '/send_message/stream/', queries=14, rows=55, method='post',
+               data=_chat),
+    ViewBudget('get_messages', lambda f: '/get_messages/', queries=7, rows=54,
+               data=lambda f: {'conversation_id': f['conversation']}),
+    ViewBudget('response_cache_stats', lambda f: '/api/cache/stats/', queries=5, rows=2),
+    ViewBudget('upstream_stats', lambda f: '/api/upstream/stats/', queries=5, rows=2),
+    ViewBudget('job_status', lambda f: f"/api/jobs/{f['job']}/", queries=6, rows=3),
+    ViewBudget('job_events', lambda f: f"/api/jobs/{f['job']}/events/", queries=5, rows=2),
+    ViewBudget('metrics', lambda f: '/metrics', queries=5, rows=2, headers={'Authorization': 'Bearer scrape-secret'}),
+    ViewBudget('auth', lambda f: '/auth/', queries=5, rows=2),
+    ViewBudget('register', lambda f: '/auth/register/', queries=5, rows=2),
+    ViewBudget('login', lambda f: '/auth/login/', queries=5, rows=2),
+    ViewBudget('logout', lambda f: '/auth/logout/', queries=5, rows=3, method='post'),
+    # The whole sidebar, one row per conversation
+    ViewBudget('conversation_history', lambda f: '/api/conversations/history/', queries=6,
+               rows=lambda f: f['conversations'] + 2),
+    ViewBudget('search_conversations', lambda f: '/api/conversations/search/', queries=6, rows=53,
+               data={'q': 'coffee'}),
+    # Everything the user has, by design
+    ViewBudget('export_conversations', lambda f: '/api/export/', queries=7,
+               rows=lambda f: 2 * f['conversations'] + f['messages'] + 2),
+    ViewBudget('get_conversation', lambda f: f"/api/conversations/{f['conversation']}/", queries=7, rows=54),
+    ViewBudget('create_conversation', lambda f: '/api/conversations/create/', queries=6, rows=3, method='post'),
+    ViewBudget('delete_conversation', lambda f: f"/api/conversations/{f['conversation']}/delete/", queries=7,
+               rows=3, method='post'),
+    ViewBudget('general_settings', lambda f: '/settings/general/', queries=6, rows=3),
+    ViewBudget('contact_settings', lambda f: '/settings/contact/', queries=5, rows=2),
+    ViewBudget('help_center', lambda f: '/settings/help/', queries=5, rows=2),
+    ViewBudget('account_settings', lambda f: '/settings/account/', queries=5, rows=2),
+    ViewBudget('password_change', lambda f: '/settings/account/password-change/', queries=5, rows=2),
+]
+
+
+# A context budget that even the 100 message conversation overflows: the
+# context walk is bounded by it, and the budget shows the walk stops there
+@override_settings(CHAT_CONTEXT_TOKENS=2048 + 2000, CHAT_MAX_TOKENS=2048, CHAT_METRICS_TOKEN='scrape-secret')
+class ViewBudgetTests(ChatTestCase):
+    """
+    Every view's SQL queries stay the same however much data the user has,
+    and the rows it reads stay within a bound. DeepSeekService is stubbed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures = []
+        for conversations, messages in DATA_SIZES:
+            user = User.objects.create_user(f'budget_{conversations}_{messages}', password='testpass123', is_staff=True)
+            # The user's first conversation, made by the sign-up signal
+            newest = Conversation.objects.get(user=user)
+            older = Conversation.objects.bulk_create(
+                Conversation(user=user, title=f'Older {i}', preview_text=f'Older question {i}', message_count=1)
+                for i in range(conversations - 1))
+            Message.objects.bulk_create(
+                Message(conversation=conversation, role='user', content=f'Older question {i}')
+                for i, conversation in enumerate(older))
+            # About 50 tokens each, so the context budget is spent long before 100
+            Message.objects.bulk_create(
+                (Message(conversation=newest, role='user' if i % 2 == 0 else 'assistant',
+                         content=f'Message {i} about the weather in Nairobi and the price of coffee ' * 3)
+                 for i in range(messages)), batch_size=2000)
+            Conversation.objects.filter(pk=newest.pk).update(message_count=messages, updated_at=timezone.now())
+            job = Job.objects.create(kind='chat_turn', user=user, status='done',
+                                     payload={'conversation_id': newest.id}, result={'ai_response': 'Hi'})
+            cls.fixtures.append({'user': user, 'conversation': newest.id, 'job': job.id,
+                                 'conversations': conversations, 'messages': messages})
+
+    def request(self, fixture, method, url, data=None, headers=None):
+        """(queries, rows) of one request as the fixture's user, rolled back afterwards"""
+        self.client.force_login(fixture['user'])
+        with transaction.atomic(), \
+                mock.patch.object(DeepSeekService, 'send_message', return_value='Stub reply'), \
+                mock.patch.object(DeepSeekService, 'stream_message', return_value=iter(['Stub', ' reply'])):
+            with CaptureQueriesContext(connection) as queries, RowCounter() as counter:
+                if method == 'post':
+                    response = self.client.post(url, json.dumps(data or {}), content_type='application/json',
+                                                headers=headers)
+                else:
+                    response = self.client.get(url, data, headers=headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 500, response)
+            transaction.set_rollback(True)
+        return len(queries), counter.rows
+
+    def test_queries_stay_flat_as_data_grows(self):
+        for budget in VIEW_BUDGETS:
+            counts = []
+            for fixture in self.fixtures:
+                with self.subTest(view=budget.name, conversations=fixture['conversations'],
+                                  messages=fixture['messages']):
+                    data = budget.data(fixture) if callable(budget.data) else budget.data
+                    queries, rows = self.request(fixture, budget.method, budget.url(fixture), data, budget.headers)
+                    counts.append(queries)
+                    self.assertLessEqual(queries, budget.queries)
+                    self.assertLessEqual(rows, budget.row_limit(fixture))
+            with self.subTest(view=budget.name):
+                self.assertEqual(len(set(counts)), 1, f"Queries grow with the data: {counts}")
+
+    def test_every_view_has_a_budget(self):
+        from . import urls
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names - {budget.name for budget in VIEW_BUDGETS}, set())
+
+
+@override_settings(DEEPSEEK_API_KEY='test-key', CHAT_MODELS=['primary/model'], CHAT_RETRY_ATTEMPTS=0,
+                   CHAT_METRICS_TOKEN='scrape-secret')
+class MetricsTests(ChatTestCase):
+    """Request, database and upstream metrics at /metrics, added up across processes"""
+
+    username = 'metrics_user'
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.override(CHAT_METRICS_DIR=directory.name)
+        self.directory = directory.name
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        cache.clear()
+        reset_http_session()
+        self.addCleanup(reset_http_session)
+
+    def scrape(self):
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode()
+
+    def test_request_latency_and_queries_by_view(self):
+        self.client.get('/api/conversations/history/')
+        self.client.get('/api/conversations/history/')
+        self.client.get('/no/such/page/')
+        Job.objects.create(kind='chat_turn')
+
+        text = self.scrape()
+        self.assertIn('chat_http_requests_total{view="conversation_history",method="GET",status="200"} 2', text)
+        self.assertIn('chat_http_requests_total{view="unmatched",method="GET",status="404"} 1', text)
+        self.assertIn('chat_http_request_duration_seconds_count{view="conversation_history",method="GET"} 2', text)
+        self.assertIn('chat_http_request_duration_seconds_bucket{view="conversation_history",method="GET",le="+Inf"} 2',
+                      text)
+        # A handful of queries each, every one of them counted
+        self.assertIn('chat_http_request_db_queries_bucket{view="conversation_history",le="8.0"} 2', text)
+        self.assertIn('chat_http_request_db_queries_bucket{view="conversation_history",le="2.0"} 0', text)
+        self.assertIn('chat_jobs{status="queued"} 1', text)
+
+    def test_upstream_latency_errors_and_tokens(self):
+        ok = mock.Mock(status_code=200)
+        ok.json.return_value = {'choices': [{'message': {'content': 'Hi!'}}],
+                                'usage': {'prompt_tokens': 12, 'completion_tokens': 3}}
+        failed = mock.Mock(status_code=502, text='Bad gateway', headers={})
+        with mock.patch.object(get_http_session(), 'post', side_effect=[ok, failed]):
+            DeepSeekService.send_message([{'role': 'user', 'content': 'Hello'}])
+            with self.assertRaises(AIServiceError):
+                DeepSeekService.send_message([{'role': 'user', 'content': 'Hello again'}])
+
+        text = self.scrape()
+        self.assertIn('chat_upstream_prompt_tokens_total{model="primary/model"} 12', text)
+        self.assertIn('chat_upstream_completion_tokens_total{model="primary/model"} 3', text)
+        self.assertIn('chat_upstream_duration_seconds_count{model="primary/model"} 2', text)
+        self.assertIn('chat_upstream_errors_total{model="primary/model",code="502"} 1', text)
+
+    def test_processes_are_added_up(self):
+        self.client.get('/api/conversations/history/')
+        # What another worker process wrote
+        other = {
+            'chat_http_requests_total': [[['conversation_history', 'GET', '200'], 4]],
+            'chat_upstream_prompt_tokens_total': [[['primary/model'], 100]],
+        }
+        with open(f"{self.directory}/99999.json", 'w') as f:
+            json.dump(other, f)
+
+        text = self.scrape()
+        self.assertIn('chat_http_requests_total{view="conversation_history",method="GET",status="200"} 5', text)
+        self.assertIn('chat_upstream_prompt_tokens_total{model="primary/model"} 100', text)
+
+    @skipUnless(metrics.fcntl, "Files are only folded in where there's fcntl")
+    def test_exited_processes_are_folded_in_once(self):
+        self.client.get('/api/conversations/history/')
+        # A process that has exited: its lock file is there, but nobody holds it
+        with open(f"{self.directory}/99998.json", 'w') as f:
+            json.dump({'chat_http_requests_total': [[['conversation_history', 'GET', '200'], 4]]}, f)
+        Path(f"{self.directory}/99998.lock").touch()
+        # And one still running
+        with open(f"{self.directory}/99997.json", 'w') as f:
+            json.dump({'chat_http_requests_total': [[['conversation_history', 'GET', '200'], 2]]}, f)
+        running = open(f"{self.directory}/99997.lock", 'a')
+        self.addCleanup(running.close)
+        metrics.fcntl.flock(running, metrics.fcntl.LOCK_EX)
+
+        for _ in range(2):
+            text = self.scrape()
+            self.assertIn('chat_http_requests_total{view="conversation_history",method="GET",status="200"} 7', text)
+        self.assertFalse(Path(f"{self.directory}/99998.json").exists())
+        self.assertFalse(Path(f"{self.directory}/99998.lock").exists())
+        self.assertTrue(Path(f"{self.directory}/99997.json").exists())
+
+    @skipUnless(metrics.fcntl, "Files are only folded in where there's fcntl")
+    def test_reused_pid_keeps_the_earlier_process_counts(self):
+        # Left by an exited process that had this process's pid
+        with open(f"{self.directory}/{os.getpid()}.json", 'w') as f:
+            json.dump({'chat_http_requests_total': [[['conversation_history', 'GET', '200'], 4]]}, f)
+
+        self.client.get('/api/conversations/history/')
+        text = self.scrape()
+        self.assertIn('chat_http_requests_total{view="conversation_history",method="GET",status="200"} 5', text)
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+        # Open without one only under DEBUG
+        with override_settings(CHAT_METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class LoggingTests(ChatTestCase):
+    """JSON logs written by a background thread, with request ids and one record per chat turn"""
+
+    username = 'logging_user'
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def capture(self, target=None, queue_size=100):
+        """A queue handler on the chatBot loggers writing JSON lines to a StringIO"""
+        output = io.StringIO()
+        if target is None:
+            target = logging.StreamHandler(output)
+            target.setFormatter(logs.JsonFormatter())
+        handler = logs.QueueJsonHandler(queue_size=queue_size, target=target)
+        handler.addFilter(logs.RequestIdFilter())
+        logger = logging.getLogger('chatBot')
+        logger.addHandler(handler)
+        self.addCleanup(handler.close)
+        self.addCleanup(logger.removeHandler, handler)
+        return handler, output
+
+    def test_request_id_is_taken_or_made_up(self):
+        response = self.client.get('/api/conversations/history/', headers={'X-Request-ID': 'edge-41.7'})
+        self.assertEqual(response['X-Request-ID'], 'edge-41.7')
+        # Not something to copy into logs as it is
+        response = self.client.get('/api/conversations/history/', headers={'X-Request-ID': 'a b\n{"level"'})
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+        self.assertRegex(self.client.get('/api/conversations/history/')['X-Request-ID'], r'^[0-9a-f]{32}$')
+
+    def test_one_record_per_turn_with_phase_timings(self):
+        # The request id is stamped by a handler filter; stamp it here instead
+        turns = logging.getLogger('chatBot.turns')
+        request_ids = logs.RequestIdFilter()
+        turns.addFilter(request_ids)
+        self.addCleanup(turns.removeFilter, request_ids)
+        with mock.patch.object(DeepSeekService, 'send_message', return_value='Hello!'), \
+                self.assertLogs('chatBot.turns', 'INFO') as captured:
+            self.client.post('/send_message/', json.dumps({'message': 'Hi'}), content_type='application/json',
+                             headers={'X-Request-ID': 'turn-1'})
+
+        records = [r for r in captured.records if getattr(r, 'event', None) == 'chat.turn']
+        self.assertEqual(len(records), 1)
+        turn = records[0]
+        self.assertEqual(turn.request_id, 'turn-1')
+        self.assertEqual(turn.outcome, 'ok')
+        self.assertEqual(turn.user_id, self.user.id)
+        self.assertEqual(turn.reply_chars, 6)
+        for phase in ('db_read_ms', 'upstream_ms', 'db_write_ms', 'total_ms'):
+            self.assertGreaterEqual(getattr(turn, phase), 0)
+
+    def test_records_are_written_as_json_lines(self):
+        handler, output = self.capture()
+        self.addCleanup(logs._request_id.set, logs.get_request_id())
+        logs.set_request_id('json-1')
+        logging.getLogger('chatBot.tests').info("Hello", extra={'event': 'test.event', 'n': 3})
+        handler.flush()
+
+        record = json.loads(output.getvalue())
+        self.assertEqual(record['request_id'], 'json-1')
+        self.assertEqual(record['event'], 'test.event')
+        self.assertEqual(record['n'], 3)
+
+    def test_upstream_error_body_is_cut_short(self):
+        failed = mock.Mock(status_code=502, text='<html>' + 'x' * 5000, headers={})
+        with mock.patch.object(get_http_session(), 'post', return_value=failed), \
+                self.assertLogs('chatBot.services', 'WARNING') as captured:
+            with self.assertRaises(AIServiceError):
+                DeepSeekService.complete_once('primary/model', [{'role': 'user', 'content': 'Hi'}])
+
+        record = captured.records[0]
+        self.assertEqual(record.event, 'upstream.request')
+        self.assertEqual(record.code, 502)
+        self.assertEqual(len(record.detail), 300)
+
+    def test_full_queue_drops_records_instead_of_blocking(self):
+        release = threading.Event()
+
+        class SlowCollector(logging.Handler):
+            def emit(self, record):
+                release.wait(5)
+
+        handler, _ = self.capture(target=SlowCollector(), queue_size=2)
+        self.addCleanup(release.set)
+        # Only to this handler, not the project's own as well
+        logger = logging.getLogger('chatBot.tests')
+        logging.getLogger('chatBot').removeHandler(handler)
+        logger.addHandler(handler)
+        logger.propagate = False
+        self.addCleanup(setattr, logger, 'propagate', True)
+        self.addCleanup(logger.removeHandler, handler)
+        start = time.perf_counter()
+        for n in range(10):
+            logger.info("Record %s", n)
+        self.assertLess(time.perf_counter() - start, 1)
+
+        results = dict((labels[0], count) for labels, count in metrics.LOG_RECORDS.snapshot())
+        self.assertEqual(results['queued'] + results['dropped'], 10)
+        # At most one with the writer and two waiting
+        self.assertGreaterEqual(results['dropped'], 7)
+
+    @override_settings(CHAT_LOG_SAMPLE_RATES={'upstream.request': 0.0})
+    def test_sampling_never_drops_warnings(self):
+        sample = logs.SampleFilter()
+
+        def record(level, event):
+            record = logging.LogRecord('chatBot.services', level, __file__, 0, 'message', (), None)
+            record.event = event
+            return record
+
+        self.assertFalse(sample.filter(record(logging.INFO, 'upstream.request')))
+        self.assertTrue(sample.filter(record(logging.WARNING, 'upstream.request')))
+        self.assertTrue(sample.filter(record(logging.INFO, 'chat.turn')))
+
+
+@override_settings(DEEPSEEK_API_KEY='test-key', CHAT_MODELS=['primary/model'])
+class ProfilingTests(ChatTestCase):
+    """Sampled and staff-requested request profiles, kept in a ring buffer"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        reset_http_session()
+        self.addCleanup(reset_http_session)
+        self.user = User.objects.create_user('profiled_user', password='testpass123')
+        self.staff = User.objects.create_user('profiling_staff', password='testpass123', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def test_staff_header_profiles_the_request(self):
+        self.client.get('/api/conversations/history/')
+        self.assertFalse(RequestProfile.objects.exists())
+
+        response = self.client.get('/api/conversations/history/', headers={'X-Profile': '1'})
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.view, profile.status, profile.trigger, profile.user),
+                         ('conversation_history', 200, 'header', self.staff))
+        self.assertEqual(profile.request_id, response['X-Request-ID'])
+        self.assertEqual(profile.query_count, len(profile.data['queries']))
+        self.assertTrue(any('chatBot_conversation' in q['sql'] for q in profile.data['queries']))
+        self.assertNotIn('stacks', profile.data)
+
+        # Anyone else's header is ignored
+        self.client.force_login(self.user)
+        self.client.get('/api/conversations/history/', headers={'X-Profile': '1'})
+        self.assertEqual(RequestProfile.objects.count(), 1)
+
+    def test_duplicate_and_repeated_queries(self):
+        profile = profiling.Profile('header')
+        token = profiling.activate(profile)
+        try:
+            for pk in (1, 1, 2):
+                Conversation.objects.filter(pk=pk).exists()
+        finally:
+            profiling.deactivate(token)
+
+        duplicates, data = profile.summary()
+        self.assertEqual(duplicates, 1)
+        self.assertEqual(len(data['repeated']), 1)
+        self.assertEqual((data['repeated'][0]['count'], data['repeated'][0]['duplicates']), (3, 1))
+        # Parameters may be users' messages: never stored
+        self.assertNotIn('params', data['queries'][0])
+
+    def test_upstream_calls_and_template_render(self):
+        self.client.get('/', headers={'X-Profile': '1'})
+        home = RequestProfile.objects.get()
+        self.assertIn('render chat.html', home.data['sections'])
+
+        ok = mock.Mock(status_code=200)
+        ok.json.return_value = {'choices': [{'message': {'content': 'Hi!'}}]}
+        with mock.patch.object(get_http_session(), 'post', return_value=ok):
+            self.client.post('/send_message/', json.dumps({'message': 'Hello'}), content_type='application/json',
+                             headers={'X-Profile': '1'})
+        turn = RequestProfile.objects.latest('id')
+        self.assertEqual(turn.view, 'send_message')
+        self.assertEqual([call['model'] for call in turn.data['upstream']], ['primary/model'])
+        self.assertGreaterEqual(turn.upstream_ms, 0)
+
+    @mock.patch.object(DeepSeekService, 'stream_message', return_value=iter(['Hel', 'lo!']))
+    def test_stream_is_profiled_to_the_end(self, stream_message):
+        response = self.client.post('/send_message/stream/', json.dumps({'message': 'Hello'}),
+                                    content_type='application/json', headers={'X-Profile': '1'})
+        self.assertFalse(RequestProfile.objects.exists())
+        b''.join(response.streaming_content)
+
+        profile = RequestProfile.objects.get()
+        # The turn is saved while the body streams
+        self.assertTrue(any(q['sql'].startswith('INSERT INTO "chatBot_message"') for q in profile.data['queries']))
+
+    @override_settings(CHAT_PROFILE_SAMPLE_RATE=1.0, CHAT_PROFILE_KEEP=3)
+    def test_only_the_newest_profiles_are_kept(self):
+        for _ in range(5):
+            self.client.get('/api/conversations/history/')
+        profiles = list(RequestProfile.objects.values_list('trigger', flat=True))
+        self.assertEqual(profiles, ['sample'] * 3)
+
+    def test_profile_in_the_admin(self):
+        self.client.get('/api/conversations/history/', headers={'X-Profile': 'stacks'})
+        profile = RequestProfile.objects.get()
+        self.assertIn('stacks', profile.data)
+
+        admin = User.objects.create_superuser('profile_admin', password='testpass123')
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get('/admin/chatBot/requestprofile/').status_code, 200)
+        page = self.client.get(f'/admin/chatBot/requestprofile/{profile.id}/change/')
+        self.assertContains(page, 'FROM &quot;chatBot_conversation&quot;')
+
+    @override_settings(CHAT_PROFILE_STACK_INTERVAL=0.001)
+    def test_stack_samples(self):
+        profile = profiling.Profile('header', stacks=True)
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        _, data = profile.summary()
+        profile.sampler.stop()
+
+        self.assertTrue(data['stacks'])
+        self.assertTrue(any('test_stack_samples' in stack for stack, _ in data['stacks']))
@@ -0,0 +1,95 @@
+"""
+One chat turn, shared by the chat views and the job worker that runs turns
+off the request path (see jobs.py).
+"""
+import logging
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from .context import estimate_tokens
+from .idempotency import finish
+from .memory import remember_later
+from .models import Message
+from .ratelimit import record_tokens
+from .summaries import schedule_summary
+
+# One chat turn on its way to the model. The user's message is not saved
+# yet: it goes into the database together with the reply (see save_reply),
+# so a turn costs one transaction. fresh asks for a new reply even if an
+# identical request is in the response cache. claim is the IdempotencyKey
+# this request owns, if the client sent a key.
+Turn = namedtuple('Turn', ['conversation', 'user_msg', 'message_history', 'fresh', 'claim'])
+
+logger = logging.getLogger(__name__)
+
+
+class TurnTimer:
+    """
+    Times the phases of one chat turn (db_read, upstream, db_write) and logs
+    them in a single chat.turn record when the turn is over
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def log(self, turn, outcome, error=None, exc_info=None, **fields):
+        """outcome is ok, queued, upstream_error, error or abandoned"""
+        record = {
+            'event': 'chat.turn',
+            'outcome': outcome,
+            'conversation_id': turn.conversation.id if turn else None,
+            'user_id': turn.conversation.user_id if turn else None,
+            'messages_sent': len(turn.message_history) if turn else None,
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 1),
+            **{f'{name}_ms': round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            **fields,
+        }
+        if error is not None:
+            record['error'] = str(error)
+        level = logging.ERROR if exc_info else logging.WARNING if error is not None else logging.INFO
+        logger.log(level, "Chat turn %s", outcome, exc_info=exc_info, extra=record)
+
+
+def save_reply(turn, content):
+    """
+    Save the turn: the user's message and the assistant's reply (None when
+    there is no reply to keep) in one transaction
+    """
+    conversation = turn.conversation
+    reply = None if content is None else Message(role='assistant', content=content)
+    # What the turn cost upstream, against the user's tokens-per-minute budget
+    record_tokens(conversation.user_id, sum(estimate_tokens(message['content']) for message in turn.message_history)
+                  + estimate_tokens(content or ''))
+    with transaction.atomic():
+        messages = conversation.save_turn(turn.user_msg, reply)
+        if turn.claim is not None:
+            # Same transaction: a retry finds either no turn, or the turn
+            # and the result to replay
+            finish(turn.claim, turn_result(turn, content))
+
+    # Off the request path: fold turns that just left the live window into
+    # the summary, and add this turn to the user's memory index. After the
+    # commit, since the job worker saves turns inside a larger transaction
+    transaction.on_commit(lambda: schedule_summary(conversation.id))
+    transaction.on_commit(lambda: remember_later(conversation.user_id, messages))
+
+
+def turn_result(turn, content):
+    """What the chat API answers with for a finished turn"""
+    return {
+        'user_message': turn.user_msg.content,
+        'ai_response': content or '',
+        'conversation_id': turn.conversation.id
+    }
@@ -9,7 +9,13 @@ urlpatterns = [
     # Home/Chat URLs
     path('', views.home, name='home'),
     path('send_message/', views.send_message, name='send_message'),
+    path('send_message/stream/', views.send_message_stream, name='send_message_stream'),
     path('get_messages/', views.get_messages, name='get_messages'),
+    path('api/cache/stats/', views.response_cache_stats, name='response_cache_stats'),
+    path('api/upstream/stats/', views.upstream_stats, name='upstream_stats'),
+    path('api/jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('api/jobs/<int:job_id>/events/', views.job_events, name='job_events'),
+    path('metrics', views.metrics_view, name='metrics'),  # Prometheus scrape target
     
     # Authentication URLs
     path('auth/', auth_page, name='auth'),  # Shows the page with two buttons (shows auth.html)
@@ -19,6 +25,8 @@ urlpatterns = [
     
     # Conversation History URLs
     path('api/conversations/history/', views.conversation_history, name='conversation_history'),
+    path('api/conversations/search/', views.search_conversations, name='search_conversations'),
+    path('api/export/', views.export_conversations, name='export_conversations'),
     path('api/conversations/<int:conversation_id>/', views.get_conversation, name='get_conversation'),
     path('api/conversations/create/', views.create_conversation, name='create_conversation'),
     path('api/conversations/<int:conversation_id>/delete/', views.delete_conversation, name='delete_conversation'),
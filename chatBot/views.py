@@ -1,100 +1,482 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import UserCreationForm
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.crypto import constant_time_compare
+from asgiref.sync import sync_to_async
+import asyncio
 import json
-from .models import Conversation, Message
+import logging
+import time
+from django.conf import settings
+from .models import EMPTY_PREVIEW, Conversation, Job, Message
 from .services import DeepSeekService 
+from . import metrics, profiling
+from .errors import AIServiceError
+from .context import abuild_context
+from .turns import Turn, TurnTimer, save_reply
+from .jobs import QueueFull, enqueue_turn, queued_result
+from .pagination import PaginationError, message_page, page_number, page_size
+from .search import highlight, search_messages
+from .export import aexport_stream, export_stream, parse_since
+from .response_cache import get_response_cache
+from .hedging import get_upstream_stats
+from .resilience import circuit_states
+from .ratelimit import rate_limited
+from .idempotency import IdempotencyError, arelease, claim_or_wait, get_key, release
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
 from datetime import timedelta
 
+logger = logging.getLogger(__name__)
 
 # Home view - if authenticated, show chat interface
 def home(request):
     if request.user.is_authenticated:
         # Get user's most recent conversation
-        conversation = Conversation.objects.filter(user=request.user, is_active=True).order_by('-updated_at').first()
+        conversation = Conversation.objects.active_for(request.user).first()
         if not conversation:
             conversation = Conversation.objects.create(user=request.user)
         
-        # Get all messages in this conversation
-        messages = Message.objects.filter(conversation=conversation)
-        return render(request, 'chat.html', {
-            'messages': messages,
-            'conversation': conversation
-        })
+        # Only the newest page; chat.js fetches older ones on scroll
+        page = message_page(conversation.id)
+        with profiling.section('render chat.html'):
+            return render(request, 'chat.html', {
+                'messages': page.messages,
+                'page': page,
+                'conversation': conversation
+            })
     else:
         return render(request, 'home.html')
     
 
+async def _claim(request, user):
+    """
+    (claim, replay): the IdempotencyKey to record the result against, or
+    the stored result of an earlier request with the same key
+    """
+    key = get_key(request)
+    if key is None:
+        return None, None
+    return await claim_or_wait(user.id, key)
+
+
+async def _begin_turn(request, user, claim=None):
+    """
+    Validate a chat POST and build the history.
+    Returns (turn, error_response)
+    """
+    data = json.loads(request.body)
+    user_message = data.get('message', '').strip()
+    conversation_id = data.get('conversation_id')
+    
+    if not user_message:
+        return None, JsonResponse({'status': 'error', 'message': 'Message cannot be empty'})
+    
+    # Get or create conversation
+    if conversation_id:
+        try:
+            conversation = await Conversation.objects.aget(id=conversation_id, user=user, is_active=True)
+        except Conversation.DoesNotExist:
+            return None, JsonResponse({'status': 'error', 'message': 'Conversation not found'})
+    else:
+        conversation = await Conversation.objects.acreate(user=user)
+    
+    # Saved, and stamped, with the reply (see turns.save_reply)
+    user_msg = Message(
+        conversation=conversation,
+        role='user',
+        content=user_message
+    )
+    
+    # Get the newest history that fits the model's context for this turn,
+    # plus older turns recalled as relevant to this message
+    context = await abuild_context(conversation.id, user_id=user.id, pending=user_msg)
+    message_history = DeepSeekService.format_message_history(
+        context.messages, summary=context.summary, recalled=context.recalled)
+    return Turn(conversation, user_msg, message_history, bool(data.get('fresh')), claim), None
+
+
+_asave_reply = sync_to_async(save_reply)
+
+
+async def _get_ai_response(request, turn):
+    # Under ASGI await OpenRouter on the event loop. Under WSGI the worker
+    # thread is held for the request anyway (and every request gets a fresh
+    # event loop), so use the pooled sync session there
+    if isinstance(request, ASGIRequest):
+        return await DeepSeekService.asend_message(turn.message_history, fresh=turn.fresh)
+    return await sync_to_async(DeepSeekService.send_message, thread_sensitive=False)(
+        turn.message_history, fresh=turn.fresh)
+
+
 #api endpoint to send and receive messages
 @csrf_exempt
-def send_message(request):
+@rate_limited
+async def send_message(request):
     """
-    API endpoint to send message to DeepSeek and save response
+    API endpoint to send message to DeepSeek and save response.
+    Async so that under ASGI the upstream wait doesn't hold a worker thread.
     """
-    if request.method == 'POST' and request.user.is_authenticated:
+    user = await request.auser()
+    if request.method == 'POST' and user.is_authenticated:
+        claim = None
+        turn = None
+        timer = TurnTimer()
         try:
-            data = json.loads(request.body)
-            user_message = data.get('message', '').strip()
-            conversation_id = data.get('conversation_id')
-            
-            if not user_message:
-                return JsonResponse({'status': 'error', 'message': 'Message cannot be empty'})
-            
-            # Get or create conversation
-            if conversation_id:
-                try:
-                    conversation = Conversation.objects.get(id=conversation_id, user=request.user, is_active=True)
-                except Conversation.DoesNotExist:
-                    return JsonResponse({'status': 'error', 'message': 'Conversation not found'})
-            else:
-                conversation = Conversation.objects.create(user=request.user)
+            # A retry of a request we've already answered (or are answering)
+            claim, replay = await _claim(request, user)
+            if replay is not None:
+                if replay.get('status') == 'queued':
+                    return JsonResponse(replay, status=202)
+                return JsonResponse({'status': 'success', **replay})
             
-            # Save user message
-            Message.objects.create(
-                conversation=conversation,
-                role='user',
-                content=user_message
-            )
+            with timer.phase('db_read'):
+                turn, error = await _begin_turn(request, user, claim)
+            if error:
+                if claim:
+                    await arelease(claim)
+                return error
             
-            # Get conversation history for context
-            previous_messages = Message.objects.filter(conversation=conversation).order_by('timestamp')
-            message_history = DeepSeekService.format_message_history(previous_messages)
+            # Queue mode: a job worker calls the model, the client polls the job
+            if settings.CHAT_QUEUE_ENABLED:
+                with timer.phase('db_write'):
+                    job, error = await _enqueue_turn(turn)
+                timer.log(turn, 'queued' if job else 'queue_full')
+                return error or JsonResponse(queued_result(job, turn.conversation.id), status=202)
             
             # Get AI response from DeepSeek
-            ai_response = DeepSeekService.send_message(message_history)
+            with timer.phase('upstream'):
+                ai_response = await _get_ai_response(request, turn)
             
             # Save AI response
-            ai_msg = Message.objects.create(
-                conversation=conversation,
-                role='assistant',
-                content=ai_response
-            )
-            
-            # Update conversation timestamp
-            conversation.save()
+            with timer.phase('db_write'):
+                await _asave_reply(turn, ai_response)
+            timer.log(turn, 'ok', reply_chars=len(ai_response))
             
             return JsonResponse({
                 'status': 'success',
-                'user_message': user_message,
+                'user_message': turn.user_msg.content,
                 'ai_response': ai_response,
-                'conversation_id': conversation.id
+                'conversation_id': turn.conversation.id
             })
-            
-        except Exception as e:
-            print(f"Error in send_message: {e}")
+        
+        except IdempotencyError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status)
+        except AIServiceError as e:
+            # Nothing saved: the error isn't the assistant's reply, and the
+            # client can send the message again
+            timer.log(turn, 'upstream_error', error=e)
+            if claim:
+                await arelease(claim)
+            return _ai_error_response(e)
+        except Exception:
+            timer.log(turn, 'error', exc_info=True)
+            if claim:
+                await arelease(claim)
             return JsonResponse({'status': 'error', 'message': 'Internal server error'})
     
     return JsonResponse({'status': 'error', 'message': 'Unauthorized'})
 
+
+async def _enqueue_turn(turn):
+    """
+    Hand the turn to the job worker. Returns (job, error_response): when the
+    queue is full the client gets a 503 and should retry after Retry-After.
+    """
+    try:
+        return await sync_to_async(enqueue_turn)(turn), None
+    except QueueFull as e:
+        logger.warning("Chat queue full: %s", e, extra={'event': 'queue.full'})
+        if turn.claim:
+            await arelease(turn.claim)
+        response = JsonResponse({
+            'status': 'error',
+            'message': 'The server is busy right now, please try again shortly'
+        }, status=503)
+        response['Retry-After'] = str(settings.CHAT_QUEUE_RETRY_AFTER)
+        return None, response
+
+
+def _ai_error_response(error):
+    """The chat API's answer when OpenRouter couldn't produce a reply"""
+    response = JsonResponse({'status': 'error', 'message': str(error)}, status=error.status)
+    if error.retry_after:
+        response['Retry-After'] = str(int(error.retry_after + 0.999))
+    return response
+
+
+def _sse(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@csrf_exempt
+@rate_limited
+async def send_message_stream(request):
+    """
+    Streaming version of send_message: relays the reply as Server-Sent Events
+    (start, token..., done) while OpenRouter generates it.
+
+    The assistant message is saved once the stream ends. If the client goes
+    away mid-stream the generator is closed and whatever arrived so far is kept.
+    """
+    user = await request.auser()
+    if request.method != 'POST' or not user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Unauthorized'})
+    
+    claim = None
+    turn = None
+    timer = TurnTimer()
+    try:
+        claim, replay = await _claim(request, user)
+        if replay is not None:
+            if replay.get('status') == 'queued':
+                return _job_response(request, replay)
+            return _event_stream_response(_replay_events(replay))
+        
+        with timer.phase('db_read'):
+            turn, error = await _begin_turn(request, user, claim)
+        if error:
+            if claim:
+                await arelease(claim)
+            return error
+        
+        if settings.CHAT_QUEUE_ENABLED:
+            with timer.phase('db_write'):
+                job, error = await _enqueue_turn(turn)
+            timer.log(turn, 'queued' if job else 'queue_full')
+            return error or _job_response(request, queued_result(job, turn.conversation.id))
+    except IdempotencyError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status)
+    except Exception:
+        timer.log(turn, 'error', exc_info=True)
+        if claim:
+            await arelease(claim)
+        return JsonResponse({'status': 'error', 'message': 'Internal server error'})
+    
+    # Under ASGI relay with an async generator (a sync one would be buffered
+    # whole by Django); under WSGI a plain generator streams fine
+    if isinstance(request, ASGIRequest):
+        events = _astream_events(turn, timer)
+    else:
+        events = _stream_events(turn, timer)
+    return _event_stream_response(events)
+
+
+def _event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+
+def _job_response(request, result):
+    """
+    A queued turn. Under ASGI follow the job and stream the reply as it is
+    written; under WSGI that would hold a thread again, so the client polls
+    """
+    if isinstance(request, ASGIRequest):
+        return _event_stream_response(_ajob_events(result['job_id'], result['conversation_id']))
+    return JsonResponse(result, status=202)
+
+
+async def _ajob_events(job_id, conversation_id):
+    """
+    A queued turn as Server-Sent Events, read off its job row as the worker
+    fills it in. Gives up after CHAT_QUEUE_WAIT_TIMEOUT, so a job stuck in
+    the queue can't hold the connection forever; the client can still poll
+    """
+    yield _sse('start', {'conversation_id': conversation_id, 'job_id': job_id})
+    sent = 0
+    deadline = time.monotonic() + settings.CHAT_QUEUE_WAIT_TIMEOUT
+    while True:
+        job = await Job.objects.values('status', 'output', 'result').aget(pk=job_id)
+        text = job['result']['ai_response'] if job['status'] == 'done' else job['output']
+        if len(text) > sent:
+            yield _sse('token', {'delta': text[sent:]})
+            sent = len(text)
+        if job['status'] == 'done':
+            yield _sse('done', {'conversation_id': conversation_id})
+            return
+        if job['status'] == 'failed':
+            yield _sse('error', {'message': 'Failed to get response'})
+            return
+        if time.monotonic() > deadline:
+            yield _sse('error', {'message': 'Timed out waiting for the response', 'job_id': job_id})
+            return
+        await asyncio.sleep(settings.CHAT_QUEUE_POLL_INTERVAL)
+
+
+def _replay_events(result):
+    """A stored turn played back as one stream"""
+    return [
+        _sse('start', {'conversation_id': result['conversation_id']}),
+        _sse('token', {'delta': result['ai_response']}),
+        _sse('done', {'conversation_id': result['conversation_id']}),
+    ]
+
+
+def _abandon_turn(turn, chunks):
+    """
+    The stream ended early: the client went away or OpenRouter failed. Keep
+    the user's message and any partial reply, unless nothing arrived and the
+    client can retry with its idempotency key: then give the key back so the
+    retry runs the turn.
+    """
+    if not chunks and turn.claim is not None:
+        release(turn.claim)
+    else:
+        save_reply(turn, ''.join(chunks) or None)
+
+
+def _error_event(error):
+    # The turn is then handled like a disconnect (see _abandon_turn): the
+    # error text itself is never saved as a reply
+    return _sse('error', {'message': str(error), 'retry_after': error.retry_after})
+
+
+def _stream_events(turn, timer):
+    chunks = []
+    saved = False
+    error = None
+    try:
+        yield _sse('start', {'conversation_id': turn.conversation.id})
+        try:
+            # Includes the time the client took to read the stream
+            with timer.phase('upstream'):
+                for delta in DeepSeekService.stream_message(turn.message_history, fresh=turn.fresh):
+                    chunks.append(delta)
+                    yield _sse('token', {'delta': delta})
+        except AIServiceError as e:
+            error = e
+            yield _error_event(e)
+            return
+        
+        with timer.phase('db_write'):
+            save_reply(turn, ''.join(chunks))
+        saved = True
+        yield _sse('done', {'conversation_id': turn.conversation.id})
+    finally:
+        if not saved:
+            with timer.phase('db_write'):
+                _abandon_turn(turn, chunks)
+        _log_stream_turn(timer, turn, chunks, saved, error)
+
+
+async def _astream_events(turn, timer):
+    chunks = []
+    saved = False
+    error = None
+    try:
+        yield _sse('start', {'conversation_id': turn.conversation.id})
+        try:
+            with timer.phase('upstream'):
+                async for delta in DeepSeekService.astream_message(turn.message_history, fresh=turn.fresh):
+                    chunks.append(delta)
+                    yield _sse('token', {'delta': delta})
+        except AIServiceError as e:
+            error = e
+            yield _error_event(e)
+            return
+        
+        with timer.phase('db_write'):
+            await _asave_reply(turn, ''.join(chunks))
+        saved = True
+        yield _sse('done', {'conversation_id': turn.conversation.id})
+    finally:
+        # Client disconnected (task cancelled): shielded so the save
+        # finishes even though the request is being torn down
+        if not saved:
+            with timer.phase('db_write'):
+                await asyncio.shield(sync_to_async(_abandon_turn)(turn, chunks))
+        _log_stream_turn(timer, turn, chunks, saved, error)
+
+
+def _log_stream_turn(timer, turn, chunks, saved, error):
+    if saved:
+        outcome = 'ok'
+    elif error is not None:
+        outcome = 'upstream_error'
+    else:  # The client went away
+        outcome = 'abandoned'
+    timer.log(turn, outcome, error=error, reply_chars=sum(len(chunk) for chunk in chunks), streamed=True)
+
+@login_required
+@require_http_methods(["GET"])
+def response_cache_stats(request):
+    """Hit/miss/eviction counters of the response cache (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'status': 'error', 'message': 'Forbidden'}, status=403)
+    cache = get_response_cache()
+    return JsonResponse({
+        'status': 'success',
+        'enabled': cache is not None,
+        'stats': cache.stats() if cache else {}
+    })
+
+
+@login_required
+@require_http_methods(["GET"])
+def upstream_stats(request):
+    """Hedge, fallback and latency numbers and circuit states for the OpenRouter calls (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'status': 'error', 'message': 'Forbidden'}, status=403)
+    return JsonResponse({
+        'status': 'success',
+        'stats': get_upstream_stats().stats(),
+        'circuits': circuit_states()
+    })
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Prometheus metrics of every worker process, in the text exposition format"""
+    token = settings.CHAT_METRICS_TOKEN
+    # Open without a token only while developing
+    if token or not settings.DEBUG:
+        if not token or not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@require_http_methods(["GET"])
+def job_status(request, job_id):
+    """Where a queued chat turn has got to: its status and the reply so far"""
+    try:
+        job = Job.objects.values('id', 'status', 'output', 'result', 'error').get(id=job_id, user=request.user)
+    except Job.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+    return JsonResponse({'status': 'success', 'job': job})
+
+
+async def job_events(request, job_id):
+    """Subscribe to a queued chat turn: its reply as Server-Sent Events (ASGI only)"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Unauthorized'})
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Streaming needs ASGI; poll /api/jobs/{job_id}/ instead'
+        }, status=400)
+    try:
+        conversation_id = await Job.objects.filter(id=job_id, user=user).values_list(
+            'payload__conversation_id', flat=True).aget()
+    except Job.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+    return _event_stream_response(_ajob_events(job_id, conversation_id))
+
+
 @csrf_exempt
 def get_messages(request):
     """
-    API endpoint to get all messages for the current user's conversation
+    API endpoint to get a page of messages for the current user's conversation.
+    Newest page by default; ?before=/?after= cursors and ?limit= page through it.
     """
     if request.user.is_authenticated:
         try:
@@ -103,25 +485,19 @@ def get_messages(request):
                 conversation = Conversation.objects.get(id=conversation_id, user=request.user, is_active=True)
             else:
                 # Get most recent conversation
-                conversation = Conversation.objects.filter(user=request.user, is_active=True).order_by('-updated_at').first()
+                conversation = Conversation.objects.active_for(request.user).first()
                 if not conversation:
                     return JsonResponse({'status': 'success', 'messages': []})
             
-            messages = Message.objects.filter(conversation=conversation).order_by('timestamp')
+            page = message_page(conversation.id, request.GET.get('before'), request.GET.get('after'),
+                                request.GET.get('limit'))
             
-            messages_data = [
-                {
-                    'role': msg.role, 
-                    'content': msg.content, 
-                    'timestamp': msg.timestamp.isoformat()
-                }
-                for msg in messages
-            ]
-            
-            return JsonResponse({'status': 'success', 'messages': messages_data, 'conversation_id': conversation.id})
+            return JsonResponse({'status': 'success', **page.to_json(), 'conversation_id': conversation.id})
             
         except Conversation.DoesNotExist:
             return JsonResponse({'status': 'error', 'message': 'Conversation not found'})
+        except PaginationError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
     
     return JsonResponse({'status': 'error', 'message': 'Unauthorized'})
 
@@ -145,10 +521,9 @@ def get_time_display(dt):
 @require_http_methods(["GET"])
 def conversation_history(request):
     """Get all conversations for the current user, grouped by date"""
-    conversations = Conversation.objects.filter(
-        user=request.user, 
-        is_active=True
-    ).prefetch_related('messages').order_by('-updated_at')
+    # One query: the counters and preview live on the conversation row
+    conversations = Conversation.objects.active_for(request.user).values(
+        'id', 'title', 'preview_text', 'message_count', 'updated_at')
     
     # Get current date info
     today = timezone.now().date()
@@ -165,16 +540,16 @@ def conversation_history(request):
     
     for conv in conversations:
         conv_data = {
-            'id': conv.id,
-            'title': conv.title,
-            'preview': conv.preview_text,
-            'message_count': conv.message_count,
-            'last_updated': conv.updated_at.isoformat(),
-            'time_display': get_time_display(conv.updated_at)
+            'id': conv['id'],
+            'title': conv['title'],
+            'preview': conv['preview_text'] or EMPTY_PREVIEW,
+            'message_count': conv['message_count'],
+            'last_updated': conv['updated_at'].isoformat(),
+            'time_display': get_time_display(conv['updated_at'])
         }
         
         # Categorize by date
-        conv_date = conv.updated_at.date()
+        conv_date = conv['updated_at'].date()
         if conv_date == today:
             history_data['today'].append(conv_data)
         elif conv_date == yesterday:
@@ -186,32 +561,90 @@ def conversation_history(request):
     
     return JsonResponse({'conversations': history_data})
 
+@login_required
+@require_http_methods(["GET"])
+def search_conversations(request):
+    """
+    Full-text search over the user's messages: ?q= the words to find, with
+    ?page= and ?limit= to page through the results, best match first
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        number = page_number(request.GET.get('page'))
+        size = page_size(request.GET.get('limit'))
+    except PaginationError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+
+    # One row more than the page tells us if there's another
+    hits = search_messages(request.user.id, query, size + 1, (number - 1) * size)
+    return JsonResponse({
+        'status': 'success',
+        'query': query,
+        'results': [
+            {
+                'message_id': hit.id,
+                'conversation_id': hit.conversation_id,
+                'conversation_title': hit.conversation_title,
+                'role': hit.role,
+                'snippet': highlight(hit.snippet),
+                'timestamp': hit.timestamp.isoformat(),
+            }
+            for hit in hits[:size]
+        ],
+        'page': number,
+        'has_more': len(hits) > size,
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def export_conversations(request):
+    """
+    Download all the user's conversations and messages as NDJSON, streamed.
+    ?since= (ISO 8601) exports only what changed from then on; ?format=gzip
+    compresses it
+    """
+    try:
+        since = parse_since(request.GET['since']) if request.GET.get('since') else None
+    except ValueError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+    compress = request.GET.get('format') == 'gzip'
+
+    stream = aexport_stream if isinstance(request, ASGIRequest) else export_stream
+    response = StreamingHttpResponse(stream(request.user.id, since, compress),
+                                     content_type='application/gzip' if compress else 'application/x-ndjson')
+    filename = f"conversations-{request.user.username}.ndjson" + ('.gz' if compress else '')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'  # Let nginx pass on the client's pace
+    return response
+
 @login_required
 @require_http_methods(["GET"])
 def get_conversation(request, conversation_id):
-    """Load a specific conversation with all its messages"""
+    """
+    Load a specific conversation with a page of its messages (the newest
+    by default; see get_messages for the paging parameters)
+    """
     try:
-        conversation = Conversation.objects.get(
+        conversation = Conversation.objects.only('id', 'title').get(
             id=conversation_id, 
             user=request.user, 
             is_active=True
         )
-        messages = conversation.messages.all()
-        
-        messages_data = []
-        for msg in messages:
-            messages_data.append({
-                'role': msg.role,
-                'content': msg.content,
-                'timestamp': msg.timestamp.isoformat()
-            })
+        page = message_page(conversation.id, request.GET.get('before'), request.GET.get('after'),
+                            request.GET.get('limit'))
         
         return JsonResponse({
             'status': 'success',
             'conversation': {
                 'id': conversation.id,
                 'title': conversation.title,
-                'messages': messages_data
+                **page.to_json()
             }
         })
     except Conversation.DoesNotExist:
@@ -219,6 +652,11 @@ def get_conversation(request, conversation_id):
             'status': 'error', 
             'message': 'Conversation not found'
         }, status=404)
+    except PaginationError as e:
+        return JsonResponse({
+            'status': 'error', 
+            'message': str(e)
+        }, status=400)
 
 @login_required
 @csrf_exempt
@@ -233,7 +671,7 @@ def create_conversation(request):
             'conversation': {
                 'id': conversation.id,
                 'title': conversation.title,
-                'preview': conversation.preview_text,
+                'preview': conversation.preview,
                 'message_count': conversation.message_count,
                 'last_updated': conversation.updated_at.isoformat(),
                 'time_display': get_time_display(conversation.updated_at)
@@ -256,7 +694,7 @@ def delete_conversation(request, conversation_id):
             user=request.user
         )
         conversation.is_active = False
-        conversation.save()
+        conversation.save(update_fields=['is_active', 'updated_at'])
         
         return JsonResponse({'status': 'success'})
     except Conversation.DoesNotExist:
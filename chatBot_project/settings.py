@@ -35,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chatBot.middleware.MetricsMiddleware',  # First, so it times everything after it
+    'chatBot.middleware.RequestIdMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -42,6 +44,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'chatBot.middleware.ProfilingMiddleware',  # After authentication: staff can ask for a profile
 ]
 
 ROOT_URLCONF = 'chatBot_project.urls'    #  PROJECT NAME
@@ -107,6 +110,155 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # DeepSeek API Configuration
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 
+# OpenRouter HTTP client (one pooled keep-alive session per process)
+OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+OPENROUTER_POOL_SIZE = int(os.getenv('OPENROUTER_POOL_SIZE', '20'))  # Max open connections, size it to your worker threads
+OPENROUTER_ASYNC_POOL_SIZE = int(os.getenv('OPENROUTER_ASYNC_POOL_SIZE', '200'))  # Max open connections per ASGI event loop
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv('OPENROUTER_CONNECT_TIMEOUT', '5'))  # Seconds to open a connection
+OPENROUTER_READ_TIMEOUT = float(os.getenv('OPENROUTER_READ_TIMEOUT', '30'))  # Seconds to wait for the response
+
+# Models tried in order: the next one is asked when a model's request fails
+CHAT_MODELS = [model.strip() for model in os.getenv('CHAT_MODELS', 'deepseek/deepseek-chat').split(',') if model.strip()]
+
+# Hedged requests: a completion slower than the model's recent p95 gets a
+# second, identical request and the first answer wins (see chatBot/hedging.py)
+CHAT_HEDGE_ENABLED = os.getenv('CHAT_HEDGE_ENABLED', 'False') == 'True'
+CHAT_HEDGE_QUANTILE = float(os.getenv('CHAT_HEDGE_QUANTILE', '0.95'))  # Latency quantile to hedge after
+CHAT_HEDGE_MIN_SAMPLES = int(os.getenv('CHAT_HEDGE_MIN_SAMPLES', '20'))  # Latencies needed before the quantile is used
+CHAT_HEDGE_DELAY = float(os.getenv('CHAT_HEDGE_DELAY', '10'))  # Seconds to hedge after until then
+CHAT_HEDGE_MIN_DELAY = float(os.getenv('CHAT_HEDGE_MIN_DELAY', '1'))  # Never hedge sooner than this
+
+# Circuit breaker per model, kept in a Django cache so every worker process
+# shares it (use a shared backend in production), and retries with backoff
+# (see chatBot/resilience.py)
+CHAT_BREAKER_ALIAS = os.getenv('CHAT_BREAKER_ALIAS', 'default')  # CACHES entry holding circuit state
+CHAT_BREAKER_THRESHOLD = int(os.getenv('CHAT_BREAKER_THRESHOLD', '5'))  # Failures in a row that open the circuit
+CHAT_BREAKER_WINDOW = int(os.getenv('CHAT_BREAKER_WINDOW', '60'))  # Seconds those failures must fall within
+CHAT_BREAKER_COOLDOWN = int(os.getenv('CHAT_BREAKER_COOLDOWN', '30'))  # Seconds open before a probe request
+CHAT_RETRY_ATTEMPTS = int(os.getenv('CHAT_RETRY_ATTEMPTS', '2'))  # Retries per model after a retryable failure
+CHAT_RETRY_BASE_DELAY = float(os.getenv('CHAT_RETRY_BASE_DELAY', '0.5'))  # Backoff ceiling before the first retry
+CHAT_RETRY_MAX_DELAY = float(os.getenv('CHAT_RETRY_MAX_DELAY', '8'))  # Longest wait, Retry-After included
+
+# Chat context: history sent per turn is trimmed to fit this many tokens
+CHAT_CONTEXT_TOKENS = int(os.getenv('CHAT_CONTEXT_TOKENS', '16000'))  # Prompt + reply budget per request
+CHAT_MAX_TOKENS = int(os.getenv('CHAT_MAX_TOKENS', '2048'))  # Reserved for the reply (max_tokens)
+
+# Rolling summary: turns older than the live window are folded into a stored
+# summary by a background thread and sent in place of the raw messages
+CHAT_SUMMARY_ENABLED = os.getenv('CHAT_SUMMARY_ENABLED', 'True') == 'True'
+CHAT_SUMMARY_WINDOW_TOKENS = int(os.getenv('CHAT_SUMMARY_WINDOW_TOKENS', '4000'))  # Newest turns always sent verbatim
+CHAT_SUMMARY_MIN_TOKENS = int(os.getenv('CHAT_SUMMARY_MIN_TOKENS', '1000'))  # Wait for this much before summarizing
+CHAT_SUMMARY_CHUNK_TOKENS = int(os.getenv('CHAT_SUMMARY_CHUNK_TOKENS', '6000'))  # Old turns folded per API call
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_SUMMARY_MAX_TOKENS', '512'))  # Length of the summary itself
+
+# Vector memory: older messages similar to the newest one are recalled into context
+CHAT_MEMORY_ENABLED = os.getenv('CHAT_MEMORY_ENABLED', 'True') == 'True'
+CHAT_MEMORY_DIR = os.getenv('CHAT_MEMORY_DIR', BASE_DIR / 'memory_index')  # One vector file per user
+CHAT_MEMORY_EMBEDDER = os.getenv('CHAT_MEMORY_EMBEDDER', 'chatBot.memory.HashingEmbedder')
+CHAT_MEMORY_DIM = int(os.getenv('CHAT_MEMORY_DIM', '64'))  # HashingEmbedder vector size
+CHAT_MEMORY_TOP_K = int(os.getenv('CHAT_MEMORY_TOP_K', '4'))  # Messages recalled per turn
+CHAT_MEMORY_MIN_SCORE = float(os.getenv('CHAT_MEMORY_MIN_SCORE', '0.3'))  # Cosine similarity cut-off
+CHAT_MEMORY_TOKENS = int(os.getenv('CHAT_MEMORY_TOKENS', '1000'))  # Budget kept for recalled messages
+
+# Message history pages (chat page and conversation APIs)
+CHAT_PAGE_SIZE = int(os.getenv('CHAT_PAGE_SIZE', '50'))  # Messages per page unless ?limit= says otherwise
+CHAT_PAGE_MAX = int(os.getenv('CHAT_PAGE_MAX', '200'))  # Largest ?limit= honoured
+
+# Response cache: identical requests with little or no history (common
+# openers like "hi") are answered without calling OpenRouter. Off by default
+CHAT_RESPONSE_CACHE = os.getenv('CHAT_RESPONSE_CACHE', '')  # '', 'local' (per process) or 'django'
+CHAT_RESPONSE_CACHE_ALIAS = os.getenv('CHAT_RESPONSE_CACHE_ALIAS', 'default')  # CACHES entry for 'django'
+CHAT_RESPONSE_CACHE_SIZE = int(os.getenv('CHAT_RESPONSE_CACHE_SIZE', '1000'))  # Entries kept by 'local'
+CHAT_RESPONSE_CACHE_TTL = int(os.getenv('CHAT_RESPONSE_CACHE_TTL', '3600'))  # Seconds a reply stays fresh
+CHAT_RESPONSE_CACHE_MAX_MESSAGES = int(os.getenv('CHAT_RESPONSE_CACHE_MAX_MESSAGES', '1'))  # Longer histories skip it
+
+# Per-user limits on the chat endpoints, kept in a Django cache so they hold
+# across processes; outside DEBUG that cache (and the circuit breakers') must
+# be one every process shares, such as Redis (see chatBot/ratelimit.py)
+CHAT_RATE_LIMIT_ENABLED = os.getenv('CHAT_RATE_LIMIT_ENABLED', 'True') == 'True'
+CHAT_RATE_LIMIT_ALIAS = os.getenv('CHAT_RATE_LIMIT_ALIAS', 'default')  # CACHES entry holding the counters
+CHAT_RATE_LIMIT_PER_MINUTE = int(os.getenv('CHAT_RATE_LIMIT_PER_MINUTE', '20'))  # Sustained chat requests
+CHAT_RATE_LIMIT_BURST = int(os.getenv('CHAT_RATE_LIMIT_BURST', '10'))  # Requests allowed back to back
+CHAT_RATE_LIMIT_CONCURRENT = int(os.getenv('CHAT_RATE_LIMIT_CONCURRENT', '3'))  # Generations in flight per user
+CHAT_RATE_LIMIT_SLOT_TIMEOUT = int(os.getenv('CHAT_RATE_LIMIT_SLOT_TIMEOUT', '300'))  # Seconds before a lost slot frees
+CHAT_RATE_LIMIT_SLOT_RETRY = int(os.getenv('CHAT_RATE_LIMIT_SLOT_RETRY', '2'))  # Retry-After when at the cap
+CHAT_RATE_LIMIT_TOKENS_PER_MINUTE = int(os.getenv('CHAT_RATE_LIMIT_TOKENS_PER_MINUTE', '100000'))  # Prompt + reply
+
+# Idempotency keys: a retried chat request gets the original's result
+CHAT_IDEMPOTENCY_WINDOW = int(os.getenv('CHAT_IDEMPOTENCY_WINDOW', '86400'))  # Seconds a result can be replayed
+CHAT_IDEMPOTENCY_WAIT = int(os.getenv('CHAT_IDEMPOTENCY_WAIT', '60'))  # Longest a duplicate waits for the original
+
+# Job queue: with it on, chat turns run in `manage.py run_worker` instead of
+# the web request (see chatBot/jobs.py). Off by default
+CHAT_QUEUE_ENABLED = os.getenv('CHAT_QUEUE_ENABLED', 'False') == 'True'
+CHAT_QUEUE_MAX_DEPTH = int(os.getenv('CHAT_QUEUE_MAX_DEPTH', '500'))  # Queued jobs before new chats get a 503
+CHAT_QUEUE_RETRY_AFTER = int(os.getenv('CHAT_QUEUE_RETRY_AFTER', '5'))  # Retry-After seconds sent with that 503
+CHAT_QUEUE_WORKER_THREADS = int(os.getenv('CHAT_QUEUE_WORKER_THREADS', '8'))  # Jobs one worker runs at once
+CHAT_QUEUE_POLL_INTERVAL = float(os.getenv('CHAT_QUEUE_POLL_INTERVAL', '0.5'))  # Seconds between checks for new jobs
+CHAT_QUEUE_FLUSH_INTERVAL = float(os.getenv('CHAT_QUEUE_FLUSH_INTERVAL', '0.25'))  # Seconds between partial reply writes
+CHAT_QUEUE_JOB_TIMEOUT = int(os.getenv('CHAT_QUEUE_JOB_TIMEOUT', '120'))  # Silent this long, a running job is requeued
+CHAT_QUEUE_MAX_ATTEMPTS = int(os.getenv('CHAT_QUEUE_MAX_ATTEMPTS', '3'))  # Tries before a job is marked failed
+CHAT_QUEUE_WAIT_TIMEOUT = float(os.getenv('CHAT_QUEUE_WAIT_TIMEOUT', '300'))  # Seconds an SSE client follows a job
+
+# Prometheus metrics at /metrics (see chatBot/metrics.py)
+CHAT_METRICS_ENABLED = os.getenv('CHAT_METRICS_ENABLED', 'True') == 'True'
+CHAT_METRICS_DIR = os.getenv('CHAT_METRICS_DIR', BASE_DIR / 'metrics')  # One file per process; '' for per-process only
+CHAT_METRICS_FLUSH_INTERVAL = float(os.getenv('CHAT_METRICS_FLUSH_INTERVAL', '10'))  # Seconds between writes
+CHAT_METRICS_TOKEN = os.getenv('CHAT_METRICS_TOKEN', '')  # Bearer token the scraper must send; '' for none, DEBUG only
+
+# Logging: the chatBot loggers write JSON lines to stdout from a background
+# thread, so a slow log collector never holds up a request (see chatBot/logs.py)
+CHAT_LOG_LEVEL = os.getenv('CHAT_LOG_LEVEL', 'INFO')
+CHAT_LOG_QUEUE_SIZE = int(os.getenv('CHAT_LOG_QUEUE_SIZE', '10000'))  # Records waiting to be written; more are dropped
+# Share of a busy event's records kept, as "event=rate,...", e.g. "upstream.request=0.1"
+CHAT_LOG_SAMPLE_RATES = {
+    event.strip(): float(rate)
+    for event, _, rate in (item.partition('=') for item in os.getenv('CHAT_LOG_SAMPLE_RATES', '').split(','))
+    if event.strip()
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {'()': 'chatBot.logs.SampleFilter'},
+        'request_id': {'()': 'chatBot.logs.RequestIdFilter'},
+    },
+    'handlers': {
+        'queue': {
+            'class': 'chatBot.logs.QueueJsonHandler',
+            'queue_size': CHAT_LOG_QUEUE_SIZE,
+            'filters': ['sample', 'request_id'],
+        },
+    },
+    'loggers': {
+        'chatBot': {'handlers': ['queue'], 'level': CHAT_LOG_LEVEL, 'propagate': False},
+    },
+}
+
+# Request profiles, kept in the admin (see chatBot/profiling.py): a random
+# share of requests, and any a staff user sends with an X-Profile header
+CHAT_PROFILE_ENABLED = os.getenv('CHAT_PROFILE_ENABLED', 'True') == 'True'
+CHAT_PROFILE_SAMPLE_RATE = float(os.getenv('CHAT_PROFILE_SAMPLE_RATE', '0'))  # 0 for only the ones asked for
+CHAT_PROFILE_KEEP = int(os.getenv('CHAT_PROFILE_KEEP', '500'))  # Newest profiles kept
+CHAT_PROFILE_STACKS = os.getenv('CHAT_PROFILE_STACKS', 'False') == 'True'  # Stack samples in sampled profiles too
+CHAT_PROFILE_STACK_INTERVAL = float(os.getenv('CHAT_PROFILE_STACK_INTERVAL', '0.005'))  # Seconds between samples
+
+# Retention: how long deleted and finished rows are kept before `manage.py
+# purge` deletes them, in batches (see chatBot/purge.py)
+CHAT_RETENTION_DELETED_DAYS = int(os.getenv('CHAT_RETENTION_DELETED_DAYS', '30'))  # Soft-deleted conversations
+CHAT_RETENTION_JOB_DAYS = int(os.getenv('CHAT_RETENTION_JOB_DAYS', '7'))  # Done and failed jobs
+CHAT_PURGE_BATCH_SIZE = int(os.getenv('CHAT_PURGE_BATCH_SIZE', '1000'))  # Rows deleted per transaction
+CHAT_PURGE_PAUSE = float(os.getenv('CHAT_PURGE_PAUSE', '0.1'))  # Seconds between batches
+
+# Exports (/api/export/ and `manage.py export_conversations`), streamed in
+# constant memory (see chatBot/export.py)
+CHAT_EXPORT_BATCH_SIZE = int(os.getenv('CHAT_EXPORT_BATCH_SIZE', '2000'))  # Rows fetched from the database at a time
+CHAT_EXPORT_CHUNK_BYTES = int(os.getenv('CHAT_EXPORT_CHUNK_BYTES', '65536'))  # Bytes per chunk written to the client
+
+# Keeps log lines and metrics files out of test runs (see chatBot/test_runner.py)
+TEST_RUNNER = 'chatBot.test_runner.ChatTestRunner'
+
 # Authentication settings
 LOGIN_URL = 'login'  # Where to go if not logged in
 LOGIN_REDIRECT_URL = '/'  # Redirect to homepage after login
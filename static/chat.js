@@ -10,6 +10,13 @@ document.addEventListener('DOMContentLoaded', function() {
     let currentConversationId = null; // Track current conversation
     let currentLoadingElement = null; // Track the current loading indicator
     
+    // Only the newest page of messages is loaded; older pages are fetched on scroll up
+    const olderPages = {
+        conversationId: chatMessages ? chatMessages.dataset.conversationId : null,
+        before: chatMessages ? chatMessages.dataset.before : null, // Cursor, empty when there's nothing older
+        loading: false
+    };
+    
     // ENABLE ALL INPUTS ON PAGE LOAD
     enableAllInputs();
     
@@ -26,6 +33,11 @@ document.addEventListener('DOMContentLoaded', function() {
     
     if (pasteBtn) pasteBtn.addEventListener('click', handlePaste);
     if (sendBtn) sendBtn.addEventListener('click', sendMessage);
+    if (chatMessages) {
+        chatMessages.addEventListener('scroll', () => {
+            if (chatMessages.scrollTop < 100) loadOlderMessages();
+        });
+    }
     
     // ===== SIDEBAR FUNCTIONALITY =====
     class SidebarManager {
@@ -300,10 +312,12 @@ document.addEventListener('DOMContentLoaded', function() {
             // Clear current chat
             chatMessages.innerHTML = '';
             
-            // Add messages from conversation
+            // Add messages from conversation (its newest page)
             conversation.messages.forEach(message => {
-                addMessage(message.role, message.content);
+                addMessage(message.role, message.content, message.timestamp);
             });
+            olderPages.conversationId = conversation.id;
+            olderPages.before = conversation.before;
             
             // Scroll to bottom
             scrollToBottom();
@@ -365,6 +379,8 @@ document.addEventListener('DOMContentLoaded', function() {
             // Clear active conversation
             this.setActiveConversation(null);
             currentConversationId = null;
+            olderPages.conversationId = null;
+            olderPages.before = null;
             
             // Clear current chat
             clearCurrentChat();
@@ -518,34 +534,74 @@ document.addEventListener('DOMContentLoaded', function() {
                 requestBody.conversation_id = currentConversationId;
             }
             
-            const response = await fetch('/send_message/', {
+            // One key per message: retries reuse it, so the server answers
+            // them from the first attempt instead of calling the AI again
+            const response = await fetchWithRetry('/send_message/stream/', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
-                    'X-CSRFToken': getCsrfToken()
+                    'X-CSRFToken': getCsrfToken(),
+                    'Idempotency-Key': newIdempotencyKey()
                 },
                 body: JSON.stringify(requestBody)
             });
             
-            const data = await response.json();
-            
-            // Hide loading and add AI response
-            hideAILoading();
-            
-            if (data.status === 'success') {
-                addMessage('assistant', data.ai_response);
-                
+            // Show the reply token by token as it streams in
+            let streamingMessage = null;
+            let reply = '';
+            let replyError = null;
+            const showReply = text => {
+                if (!streamingMessage) {
+                    hideAILoading();
+                    streamingMessage = addStreamingMessage();
+                }
+                reply = text;
+                streamingMessage.textContent = reply;
+                smartScrollToBottom();
+            };
+            const setConversation = conversationId => {
                 // Update current conversation ID if this is a new conversation
-                if (data.conversation_id && !currentConversationId) {
-                    currentConversationId = data.conversation_id;
+                if (conversationId && !currentConversationId) {
+                    currentConversationId = conversationId;
                     
                     // Refresh sidebar to show new conversation
                     if (sidebarManager) {
                         sidebarManager.loadConversationHistory();
                     }
                 }
+            };
+            
+            // Validation errors come back as plain JSON, not as a stream;
+            // so does a turn handed to the job queue, which we poll
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!contentType.startsWith('text/event-stream')) {
+                const data = await response.json();
+                if (data.status !== 'queued') {
+                    hideAILoading();
+                    addMessage('assistant', `Error: ${data.message || 'Failed to get response'}`);
+                    return;
+                }
+                setConversation(data.conversation_id);
+                replyError = await pollJob(data.job_id, showReply);
             } else {
-                addMessage('assistant', `Error: ${data.message || 'Failed to get response'}`);
+                await readEventStream(response, (event, data) => {
+                    if (event === 'start') {
+                        setConversation(data.conversation_id);
+                    } else if (event === 'token') {
+                        showReply(reply + data.delta);
+                    } else if (event === 'error') {
+                        // The AI service failed; this text is not part of the reply
+                        replyError = data.message;
+                    }
+                });
+            }
+            
+            hideAILoading();
+            if (streamingMessage) {
+                streamingMessage.closest('.message-content').appendChild(createMessageFooter(reply));
+            }
+            if (replyError || !streamingMessage) {
+                addMessage('assistant', `Error: ${replyError || 'Failed to get response'}`);
             }
             
         } catch (error) {
@@ -557,12 +613,153 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    function addMessage(role, content) {
+    // Poll a queued chat job until it finishes, passing the reply so far to
+    // onText. Returns the job's error message if it failed, otherwise null
+    async function pollJob(jobId, onText) {
+        while (true) {
+            const response = await fetchWithRetry(`/api/jobs/${jobId}/`, {});
+            const data = await response.json();
+            if (data.status !== 'success') {
+                throw new Error(data.message || 'Failed to get job');
+            }
+            const job = data.job;
+            if (job.status === 'done') {
+                onText(job.result.ai_response);
+                return null;
+            }
+            if (job.status === 'failed') {
+                if (job.output) {
+                    onText(job.output);
+                }
+                return job.error || 'Failed to get response';
+            }
+            if (job.output) {
+                onText(job.output);
+            }
+            await new Promise(resolve => setTimeout(resolve, 500));
+        }
+    }
+    
+    function newIdempotencyKey() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+    
+    // fetch() that retries when the request never got an answer (flaky
+    // mobile networks); safe because the request carries an idempotency key
+    async function fetchWithRetry(url, options, retries = 2) {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                return await fetch(url, options);
+            } catch (error) {
+                if (attempt >= retries) throw error;
+                await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+            }
+        }
+    }
+    
+    // Read a text/event-stream response, calling onEvent(event, data) per event
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let event = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                
+                if (data) onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+    
+    // Add an empty assistant message and return its text element to fill in
+    function addStreamingMessage() {
+        const emptyState = chatMessages.querySelector('.empty-chat');
+        if (emptyState) emptyState.remove();
+        
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message assistant-message';
+        
+        const messageContent = document.createElement('div');
+        messageContent.className = 'message-content';
+        
+        const strong = document.createElement('strong');
+        strong.textContent = 'AI: ';
+        
+        const messageText = document.createElement('div');
+        messageText.className = 'message-text';
+        
+        messageContent.appendChild(strong);
+        messageContent.appendChild(messageText);
+        messageDiv.appendChild(messageContent);
+        chatMessages.appendChild(messageDiv);
+        
+        return messageText;
+    }
+    
+    // Fetch the page before the oldest message shown and put it on top
+    async function loadOlderMessages() {
+        if (olderPages.loading || !olderPages.before || !olderPages.conversationId) return;
+        olderPages.loading = true;
+        const conversationId = olderPages.conversationId;
+        
+        try {
+            const params = new URLSearchParams({ before: olderPages.before });
+            const response = await fetch(`/api/conversations/${conversationId}/?${params}`);
+            if (!response.ok) return;
+            
+            const data = await response.json();
+            // The user may have switched conversations meanwhile
+            if (olderPages.conversationId !== conversationId) return;
+            
+            const fragment = document.createDocumentFragment();
+            data.conversation.messages.forEach(message => {
+                fragment.appendChild(createMessageElement(message.role, message.content, message.timestamp));
+            });
+            
+            // Keep what the user is looking at in place as content grows above it
+            const previousHeight = chatMessages.scrollHeight;
+            chatMessages.insertBefore(fragment, chatMessages.firstChild);
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+            
+            olderPages.before = data.conversation.before;
+        } catch (error) {
+            console.error('Failed to load older messages:', error);
+        } finally {
+            olderPages.loading = false;
+        }
+    }
+    
+    function addMessage(role, content, timestamp) {
         if (!chatMessages) return;
         
         const emptyState = chatMessages.querySelector('.empty-chat');
         if (emptyState) emptyState.remove();
         
+        // ALWAYS ADD NEW MESSAGES TO THE BOTTOM
+        chatMessages.appendChild(createMessageElement(role, content, timestamp));
+        
+        // Smart scroll for new messages only
+        smartScrollToBottom();
+    }
+    
+    function createMessageElement(role, content, timestamp) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${role === 'user' ? 'user-message' : 'assistant-message'}`;
         
@@ -580,16 +777,11 @@ document.addEventListener('DOMContentLoaded', function() {
         messageContent.appendChild(messageText);
         
         if (role === 'assistant') {
-            messageContent.appendChild(createMessageFooter(content));
+            messageContent.appendChild(createMessageFooter(content, timestamp));
         }
         
         messageDiv.appendChild(messageContent);
-        
-        // ALWAYS ADD NEW MESSAGES TO THE BOTTOM
-        chatMessages.appendChild(messageDiv);
-        
-        // Smart scroll for new messages only
-        smartScrollToBottom();
+        return messageDiv;
     }
 
     // dynamically create and insert loading indicator
@@ -623,13 +815,13 @@ document.addEventListener('DOMContentLoaded', function() {
         return loadingDiv;
     }
     
-    function createMessageFooter(content) {
+    function createMessageFooter(content, sentAt) {
         const messageFooter = document.createElement('div');
         messageFooter.className = 'message-footer';
         
         const timestamp = document.createElement('div');
         timestamp.className = 'message-timestamp';
-        timestamp.textContent = formatTimestamp(new Date());
+        timestamp.textContent = formatTimestamp(sentAt ? new Date(sentAt) : new Date());
         messageFooter.appendChild(timestamp);
         
         const reactionButtons = document.createElement('div');
@@ -1,25 +1,28 @@
 import os
 import sys
 
+# The test modules sit next to this file
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
 def run_all_tests():
     """Run all test files"""
     print(" RUNNING ALL TESTS")
     print("=" * 50)
     
     tests = [
-        ('OpenRouter API', 'test_openrouter'),
-        ('Database Models', 'test_database'),
-        ('Services', 'test_services')
+        ('OpenRouter API', 'test_openrouter', 'test_openrouter_connection'),
+        ('Database Models', 'test_database', 'test_database_models'),
+        ('Services', 'test_services', 'test_services')
     ]
     
     results = []
     
-    for test_name, test_file in tests:
+    for test_name, test_file, test_function in tests:
         print(f"\nRunning {test_name} Test...")
         try:
             # Import and run the test
             module = __import__(test_file)
-            success = module.test_connection() if test_file == 'test_openrouter' else module.test_database_models() if test_file == 'test_database' else module.test_services()
+            success = getattr(module, test_function)()
             results.append((test_name, success))
             print(f"{test_name}: {'PASS' if success else 'FAIL'}")
         except Exception as e:
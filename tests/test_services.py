@@ -8,7 +8,7 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatBot_project.settings')
 django.setup()
 
-from chatBot_app.services import DeepSeekService
+from chatBot.services import DeepSeekService
 
 def test_services():
     """Test the DeepSeekService class"""
@@ -16,7 +16,7 @@ def test_services():
     
     try:
         # Test message history formatting
-        from chatBot_app.models import Conversation, Message, User
+        from chatBot.models import Conversation, Message, User
         
         # Create test data
         user = User.objects.create_user('service_test_user', 'service@test.com', 'testpass')